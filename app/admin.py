@@ -1,9 +1,18 @@
 from django.contrib import admin
-from .models import Profile, Account, Bank, Card, Transaction, PaymentMethod
+from .models import Profile, Account, Bank, Card, Transaction, PaymentMethod, SpendingSummary, \
+    LedgerEntry, BalanceSnapshot, Counterparty, IdempotencyKey, ScheduledPayment, Job, Notification
 
 admin.site.register(Profile)
 admin.site.register(Account)
 admin.site.register(Bank)
 admin.site.register(Card)
 admin.site.register(Transaction)
-admin.site.register(PaymentMethod)
\ No newline at end of file
+admin.site.register(PaymentMethod)
+admin.site.register(SpendingSummary)
+admin.site.register(LedgerEntry)
+admin.site.register(BalanceSnapshot)
+admin.site.register(Counterparty)
+admin.site.register(IdempotencyKey)
+admin.site.register(ScheduledPayment)
+admin.site.register(Job)
+admin.site.register(Notification)
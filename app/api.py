@@ -0,0 +1,435 @@
+import json
+import math
+
+from django.contrib.auth import login, logout
+from django.contrib.auth.forms import AuthenticationForm
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.shortcuts import get_object_or_404
+from django.views import View
+
+from app import events, ledger, notifications, registration, scheduler, search, wallet
+from app.form import CompletePaymentForm, RequestMoneyForm, SendMoneyForm
+from app.idempotency import IdempotentMixin
+from app.ledger import TransferError
+from app.models import PaymentMethod, ScheduledPayment, Transaction
+from app.utils import KeysetPaginator
+
+# JSON counterparts of the wallet pages. Clients authenticate with a session, from
+# POST api/login/, and send the CSRF token returned by GET api/ in an X-CSRFToken
+# header with every POST, like the HTML forms do. POSTs that move money or create
+# transactions also take an Idempotency-Key header, see app.idempotency.
+
+MAX_PAYOUTS = 1000
+MAX_IMPORTS = 1000
+MAX_PER_PAGE = 100
+
+
+class ApiError(Exception):
+    def __init__(self, errors, status=400):
+        super().__init__(errors)
+        self.errors = errors
+        self.status = status
+
+
+def form_errors(form):
+    return {field: [str(message) for message in messages] for field, messages in form.errors.items()}
+
+
+def transaction_json(tran, user=None):
+    data = {
+        'transaction_id': tran.transaction_id,
+        'transaction_type': tran.transaction_type,
+        'category': tran.category,
+        'amount': tran.amount,
+        'description': tran.description,
+        'create_date': tran.create_date,
+        'is_complete': tran.is_complete,
+        'creator': tran.creator.username,
+        'receiver': tran.receiver.username,
+    }
+    if user is not None:
+        data['direction'] = 'out' if tran.payer_and_payee()[0] == user.pk else 'in'
+    return data
+
+
+class ApiView(View):
+    # session authentication and permissions answered with JSON instead of redirects
+    permission_required = ()
+    login_required = True
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.login_required and not request.user.is_authenticated:
+            return JsonResponse({'errors': {'__all__': ['Authentication required.']}}, status=401)
+        if not request.user.has_perms(self.permission_required):
+            return JsonResponse({'errors': {'__all__': ['Permission denied.']}}, status=403)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as e:
+            return JsonResponse({'errors': e.errors}, status=e.status)
+
+    def http_method_not_allowed(self, request, *args, **kwargs):
+        response = JsonResponse({'errors': {'__all__': ['Method not allowed.']}}, status=405)
+        response['Allow'] = ', '.join(method.upper() for method in self._allowed_methods())
+        return response
+
+    def get_data(self):
+        try:
+            data = json.loads(self.request.body.decode() or '{}')
+        except (UnicodeDecodeError, ValueError):
+            raise ApiError({'__all__': ['The request body is not valid JSON.']})
+        if not isinstance(data, dict):
+            raise ApiError({'__all__': ['The request body must be a JSON object.']})
+        return data
+
+    def get_receivers(self, usernames):
+        # {username: user} for the receivers named in the request
+        if not all(isinstance(name, str) and name for name in usernames):
+            raise ApiError({'receiver': ['The field "Receiver" is required']})
+        receivers = User.objects.in_bulk(set(usernames), field_name='username')
+        missing = sorted(set(usernames) - set(receivers))
+        if missing:
+            raise ApiError({'receiver': ['No user found: %s.' % ', '.join(missing)]})
+        return receivers
+
+    def user_payment_methods(self, form):
+        # the form accepts only the requesting user's own payment methods
+        form.fields['payment_method'].queryset = PaymentMethod.objects.filter(user=self.request.user)
+        return form
+
+
+class ApiIdempotentView(IdempotentMixin, ApiView):
+    def is_final(self, response):
+        return response.status_code < 400
+
+    def idempotency_error(self, error):
+        return JsonResponse({'errors': {'__all__': [str(error)]}}, status=error.status)
+
+
+class ApiIndex(ApiView):
+    login_required = False
+
+    def get(self, request):
+        user = request.user
+        return JsonResponse({
+            'user': user.username if user.is_authenticated else None,
+            'csrf_token': get_token(request),
+        })
+
+
+class ApiLogin(ApiView):
+    login_required = False
+
+    def post(self, request):
+        form = AuthenticationForm(request, data=self.get_data())
+        if not form.is_valid():
+            return JsonResponse({'errors': form_errors(form)}, status=400)
+        login(request, form.get_user())
+        return JsonResponse({'user': form.get_user().username, 'csrf_token': get_token(request)})
+
+
+class ApiLogout(ApiView):
+    def post(self, request):
+        logout(request)
+        return JsonResponse({'user': None})
+
+
+class ApiBalance(ApiView):
+    permission_required = ('app.view_account',)
+
+    def get(self, request):
+        accounts = wallet.overview(request.user)['account']
+        return JsonResponse({'balance': accounts[0].balance if accounts else None})
+
+
+class ApiEvents(ApiView):
+    # Server-sent events: the wallet balance now, then a "balance" and "transaction"
+    # event for every change to it, see app.events
+    permission_required = ('app.view_account',)
+
+    def get(self, request):
+        # subscribed first, so that no change between the two is missed
+        subscription = events.subscribe(events.user_channel(request.user))
+        # the stream closes the subscription once it runs, until then it is closed here
+        try:
+            accounts = wallet.overview(request.user)['account']
+            first = [('balance', {'balance': accounts[0].balance if accounts else None})]
+            # the stream holds its thread for minutes, it need not hold a database connection
+            # too (unless a transaction is open around the request, as in tests)
+            if not connection.in_atomic_block:
+                connection.close()
+            response = StreamingHttpResponse(events.stream(subscription, first), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            # nginx would otherwise buffer the stream
+            response['X-Accel-Buffering'] = 'no'
+        except BaseException:
+            subscription.close()
+            raise
+        return response
+
+
+class ApiPaymentMethods(ApiView):
+    permission_required = ('app.view_account', 'app.view_bank', 'app.view_card')
+
+    def get(self, request):
+        overview = wallet.overview(request.user)
+        methods = [{'payment_method': account.payment_id, 'method_type': 'account', 'label': 'Wallet',
+                    'balance': account.balance} for account in overview['account']]
+        methods += [{'payment_method': bank.payment_id, 'method_type': 'bank', 'label': str(bank)}
+                    for bank in overview['bank_list']]
+        methods += [{'payment_method': card.payment_id, 'method_type': 'card', 'label': str(card)}
+                    for card in overview['card_list']]
+        return JsonResponse({'payment_methods': methods})
+
+
+class ApiSend(ApiIdempotentView):
+    permission_required = ('app.add_transaction',)
+
+    def post(self, request):
+        data = self.get_data()
+        receiver = self.get_receivers([data.get('receiver')])[data.get('receiver')]
+        form = self.user_payment_methods(SendMoneyForm(data))
+        if not form.is_valid():
+            return JsonResponse({'errors': form_errors(form)}, status=400)
+
+        tran = form.save(commit=False)
+        tran.creator = request.user
+        tran.receiver = receiver
+        try:
+            scheduler.send(tran, form.cleaned_data['repeat'])
+        except TransferError as e:
+            return JsonResponse({'errors': {'__all__': [str(e)]}}, status=400)
+        return JsonResponse({'transaction': transaction_json(tran, request.user)}, status=201)
+
+
+class ApiRequest(ApiIdempotentView):
+    permission_required = ('app.add_transaction',)
+
+    def post(self, request):
+        data = self.get_data()
+        receiver = self.get_receivers([data.get('receiver')])[data.get('receiver')]
+        form = RequestMoneyForm(data)
+        if not form.is_valid():
+            return JsonResponse({'errors': form_errors(form)}, status=400)
+
+        tran = form.save(commit=False)
+        tran.creator = request.user
+        tran.receiver = receiver
+        ledger.request_money(tran)
+        return JsonResponse({'transaction': transaction_json(tran, request.user)}, status=201)
+
+
+def notification_json(notification):
+    return {
+        'notification_id': notification.pk,
+        'kind': notification.kind,
+        'actor': notification.actor.username,
+        'amount': notification.amount,
+        'description': notification.description,
+        'transaction_id': notification.transaction_id,
+        'is_read': notification.is_read,
+        'create_date': notification.create_date,
+    }
+
+
+def schedule_json(schedule):
+    return {
+        'schedule_id': schedule.pk,
+        'receiver': schedule.receiver.username,
+        'category': schedule.category,
+        'amount': schedule.amount,
+        'description': schedule.description,
+        'interval': schedule.interval,
+        'next_run_at': schedule.next_run_at,
+        'last_error': schedule.last_error,
+    }
+
+
+class ApiScheduled(ApiView):
+    # the user's active scheduled payments; they are created by sends with a "repeat"
+    permission_required = ('app.view_transaction',)
+
+    def get(self, request):
+        schedules = ScheduledPayment.objects.filter(user=request.user, is_active=True).select_related('receiver')
+        return JsonResponse({'scheduled': [schedule_json(schedule) for schedule in schedules]})
+
+
+class ApiScheduledCancel(ApiView):
+    def post(self, request, pk):
+        schedule = get_object_or_404(ScheduledPayment.objects.select_related('receiver'), pk=pk,
+                                     user=request.user, is_active=True)
+        ScheduledPayment.objects.filter(pk=schedule.pk).update(is_active=False)
+        return JsonResponse({'scheduled': schedule_json(schedule)})
+
+
+class ApiIncompleteList(ApiView):
+    permission_required = ('app.view_transaction',)
+
+    def get(self, request):
+        transactions = Transaction.objects.for_listing().filter(is_complete=False)
+        return JsonResponse({
+            'requested': [transaction_json(tran) for tran in transactions.filter(creator=request.user)],
+            'to_pay': [transaction_json(tran) for tran in transactions.filter(receiver=request.user)],
+        })
+
+
+class ApiIncompletePay(ApiIdempotentView):
+    # paying moves money like a send; whether the user may pay this request is checked below
+    permission_required = ('app.add_transaction',)
+
+    def post(self, request, pk):
+        tran = get_object_or_404(Transaction.objects.select_related('creator', 'receiver'), pk=pk,
+                                 receiver=request.user, transaction_type='request')
+        form = self.user_payment_methods(CompletePaymentForm(self.get_data(), instance=tran))
+        if not form.is_valid():
+            return JsonResponse({'errors': form_errors(form)}, status=400)
+        try:
+            ledger.complete_payment(tran, request.user, form.cleaned_data['payment_method'])
+        except TransferError as e:
+            return JsonResponse({'errors': {'__all__': [str(e)]}}, status=409)
+        return JsonResponse({'transaction': transaction_json(tran, request.user)})
+
+
+class ApiActivity(ApiView):
+    permission_required = ('app.view_transaction',)
+
+    def get(self, request):
+        user = request.user
+        transactions = Transaction.objects.for_listing().filter(is_complete=True)
+        # the same four index-backed branches as the activity page, in one stream
+        querysets = [transactions.filter(creator=user, transaction_type='send'),
+                     transactions.filter(receiver=user, transaction_type='request'),
+                     transactions.filter(receiver=user, transaction_type='send'),
+                     transactions.filter(creator=user, transaction_type='request')]
+        try:
+            per_page = min(max(int(request.GET.get('per_page', 20)), 1), MAX_PER_PAGE)
+        except ValueError:
+            per_page = 20
+        paginator = KeysetPaginator(querysets, per_page, ('-create_date', '-transaction_id'))
+        page = paginator.page(request.GET.get('cursor'))
+        return JsonResponse({
+            'results': [transaction_json(tran, user) for tran in page],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        })
+
+
+class ApiNotifications(ApiView):
+    # the inbox, newest first, and the count behind the badge
+    def get(self, request):
+        try:
+            per_page = min(max(int(request.GET.get('per_page', 20)), 1), MAX_PER_PAGE)
+        except ValueError:
+            per_page = 20
+        paginator = KeysetPaginator([notifications.inbox(request.user)], per_page, ('-pk',))
+        page = paginator.page(request.GET.get('cursor'))
+        return JsonResponse({
+            'results': [notification_json(notification) for notification in page],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+            'unread': notifications.unread_count(request.user),
+        })
+
+
+class ApiNotificationsPoll(ApiView):
+    # Long poll: answers as soon as there are notifications after the id "after", or
+    # with none after "wait" seconds (at most notifications.MAX_WAIT). Clients ask again
+    # with the id of the last notification they got.
+    def get(self, request):
+        try:
+            after = int(request.GET.get('after', 0))
+            wait = float(request.GET.get('wait', 0))
+            # float() also reads "nan" and "inf"
+            if not math.isfinite(wait):
+                raise ValueError()
+        except ValueError:
+            raise ApiError({'__all__': ['"after" is a notification id and "wait" a number of seconds.']})
+        rows = notifications.wait_for(request.user, after, wait, MAX_PER_PAGE)
+        return JsonResponse({
+            'results': [notification_json(notification) for notification in rows],
+            'last': rows[-1].pk if rows else after,
+            'unread': notifications.unread_count(request.user),
+        })
+
+
+class ApiNotificationsRead(ApiView):
+    def post(self, request):
+        up_to = self.get_data().get('up_to')
+        if up_to is not None and not isinstance(up_to, int):
+            raise ApiError({'up_to': ['A notification id is required.']})
+        return JsonResponse({'marked': notifications.mark_read(request.user, up_to),
+                             'unread': notifications.unread_count(request.user)})
+
+
+class ApiPayouts(ApiIdempotentView):
+    # many sends from one payment method, validated up front and made in one database
+    # transaction: either every payout is made or none is
+    permission_required = ('app.add_transaction',)
+
+    def post(self, request):
+        data = self.get_data()
+        payouts = data.get('payouts')
+        if not isinstance(payouts, list) or not payouts or not all(isinstance(p, dict) for p in payouts):
+            raise ApiError({'payouts': ['A non-empty list of payouts is required.']})
+        if len(payouts) > MAX_PAYOUTS:
+            raise ApiError({'payouts': ['At most %d payouts can be made at once.' % MAX_PAYOUTS]})
+
+        source = self.user_payment_methods(CompletePaymentForm(data))
+        if not source.is_valid():
+            return JsonResponse({'errors': form_errors(source)}, status=400)
+        payment_method = source.cleaned_data['payment_method']
+
+        receivers = self.get_receivers([payout.get('receiver') for payout in payouts])
+        trans, errors = [], {}
+        for i, payout in enumerate(payouts):
+            # a payout has the fields of a money request, sent from the payment method above
+            form = RequestMoneyForm(payout)
+            if not form.is_valid():
+                errors[i] = form_errors(form)
+                continue
+            tran = form.save(commit=False)
+            tran.creator = request.user
+            tran.receiver = receivers[payout['receiver']]
+            tran.payment_method = payment_method
+            trans.append(tran)
+        if errors:
+            raise ApiError({'payouts': errors})
+
+        try:
+            ledger.send_many(trans)
+        except TransferError as e:
+            return JsonResponse({'errors': {'__all__': [str(e)]}}, status=400)
+        return JsonResponse({'transactions': [transaction_json(tran, request.user) for tran in trans]},
+                            status=201)
+
+
+class ApiUserSearch(ApiView):
+    # autocomplete for the send and request pages
+    def get(self, request):
+        users = search.search_users(request.GET.get('q', ''))
+        return JsonResponse({'users': [{'username': user.username, 'first_name': user.first_name,
+                                        'last_name': user.last_name} for user in users]})
+
+
+class ApiUserImport(ApiIdempotentView):
+    # bulk onboarding; each user has the fields of the registration form, and users that
+    # fail are reported by their position in the list without stopping the others
+    permission_required = ('auth.add_user',)
+
+    def post(self, request):
+        users = self.get_data().get('users')
+        if not isinstance(users, list) or not users or not all(isinstance(user, dict) for user in users):
+            raise ApiError({'users': ['A non-empty list of users is required.']})
+        if len(users) > MAX_IMPORTS:
+            raise ApiError({'users': ['At most %d users can be registered at once.' % MAX_IMPORTS]})
+
+        result = registration.register_many([
+            registration.Registration(i, *[user.get(field, '') for field in registration.CSV_FIELDS])
+            for i, user in enumerate(users)])
+        return JsonResponse({
+            'users': [user.username for row, user in result.created],
+            'failures': [{'index': failure.line, 'username': failure.username, 'error': failure.error}
+                         for failure in result.failures],
+        }, status=201 if result.created else 400)
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class AppConfig(AppConfig):
     name = 'app'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import signals  # noqa: F401
+        if getattr(settings, 'TEMPLATE_PRECOMPILE', False):
+            from . import template_cache
+            template_cache.precompile()
@@ -0,0 +1,11 @@
+from functools import partial
+
+from . import notifications
+
+
+def unread_notifications(request):
+    # a callable, so that only templates showing the badge look the count up
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_notifications': partial(notifications.unread_count, user.pk)}
@@ -0,0 +1,159 @@
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Max
+
+from . import jobs
+from .models import Counterparty, Transaction
+
+# Each user keeps only the people they most recently sent money to or requested money
+# from; the least recently used beyond this are dropped. Of those, the send and request
+# pages offer the most frequent ones. app.ledger counts its sends and requests in a job
+# (app.jobs), so they show once manage.py run_jobs has run it.
+MAX_COUNTERPARTIES = 20
+SHORTLIST_SIZE = 6
+SHORTLIST_TIMEOUT = 60 * 60
+# ids per query when record_queued() reads transactions and record_many() looks for
+# users over MAX_COUNTERPARTIES
+BATCH_SIZE = 200
+
+
+def _key(user_id):
+    return 'counterparties:%s' % user_id
+
+
+# the users a user deals with most, most frequent first; one cache lookup when warm
+def shortlist(user):
+    user_id = getattr(user, 'pk', user)
+    users = cache.get(_key(user_id))
+    if users is None:
+        rows = Counterparty.objects.filter(user=user_id, counterparty__is_active=True).select_related(
+            'counterparty').order_by('-count', '-last_date')[:SHORTLIST_SIZE]
+        users = [row.counterparty for row in rows]
+        cache.set(_key(user_id), users, SHORTLIST_TIMEOUT)
+    return users
+
+
+def invalidate(*users):
+    keys = [_key(getattr(user, 'pk', user)) for user in users]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _add(user_id, counterparty_id, count, last_date):
+    rows = Counterparty.objects.filter(user_id=user_id, counterparty_id=counterparty_id)
+    if rows.update(count=F('count') + count, last_date=last_date):
+        return
+    try:
+        with transaction.atomic():
+            Counterparty.objects.create(user_id=user_id, counterparty_id=counterparty_id, count=count,
+                                        last_date=last_date)
+    except IntegrityError:
+        # created concurrently since the update above
+        rows.update(count=F('count') + count, last_date=last_date)
+
+
+def _trim(user_ids):
+    # only users over the limit have rows to drop
+    user_ids = list(user_ids)
+    over = set()
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        over.update(Counterparty.objects.filter(user_id__in=user_ids[start:start + BATCH_SIZE]).values(
+            'user_id').annotate(rows=Count('pk')).filter(rows__gt=MAX_COUNTERPARTIES).order_by().values_list(
+            'user_id', flat=True))
+    for user_id in over:
+        stale = list(Counterparty.objects.filter(user_id=user_id).order_by('-last_date', '-pk').values_list(
+            'pk', flat=True)[MAX_COUNTERPARTIES:])
+        if stale:
+            Counterparty.objects.filter(pk__in=stale).delete()
+
+
+# count the receivers of transactions their creators sent or requested money from
+def record(tran):
+    record_many([tran])
+
+
+# record() the saved transactions trans in a job, once their transaction commits
+def queue(*trans):
+    jobs.enqueue(record_queued, {'transactions': [tran.pk for tran in trans]})
+
+
+def record_queued(payloads):
+    ids = [pk for payload in payloads for pk in payload['transactions']]
+    trans = []
+    # a transaction deleted meanwhile is not counted
+    for start in range(0, len(ids), BATCH_SIZE):
+        trans.extend(Transaction.objects.filter(pk__in=ids[start:start + BATCH_SIZE]).only(
+            'creator', 'receiver', 'create_date').order_by())
+    record_many(trans)
+
+
+# record() for many transactions: the rows they touch are read once, then changed
+# with one UPDATE each through executemany() and the missing ones inserted together
+def record_many(trans):
+    deltas = {}
+    for tran in trans:
+        if tran.creator_id == tran.receiver_id:
+            continue
+        count, last_date = deltas.get((tran.creator_id, tran.receiver_id), (0, tran.create_date))
+        deltas[(tran.creator_id, tran.receiver_id)] = (count + 1, max(last_date, tran.create_date))
+    if not deltas:
+        return
+
+    user_ids = {user_id for user_id, counterparty_id in deltas}
+    rows = Counterparty.objects.filter(user_id__in=user_ids,
+                                       counterparty_id__in={counterparty_id for _, counterparty_id in deltas})
+    existing = {}
+    for pk, *key in rows.values_list('pk', 'user_id', 'counterparty_id'):
+        if tuple(key) in deltas:
+            existing[tuple(key)] = pk
+
+    if existing:
+        quote, last_date = connection.ops.quote_name, Counterparty._meta.get_field('last_date')
+        with connection.cursor() as cursor:
+            cursor.executemany('UPDATE %s SET %s = %s + %%s, %s = %%s WHERE %s = %%s' % (
+                quote(Counterparty._meta.db_table), quote('count'), quote('count'), quote(last_date.column),
+                quote(Counterparty._meta.pk.column)),
+                [(deltas[key][0], last_date.get_db_prep_value(deltas[key][1], connection), pk)
+                 for key, pk in existing.items()])
+
+    missing = [key for key in deltas if key not in existing]
+    try:
+        with transaction.atomic():
+            Counterparty.objects.bulk_create(
+                Counterparty(user_id=user_id, counterparty_id=counterparty_id, count=deltas[key][0],
+                             last_date=deltas[key][1])
+                for key in missing for user_id, counterparty_id in [key])
+    except IntegrityError:
+        # some were created concurrently since they were read
+        for key in missing:
+            _add(*key, *deltas[key])
+
+    _trim(user_ids)
+    invalidate(*user_ids)
+
+
+# Recompute the counterparties from the transaction history. Deleted transactions no
+# longer count, which the running totals kept by record() do not notice.
+def rebuild(user_ids=None, batch_size=None):
+    rows = Transaction.objects.exclude(creator=F('receiver'))
+    if user_ids is not None:
+        rows = rows.filter(creator__in=user_ids)
+    rows = rows.values('creator', 'receiver').annotate(count=Count('pk'), last_date=Max('create_date')).order_by()
+
+    by_user = defaultdict(list)
+    for row in rows.iterator():
+        by_user[row['creator']].append(Counterparty(user_id=row['creator'], counterparty_id=row['receiver'],
+                                                    count=row['count'], last_date=row['last_date']))
+    with transaction.atomic():
+        stored = Counterparty.objects.all()
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        touched = set(stored.values_list('user_id', flat=True).distinct()) | set(by_user)
+        stored.delete()
+        Counterparty.objects.bulk_create(
+            (row for user_rows in by_user.values()
+             for row in sorted(user_rows, key=lambda row: row.last_date, reverse=True)[:MAX_COUNTERPARTIES]),
+            batch_size=batch_size)
+        invalidate(*touched)
+    return sum(min(len(user_rows), MAX_COUNTERPARTIES) for user_rows in by_user.values())
@@ -0,0 +1,225 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Live events for the event stream (api/events/): every user has a channel, and app.ledger
+# publishes to it once a change to their wallet balance commits. Events are (type, JSON
+# data) pairs. The backend of EVENTS_BACKEND carries them from publishers to subscribers.
+#
+# A stream answers for at most MAX_STREAM_SECONDS, sending a comment every HEARTBEAT
+# seconds so proxies keep it open; the client's EventSource then reconnects after RETRY_MS.
+# A subscriber that falls MAX_QUEUED events behind loses the oldest.
+MAX_STREAM_SECONDS = 300
+HEARTBEAT = 15
+RETRY_MS = 2000
+MAX_QUEUED = 100
+# the poller of SQLiteBackend waits up to this many seconds between attempts after an error
+MAX_POLL_DELAY = 30
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, backend, channels):
+        self.backend = backend
+        self.channels = channels
+        self.events = deque(maxlen=MAX_QUEUED)
+        self.ready = threading.Condition()
+
+    def put(self, event):
+        with self.ready:
+            self.events.append(event)
+            self.ready.notify()
+
+    # the events published since the last call, waiting up to timeout seconds for one
+    def get(self, timeout=None):
+        with self.ready:
+            if not self.events:
+                self.ready.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def close(self):
+        self.backend.unsubscribe(self)
+
+
+class LocalBackend:
+    # Publishers hand events straight to the subscriptions of their own process, so it
+    # only suits a single process, e.g. runserver or one threaded worker.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def publish(self, channel, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self.lock:
+            for channel in channels:
+                self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscriptions[channel]
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscriptions.values())
+
+
+class SQLiteBackend(LocalBackend):
+    # Shares events between the processes of one host through a SQLite file, e.g. for
+    # tests or a few workers without a broker. publish() appends a row; one thread per
+    # process reads the rows added since it last looked every poll_interval seconds and
+    # hands them to the local subscriptions. Rows older than retention seconds are deleted.
+    def __init__(self, path, poll_interval=0.2, retention=60):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.local = threading.local()
+        self.published = 0
+        cursor = self._connection()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'channel TEXT NOT NULL, type TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL)')
+        self.last_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        self.poller = None
+
+    def _connection(self):
+        # one connection per thread, in autocommit mode
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        return self.local.connection
+
+    def publish(self, channel, event):
+        cursor = self._connection()
+        now = time.time()
+        cursor.execute('INSERT INTO events (channel, type, data, created) VALUES (?, ?, ?, ?)',
+                       (channel,) + tuple(event) + (now,))
+        self.published += 1
+        if self.published % 1000 == 0:
+            cursor.execute('DELETE FROM events WHERE created < ?', (now - self.retention,))
+
+    def subscribe(self, channels):
+        with self.lock:
+            if self.poller is None:
+                self.poller = threading.Thread(target=self._poll, name='events-poller', daemon=True)
+                self.poller.start()
+        return super().subscribe(channels)
+
+    def poll(self):
+        rows = self._connection().execute('SELECT id, channel, type, data FROM events WHERE id > ? ORDER BY id',
+                                          (self.last_id,)).fetchall()
+        for event_id, channel, event_type, data in rows:
+            self.last_id = event_id
+            super().publish(channel, (event_type, data))
+        return len(rows)
+
+    def _poll(self):
+        # a poller that stopped would silently leave every stream of the process without
+        # events, so errors (e.g. "database is locked") are logged and retried, backing off
+        delay = self.poll_interval
+        while True:
+            try:
+                self.poll()
+                delay = self.poll_interval
+            except Exception:
+                delay = min(delay * 2, MAX_POLL_DELAY)
+                logger.exception('Reading events from %s failed, trying again in %.1fs.', self.path, delay)
+                self._reconnect()
+            time.sleep(delay)
+
+    def _reconnect(self):
+        connection, self.local.connection = getattr(self.local, 'connection', None), None
+        if connection is not None:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            config = settings.EVENTS_BACKEND
+            _backend = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _backend
+
+
+def user_channel(user):
+    return 'user:%s' % getattr(user, 'pk', user)
+
+
+def publish(channel, event_type, data):
+    backend().publish(channel, (event_type, json.dumps(data, cls=DjangoJSONEncoder)))
+
+
+def _publish_all(events):
+    # runs once the change has committed, so a backend that fails must not fail the
+    # request that made it; the streams catch up with the next event
+    try:
+        for event in events:
+            publish(*event)
+    except Exception:
+        logger.exception('Publishing %d events failed.', len(events))
+
+
+# publish [(channel, type, data)] once the current transaction commits, so nobody hears
+# of a change that is rolled back
+def publish_on_commit(events):
+    if events:
+        transaction.on_commit(lambda: _publish_all(events))
+
+
+def subscribe(*channels):
+    return backend().subscribe(channels)
+
+
+def _message(event_type, data):
+    return 'event: %s\ndata: %s\n\n' % (event_type, data)
+
+
+# The text/event-stream of a subscription, starting with the events first. Closing the
+# generator, as the server does when the client goes away, closes the subscription.
+def stream(subscription, first=(), max_seconds=MAX_STREAM_SECONDS):
+    try:
+        yield 'retry: %d\n\n' % RETRY_MS
+        for event_type, data in first:
+            yield _message(event_type, json.dumps(data, cls=DjangoJSONEncoder))
+        deadline = time.monotonic() + max_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            received = subscription.get(min(HEARTBEAT, remaining))
+            if received:
+                yield ''.join(_message(event_type, data) for event_type, data in received)
+            else:
+                yield ': keep-alive\n\n'
+    finally:
+        subscription.close()
@@ -0,0 +1,64 @@
+import csv
+import heapq
+import json
+from operator import itemgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+EXPORT_FIELDS = (
+    'transaction_id',
+    'create_date',
+    'transaction_type',
+    'category',
+    'amount',
+    'description',
+    'is_complete',
+    'creator__username',
+    'receiver__username',
+    'payment_method_id',
+)
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    # csv.writer needs a file, this one hands back each line instead of storing it
+    def write(self, value):
+        return value
+
+
+def export_rows(querysets):
+    # newest first across all querysets; every queryset is read through a server-side
+    # cursor in chunks and merged lazily, so memory use does not grow with the export
+    sort_key = itemgetter(EXPORT_FIELDS.index('create_date'), EXPORT_FIELDS.index('transaction_id'))
+    rows = [queryset.order_by('-create_date', '-transaction_id').values_list(*EXPORT_FIELDS)
+            .iterator(chunk_size=CHUNK_SIZE) for queryset in querysets]
+    return heapq.merge(*rows, key=sort_key, reverse=True)
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+
+def export_response(querysets, export_format, filename):
+    rows = export_rows(querysets)
+    lines = ndjson_lines(rows) if export_format == 'ndjson' else csv_lines(rows)
+    response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS.get(export_format, 'text/csv'))
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+        filename, export_format if export_format in EXPORT_FORMATS else 'csv')
+    return response
@@ -0,0 +1,48 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+
+CENT = Decimal('0.01')
+
+
+# value as a Decimal rounded to whole cents; floats go through their shortest repr so 0.1 stays 0.10
+def to_money(value):
+    if value is None:
+        return None
+    if isinstance(value, float):
+        value = repr(value)
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class MoneyField(models.BigIntegerField):
+    # An amount of money. Python sees a Decimal with two places, the database stores
+    # the whole number of cents, so SUMs and comparisons in SQL are exact.
+    description = 'Amount of money in cents'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return Decimal(int(value)).scaleb(-2)
+
+    def to_python(self, value):
+        try:
+            return to_money(value)
+        except (InvalidOperation, TypeError, ValueError):
+            raise exceptions.ValidationError('"%(value)s" is not a valid amount.', code='invalid',
+                                             params={'value': value})
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        return int(self.to_python(value).scaleb(2))
+
+    def formfield(self, **kwargs):
+        return super(MoneyField, self).formfield(**{
+            'form_class': forms.DecimalField,
+            'max_digits': 17,
+            'decimal_places': 2,
+            **kwargs,
+        })
@@ -2,8 +2,10 @@ from django import forms
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
 from django.forms import TextInput
-from datetime import date
+from datetime import date, datetime, time, timedelta
+from django.db.models import Q
 from django.urls import reverse_lazy
+from django.utils.timezone import make_aware
 
 from django.utils.html import format_html
 
@@ -11,7 +13,10 @@ from .models import (
     Profile,
     Bank,
     Card,
-    Transaction
+    Transaction,
+    Transaction_Type,
+    Categories,
+    Intervals,
 )
 
 
@@ -46,7 +51,10 @@ class UserRegistrationForm(forms.ModelForm):
             return self.cleaned_data['email'].strip()
 
     def clean_birthday(self):
-        if self.cleaned_data['birthday'] > date.today():
+        # the profile cannot be saved without one
+        if self.cleaned_data['birthday'] is None:
+            self.add_error('birthday', 'The field "Birthday" is required.')
+        elif self.cleaned_data['birthday'] > date.today():
             self.add_error('birthday', 'Please input a valid birthday.')
         else:
             return self.cleaned_data['birthday']
@@ -64,9 +72,16 @@ class UserRegistrationForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(UserRegistrationForm, self).__init__(*args, **kwargs)
-        self.fields['username'].error_messages = {'required': 'The field "Username" is required'}
-        self.fields['password'].error_messages = {'required': 'The field "Password" is required'}
-        self.fields['confirm_password'].error_messages = {'required': 'The field "Confirm Password" is required'}
+        self.fields['username'].error_messages['required'] = 'The field "Username" is required'
+        self.fields['password'].error_messages['required'] = 'The field "Password" is required'
+        self.fields['confirm_password'].error_messages['required'] = 'The field "Confirm Password" is required'
+
+
+class UserImportForm(UserRegistrationForm):
+    # a row of a bulk import; the usernames of all rows are checked against the
+    # database and each other at once, see app.registration
+    def validate_unique(self):
+        pass
 
 
 class UserResetPwdForm(forms.ModelForm):
@@ -230,8 +245,8 @@ class BankUpdateForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(BankUpdateForm, self).__init__(*args, **kwargs)
-        self.fields['owner_first_name'].error_messages = {'required': 'The field "Bank Holder First Name" is required'}
-        self.fields['owner_last_name'].error_messages = {'required': 'The field "Bank Holder Last Name" is required'}
+        self.fields['owner_first_name'].error_messages['required'] = 'The field "Bank Holder First Name" is required'
+        self.fields['owner_last_name'].error_messages['required'] = 'The field "Bank Holder Last Name" is required'
 
 
 class CardUpdateForm(forms.ModelForm):
@@ -251,9 +266,9 @@ class CardUpdateForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(CardUpdateForm, self).__init__(*args, **kwargs)
-        self.fields['owner_first_name'].error_messages = {'required': 'The field "Card Holder First Name" is required'}
-        self.fields['owner_last_name'].error_messages = {'required': 'The field "Card Holder Last Name" is required'}
-        self.fields['expiration_date'].error_messages = {'required': 'Please input a valid card.'}
+        self.fields['owner_first_name'].error_messages['required'] = 'The field "Card Holder First Name" is required'
+        self.fields['owner_last_name'].error_messages['required'] = 'The field "Card Holder Last Name" is required'
+        self.fields['expiration_date'].error_messages['required'] = 'Please input a valid card.'
 
 
 # check if the target user exist or not
@@ -268,6 +283,9 @@ class SearchUserForm(forms.ModelForm):
 
 
 class SendMoneyForm(forms.ModelForm):
+    # sends can be repeated by app.scheduler
+    repeat = forms.ChoiceField(choices=(('', 'Does not repeat'),) + Intervals, required=False)
+
     class Meta:
         model = Transaction
         fields = ('category', 'amount', 'payment_method', 'description')
@@ -276,8 +294,9 @@ class SendMoneyForm(forms.ModelForm):
         return self.cleaned_data['category'].strip()
 
     def clean_amount(self):
-        if self.cleaned_data['amount'] == 0:
-            self.add_error('amount', 'The field "Amount" should not be 0.')
+        # a negative amount would move the money the other way
+        if self.cleaned_data['amount'] <= 0:
+            self.add_error('amount', 'The field "Amount" should be greater than 0.')
         else:
             return self.cleaned_data['amount']
 
@@ -296,10 +315,10 @@ class SendMoneyForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(SendMoneyForm, self).__init__(*args, **kwargs)
-        self.fields['category'].error_messages = {'required': 'The field "Category" is required'}
-        self.fields['amount'].error_messages = {'required': 'The field "Amount" is required'}
-        self.fields['payment_method'].error_messages = {'required': 'The field "Payment Method" is required'}
-        self.fields['description'].error_messages = {'required': 'The field "Description" is required'}
+        self.fields['category'].error_messages['required'] = 'The field "Category" is required'
+        self.fields['amount'].error_messages['required'] = 'The field "Amount" is required'
+        self.fields['payment_method'].error_messages['required'] = 'The field "Payment Method" is required'
+        self.fields['description'].error_messages['required'] = 'The field "Description" is required'
 
 
 class RequestMoneyForm(forms.ModelForm):
@@ -311,8 +330,9 @@ class RequestMoneyForm(forms.ModelForm):
         return self.cleaned_data['category'].strip()
 
     def clean_amount(self):
-        if self.cleaned_data['amount'] == 0:
-            self.add_error('amount', 'The field "Amount" should not be 0.')
+        # a negative amount would move the money the other way
+        if self.cleaned_data['amount'] <= 0:
+            self.add_error('amount', 'The field "Amount" should be greater than 0.')
         else:
             return self.cleaned_data['amount']
 
@@ -321,9 +341,9 @@ class RequestMoneyForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(RequestMoneyForm, self).__init__(*args, **kwargs)
-        self.fields['category'].error_messages = {'required': 'The field "Category" is required'}
-        self.fields['amount'].error_messages = {'required': 'The field "Amount" is required'}
-        self.fields['description'].error_messages = {'required': 'The field "Description" is required'}
+        self.fields['category'].error_messages['required'] = 'The field "Category" is required'
+        self.fields['amount'].error_messages['required'] = 'The field "Amount" is required'
+        self.fields['description'].error_messages['required'] = 'The field "Description" is required'
 
 
 class CompletePaymentForm(forms.ModelForm):
@@ -343,4 +363,64 @@ class CompletePaymentForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(CompletePaymentForm, self).__init__(*args, **kwargs)
-        self.fields['payment_method'].error_messages = {'required': 'The field "Payment Method" is required'}
+        self.fields['payment_method'].error_messages['required'] = 'The field "Payment Method" is required'
+
+
+class StaffTransactionFilterForm(forms.Form):
+    transaction_type = forms.ChoiceField(choices=(('', 'All Types'),) + Transaction_Type, required=False,
+                                         widget=forms.Select(attrs={'class': 'form-control'}))
+    category = forms.ChoiceField(choices=(('', 'All Categories'),) + Categories, required=False,
+                                 widget=forms.Select(attrs={'class': 'form-control'}))
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    amount_min = forms.DecimalField(required=False, decimal_places=2)
+    amount_max = forms.DecimalField(required=False, decimal_places=2)
+    is_complete = forms.NullBooleanField(required=False, widget=forms.Select(attrs={'class': 'form-control'}, choices=(
+        ('unknown', 'All States'), ('true', 'Complete'), ('false', 'Incomplete'))))
+    username = forms.CharField(required=False)
+
+    def clean_username(self):
+        username = self.cleaned_data['username'].strip()
+        if username:
+            self.user = User.objects.filter(username=username).first()
+            if self.user is None:
+                self.add_error('username', 'No user found.')
+        return username
+
+    def clean(self):
+        cleaned_data = super(StaffTransactionFilterForm, self).clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            self.add_error('date_to', 'The end date must not be before the start date.')
+        amount_min, amount_max = cleaned_data.get('amount_min'), cleaned_data.get('amount_max')
+        if amount_min is not None and amount_max is not None and amount_min > amount_max:
+            self.add_error('amount_max', 'The maximum amount must not be below the minimum amount.')
+        return cleaned_data
+
+    # returns one queryset per index the filtered rows can be read from, to be merged by KeysetPaginator
+    def filter(self, queryset):
+        data = self.cleaned_data
+        conditions = {}
+        if data['transaction_type']:
+            conditions['transaction_type'] = data['transaction_type']
+        if data['category']:
+            conditions['category'] = data['category']
+        if data['is_complete'] is not None:
+            conditions['is_complete'] = data['is_complete']
+        if data['amount_min'] is not None:
+            conditions['amount__gte'] = data['amount_min']
+        if data['amount_max'] is not None:
+            conditions['amount__lte'] = data['amount_max']
+        # compare against day boundaries instead of create_date__date so the date index is usable
+        if data['date_from']:
+            conditions['create_date__gte'] = make_aware(datetime.combine(data['date_from'], time.min))
+        # the day after date.max does not exist, and every date is before its end anyway
+        if data['date_to'] and data['date_to'] < date.max:
+            conditions['create_date__lt'] = make_aware(datetime.combine(data['date_to'] + timedelta(days=1),
+                                                                        time.min))
+        queryset = queryset.filter(**conditions)
+
+        if data['username']:
+            return [queryset.filter(creator=self.user),
+                    queryset.filter(receiver=self.user).filter(~Q(creator=self.user))]
+        return [queryset]
@@ -0,0 +1,129 @@
+import re
+import uuid
+from datetime import timedelta
+from functools import partial
+
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils.timezone import now
+
+from .models import IdempotencyKey
+
+# Clients send a key with a POST, as an Idempotency-Key header or, from the HTML forms,
+# a hidden idempotency_key field. The first request with a key claims it in a short
+# transaction of its own, runs the view and stores its response under the key; the view
+# is not run inside that transaction, so a request holds no write lock longer than its
+# own changes need. A retry gets the stored response back without running the view
+# again, or a 409 while the first is still running. If the first fails, its key is given
+# up and the retry runs as if it were first. A key whose request died before storing a
+# response stays claimed until IDEMPOTENCY_TTL: its money may have moved.
+IDEMPOTENCY_TTL = timedelta(hours=24)
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FORM_FIELD = 'idempotency_key'
+
+_KEY = re.compile(r'^[-\w]{1,64}$')
+
+
+class IdempotencyError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def key_from(request):
+    key = request.META.get(HEADER) or request.POST.get(FORM_FIELD)
+    if key is None:
+        return None
+    if not _KEY.match(key):
+        raise IdempotencyError('An idempotency key is 1 to 64 letters, digits, "-" or "_".')
+    return key
+
+
+def _replay(record):
+    response = HttpResponse(record.body, status=record.status, content_type=record.content_type or None)
+    if record.location:
+        response['Location'] = record.location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(user, key, path):
+    # None once the key is ours, or the record of the request that claimed it first
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.filter(user=user, key=key, create_date__lt=now() - IDEMPOTENCY_TTL).delete()
+            IdempotencyKey.objects.create(user=user, key=key, path=path)
+        return None
+    except IntegrityError:
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            # given up by its request just now; the client can send it again
+            raise IdempotencyError('A request with this idempotency key is still being processed.', 409)
+        return record
+
+
+def _release(user, key):
+    IdempotencyKey.objects.filter(user=user, key=key, status__isnull=True).delete()
+
+
+# The response of respond() to the first request with this key; is_final(response)
+# says whether it is kept for retries, or the key is given up so the request can be
+# made again, e.g. after fixing a form error.
+def run(user, key, path, respond, is_final):
+    record = _claim(user, key, path)
+    if record is not None:
+        if record.path != path:
+            raise IdempotencyError('This idempotency key was already used for another request.', 422)
+        # a claimed key has no status until its response is stored
+        if record.status is None:
+            raise IdempotencyError('A request with this idempotency key is still being processed.', 409)
+        return _replay(record)
+
+    try:
+        response = respond()
+    except BaseException:
+        _release(user, key)
+        raise
+    if not is_final(response):
+        _release(user, key)
+        return response
+    IdempotencyKey.objects.filter(user=user, key=key).update(
+        status=response.status_code, content_type=response.get('Content-Type', ''),
+        location=response.get('Location', ''), body=response.content.decode(response.charset))
+    return response
+
+
+def purge(ttl=IDEMPOTENCY_TTL):
+    return IdempotencyKey.objects.filter(create_date__lt=now() - ttl).delete()[0]
+
+
+class IdempotentMixin:
+    # POSTs carrying an idempotency key run once per user and key
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['idempotency_key'] = new_key()
+        return context
+
+    def is_final(self, response):
+        # the forms redirect on success and render again with errors
+        return 300 <= response.status_code < 400
+
+    def idempotency_error(self, error):
+        return HttpResponse(str(error), status=error.status, content_type='text/plain')
+
+    def dispatch(self, request, *args, **kwargs):
+        respond = partial(super().dispatch, request, *args, **kwargs)
+        # anonymous requests are turned away further down
+        if request.method != 'POST' or not request.user.is_authenticated:
+            return respond()
+        try:
+            key = key_from(request)
+            if key is None:
+                return respond()
+            return run(request.user, key, request.path, respond, self.is_final)
+        except IdempotencyError as e:
+            return self.idempotency_error(e)
@@ -0,0 +1,196 @@
+import json
+import logging
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+from django.utils.timezone import now as current_time
+
+from .models import Job
+
+# A worker claims up to BATCH_SIZE due jobs at a time and holds them for LEASE; the jobs
+# of a worker that died are claimed again once it runs out. A failed job is retried
+# after RETRY_DELAY, twice as long after every further attempt up to MAX_RETRY_DELAY,
+# and kept as dead after MAX_ATTEMPTS.
+BATCH_SIZE = 100
+LEASE = timedelta(minutes=5)
+RETRY_DELAY = timedelta(seconds=30)
+MAX_RETRY_DELAY = timedelta(hours=1)
+MAX_ATTEMPTS = 5
+
+# With settings.JOBS_EAGER a request runs the jobs it queued itself once it commits, for at
+# most about EAGER_MAX_SECONDS; the tasks it does not get to are left to the workers.
+EAGER_MAX_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class RunResult:
+    def __init__(self):
+        self.done = 0
+        # (job id, error)
+        self.failures = []
+        self.dead = 0
+        self.elapsed = 0.0
+
+    @property
+    def per_second(self):
+        return self.done / self.elapsed if self.elapsed else 0.0
+
+
+class _LeaseLost(Exception):
+    pass
+
+
+def _path(task):
+    return task if isinstance(task, str) else '%s.%s' % (task.__module__, task.__qualname__)
+
+
+# Queue a call of task, a module level function taking a list of payloads, so that a
+# worker can run many of its jobs at once. The jobs are saved in the current transaction
+# and only run once it commits; payloads must be JSON serializable.
+def enqueue(task, payload=None, delay=None):
+    return enqueue_many(task, [payload or {}], delay)[0]
+
+
+def enqueue_many(task, payloads, delay=None):
+    run_at = current_time() + (delay or timedelta())
+    token = ''
+    if settings.JOBS_EAGER and not delay:
+        # saved as already claimed by this process, so that no worker takes them while
+        # they run after the commit; they are claimed again once LEASE runs out if the
+        # process never gets to them
+        token, run_at = uuid.uuid4().hex, run_at + LEASE
+    jobs = [Job(task=_path(task), payload=json.dumps(payload, cls=DjangoJSONEncoder), run_at=run_at,
+                locked_by=token, attempts=1 if token else 0)
+            for payload in payloads]
+    Job.objects.bulk_create(jobs)
+    if token:
+        transaction.on_commit(lambda: _run_eagerly(token))
+    return jobs
+
+
+def _run_eagerly(token):
+    # after the caller's transaction committed, so a failure here must not fail its
+    # request; the jobs stay queued for the next run
+    try:
+        jobs = list(Job.objects.filter(status='pending', locked_by=token).order_by('pk'))
+        if jobs:
+            _run_jobs(jobs, current_time(), RunResult(), time.perf_counter() + EAGER_MAX_SECONDS)
+    except DatabaseError:
+        logger.exception('Running the queued jobs failed, they are left for the next run.')
+
+
+def due(now=None):
+    return Job.objects.filter(status='pending', run_at__lte=now or current_time())
+
+
+# Lease up to batch_size due jobs, oldest first, to a new worker token and return them.
+# Backends with SKIP LOCKED let workers pass over the jobs another one is claiming.
+# Elsewhere (SQLite) one UPDATE picks and leases the jobs, which is atomic without row
+# locks: of two workers after the same jobs, the second claims those left.
+def claim(batch_size=BATCH_SIZE, now=None):
+    now = now or current_time()
+    token, lease_end = uuid.uuid4().hex, now + LEASE
+    lease = dict(locked_by=token, run_at=lease_end, attempts=F('attempts') + 1)
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due(now).order_by('run_at', 'pk').select_for_update(skip_locked=True).values_list(
+                'pk', flat=True)[:batch_size])
+            Job.objects.filter(pk__in=ids).update(**lease)
+    else:
+        due(now).filter(pk__in=due(now).order_by('run_at', 'pk').values('pk')[:batch_size]).update(**lease)
+    # found through the index of due jobs, as every claimed job is now due at lease_end
+    return list(Job.objects.filter(status='pending', run_at=lease_end, locked_by=token).order_by('pk'))
+
+
+def _finish(jobs):
+    # a job that outlived its lease may have been claimed again, and is the new worker's to run
+    if Job.objects.filter(pk__in=[job.pk for job in jobs], locked_by=jobs[0].locked_by).delete()[0] != len(jobs):
+        raise _LeaseLost()
+
+
+def _fail(job, now, error, result):
+    dead = job.attempts >= MAX_ATTEMPTS
+    delay = min(RETRY_DELAY * 2 ** (job.attempts - 1), MAX_RETRY_DELAY)
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status='dead' if dead else 'pending', run_at=now + delay, locked_by='', last_error=error)
+    result.failures.append((job.pk, error.strip().splitlines()[-1]))
+    result.dead += dead
+
+
+def _run_task(task, jobs, now, result):
+    try:
+        function = import_string(task)
+        payloads = [json.loads(job.payload) for job in jobs]
+    except (ImportError, ValueError):
+        for job in jobs:
+            _fail(job, now, traceback.format_exc(), result)
+        return
+
+    if len(jobs) > 1:
+        try:
+            with transaction.atomic():
+                function(payloads)
+                _finish(jobs)
+            result.done += len(jobs)
+            return
+        except Exception:
+            logger.warning('A batch of %d %s jobs failed, running them one at a time.', len(jobs), task,
+                           exc_info=True)
+
+    # one at a time, so a job that cannot be run only fails itself
+    for job, payload in zip(jobs, payloads):
+        try:
+            with transaction.atomic():
+                function([payload])
+                _finish([job])
+            result.done += 1
+        except _LeaseLost:
+            pass
+        except Exception:
+            _fail(job, now, traceback.format_exc(), result)
+
+
+def _run_jobs(jobs, now, result, deadline=None):
+    tasks = OrderedDict()
+    for job in jobs:
+        tasks.setdefault(job.task, []).append(job)
+    for task, task_jobs in tasks.items():
+        if deadline is not None and time.perf_counter() >= deadline:
+            # given back to the workers as they were before they were claimed
+            Job.objects.filter(pk__in=[job.pk for job in task_jobs], locked_by=task_jobs[0].locked_by).update(
+                run_at=now, locked_by='', attempts=F('attempts') - 1)
+            continue
+        _run_task(task, task_jobs, now, result)
+
+
+# Run due jobs batch_size at a time until none are left. The jobs of a batch are run
+# task by task, each task's jobs in one database transaction with the deletion of the
+# jobs. Stops early once max_seconds have passed; the rest are left for the next run.
+def run(batch_size=BATCH_SIZE, max_seconds=None):
+    result = RunResult()
+    start = time.perf_counter()
+    while max_seconds is None or time.perf_counter() - start < max_seconds:
+        now = current_time()
+        jobs = claim(batch_size, now)
+        if not jobs:
+            break
+        _run_jobs(jobs, now, result)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+# queue the dead jobs (of task) again, with a fresh count of attempts
+def requeue_dead(task=None):
+    jobs = Job.objects.filter(status='dead')
+    if task:
+        jobs = jobs.filter(task=_path(task))
+    return jobs.update(status='pending', run_at=current_time(), attempts=0, locked_by='')
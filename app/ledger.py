@@ -0,0 +1,286 @@
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Max, Sum
+from django.utils.timezone import now
+
+from . import counterparties, events, notifications, summaries, wallet
+from .fields import to_money
+from .models import Account, BalanceSnapshot, LedgerEntry, PaymentMethod, Transaction
+
+# entries younger than this may still belong to open transactions and are left for the next snapshot
+SNAPSHOT_DELAY = timedelta(minutes=1)
+
+
+class TransferError(Exception):
+    pass
+
+
+def wallet_payments(*users):
+    # {user id: payment method id of the user's wallet account}; every user owns exactly
+    # one payment method of type 'account', and it never changes, so this is read
+    # before the atomic block and does not hold up other writers
+    user_ids = [getattr(user, 'pk', user) for user in users]
+    return dict(PaymentMethod.objects.filter(user__in=user_ids, method_type='account')
+                .values_list('user_id', 'method_id'))
+
+
+def _lock(payment_ids):
+    # SQLite has no row locks and serialises writers on the first UPDATE, so only
+    # backends with SELECT ... FOR UPDATE pay for the extra round trip. Locking in
+    # primary key order keeps two transfers between the same accounts from deadlocking.
+    if connection.features.has_select_for_update:
+        accounts = Account.objects.filter(payment__in=payment_ids).select_for_update()
+        list(accounts.order_by('pk').values_list('pk', flat=True))
+
+
+# wallets read per query for the events of a change
+PUBLISH_BATCH_SIZE = 500
+
+
+def _post(postings, kind, tran=None, overdraw=False):
+    _post_many([(tran, postings)], kind, overdraw)
+
+
+def _post_many(movements, kind, overdraw=False):
+    # movements is a list of (transaction or None, postings); postings is a list of
+    # (payment method id, amount, is wallet account) adding up to zero. Each wallet balance
+    # changes with one UPDATE, all sent through executemany() (a batched CASE costs Django
+    # more to build than the statements cost the database), and every posting is appended
+    # to the ledger. A wallet is only debited if its balance covers it, checked by the
+    # UPDATE itself so that concurrent transfers cannot overdraw it; reversals by staff
+    # pass overdraw, as the money may have been spent since.
+    deltas = OrderedDict()
+    for tran, postings in movements:
+        for payment_id, amount, wallet in postings:
+            if wallet:
+                deltas[payment_id] = deltas.get(payment_id, 0) + amount
+
+    if deltas:
+        _lock(list(deltas))
+        quote, balance = connection.ops.quote_name, Account._meta.get_field('balance')
+        update = 'UPDATE %s SET %s = %s + %%s WHERE %s = %%s' % (
+            quote(Account._meta.db_table), quote(balance.column), quote(balance.column),
+            quote(Account._meta.get_field('payment').column))
+        covered = update + ' AND %s + %%s >= 0' % quote(balance.column)
+        debits = [(balance.get_db_prep_value(delta, connection), payment_id)
+                  for payment_id, delta in deltas.items() if delta < 0 and not overdraw]
+        credits = [(balance.get_db_prep_value(delta, connection), payment_id)
+                   for payment_id, delta in deltas.items() if delta >= 0 or overdraw]
+        with connection.cursor() as cursor:
+            if debits:
+                cursor.executemany(covered, [(delta, payment_id, delta) for delta, payment_id in debits])
+                if cursor.rowcount != len(debits):
+                    _missing_wallet([payment_id for delta, payment_id in debits])
+                    raise TransferError('Insufficient balance in the wallet account.')
+            if credits:
+                cursor.executemany(update, credits)
+                if cursor.rowcount != len(credits):
+                    raise TransferError('A wallet account of this transaction does not exist.')
+        _publish(movements, deltas, kind)
+
+    LedgerEntry.objects.bulk_create(LedgerEntry(payment_id=payment_id, transaction=tran, kind=kind, amount=amount)
+                                    for tran, postings in movements for payment_id, amount, wallet in postings)
+
+
+def _missing_wallet(payment_ids):
+    # tells a debit that found no wallet from one the balance did not cover
+    if Account.objects.filter(payment__in=payment_ids).count() != len(payment_ids):
+        raise TransferError('A wallet account of this transaction does not exist.')
+
+
+def _publish(movements, deltas, kind):
+    # Tell the owners of the wallets that changed their new balance, and of every posting
+    # to their wallet, once the transaction commits; the balances are read back here,
+    # where they include this transaction's changes.
+    owners = {}
+    payment_ids = list(deltas)
+    for start in range(0, len(payment_ids), PUBLISH_BATCH_SIZE):
+        for payment_id, user_id, balance in Account.objects.filter(
+                payment__in=payment_ids[start:start + PUBLISH_BATCH_SIZE]).values_list(
+                'payment_id', 'payment__user_id', 'balance'):
+            owners[payment_id] = events.user_channel(user_id), balance
+
+    published = []
+    for tran, postings in movements:
+        for payment_id, amount, wallet in postings:
+            if wallet:
+                published.append((owners[payment_id][0], 'transaction', {
+                    'transaction_id': tran.pk if tran is not None else None, 'kind': kind,
+                    'amount': abs(amount), 'direction': 'in' if amount > 0 else 'out'}))
+    for payment_id, delta in deltas.items():
+        channel, balance = owners[payment_id]
+        published.append((channel, 'balance', {'balance': balance, 'change': delta, 'kind': kind}))
+    events.publish_on_commit(published)
+
+
+def _transfer_postings(payer, payment_method, payee, amount, wallets=None):
+    # wallets can carry the result of wallet_payments() for many payees at once
+    if amount <= 0:
+        # the postings would be reversed, taking the money from the payee
+        raise TransferError('The amount must be greater than 0.')
+    if payment_method.user_id != payer.pk:
+        raise TransferError('The selected payment method does not belong to %s.' % payer.username)
+    payee_wallet = (wallet_payments(payee) if wallets is None else wallets).get(payee.pk)
+    if payee_wallet is None:
+        raise TransferError('%s does not have a wallet account.' % payee.username)
+    if payee_wallet == payment_method.pk:
+        raise TransferError('You cannot send money from your wallet to yourself.')
+
+    # banks and cards are charged outside the wallet, only their posting is recorded
+    return [(payment_method.pk, -amount, payment_method.method_type == 'account'),
+            (payee_wallet, amount, True)]
+
+
+# debit the creator, credit the receiver and save tran as a completed send; wallets as
+# for _transfer_postings()
+def send_money(tran, wallets=None):
+    tran.amount = to_money(tran.amount)
+    tran.transaction_type = 'send'
+    tran.is_complete = True
+    postings = _transfer_postings(tran.creator, tran.payment_method, tran.receiver, tran.amount, wallets)
+
+    with transaction.atomic():
+        tran.save()
+        _post(postings, 'send', tran)
+        summaries.record(tran)
+        counterparties.queue(tran)
+        notifications.queue('send', tran)
+        wallet.invalidate(tran.creator_id, tran.receiver_id)
+    return tran
+
+
+def _insert_transactions(trans):
+    # Bulk insert and learn the new primary keys, which the ledger entries point to.
+    # Backends that can return them from the INSERT do so. On SQLite they are the
+    # newest rows of the table: the caller's transaction holds the only write lock
+    # from the first INSERT on, so nobody else can have added any.
+    if connection.features.can_return_ids_from_bulk_insert:
+        Transaction.objects.bulk_create(trans)
+    elif connection.vendor == 'sqlite':
+        Transaction.objects.bulk_create(trans)
+        pks = list(Transaction.objects.order_by('-pk').values_list('pk', flat=True)[:len(trans)])
+        for tran, pk in zip(trans, reversed(pks)):
+            tran.pk = pk
+    else:
+        for tran in trans:
+            tran.save()
+
+
+# send_money() for many transactions in one database transaction; nothing is sent
+# unless every one of them can be
+def send_many(trans):
+    wallets = wallet_payments(*{tran.receiver_id for tran in trans})
+    movements = []
+    for tran in trans:
+        tran.amount = to_money(tran.amount)
+        tran.transaction_type = 'send'
+        tran.is_complete = True
+        movements.append((tran, _transfer_postings(tran.creator, tran.payment_method, tran.receiver,
+                                                   tran.amount, wallets)))
+
+    with transaction.atomic():
+        _insert_transactions(trans)
+        _post_many(movements, 'send')
+        summaries.record_many(trans)
+        counterparties.queue(*trans)
+        notifications.queue('send', *trans)
+        wallet.invalidate(*{user_id for tran in trans for user_id in (tran.creator_id, tran.receiver_id)})
+    return trans
+
+
+# save tran as an open request for money from its receiver
+def request_money(tran):
+    tran.transaction_type = 'request'
+    tran.is_complete = False
+    with transaction.atomic():
+        tran.save()
+        counterparties.queue(tran)
+        notifications.queue('request', tran)
+    return tran
+
+
+# pay the money request tran on behalf of its receiver
+def complete_payment(tran, payer, payment_method):
+    if tran.receiver_id != payer.pk:
+        raise TransferError('This request was not sent to %s.' % payer.username)
+    # the person who created the request receives the money
+    postings = _transfer_postings(payer, payment_method, tran.creator, tran.amount)
+
+    with transaction.atomic():
+        # claiming the row first makes a second, concurrent confirmation a no-op
+        claimed = Transaction.objects.filter(pk=tran.pk, is_complete=False).update(
+            is_complete=True, payment_method=payment_method)
+        if not claimed:
+            raise TransferError('This request has already been paid.')
+
+        _post(postings, 'payment', tran)
+        summaries.record(tran)
+        notifications.queue('payment', tran)
+        wallet.invalidate(payer, tran.creator_id)
+
+    tran.is_complete = True
+    tran.payment_method = payment_method
+    return tran
+
+
+# delete tran, refunding its payer's wallet account if money was moved
+def reverse_transaction(tran):
+    postings = []
+    if tran.is_complete:
+        payer, payee = tran.payer_and_payee()
+        wallets = wallet_payments(payer, payee)
+        postings = [(wallets.get(payer), tran.amount, True), (wallets.get(payee), -tran.amount, True)]
+
+    with transaction.atomic():
+        if postings:
+            _post(postings, 'reversal', tran, overdraw=True)
+            summaries.record(tran, -1)
+            wallet.invalidate(payer, payee)
+        tran.delete()
+
+
+# move the whole balance of a wallet account out of the app, to the user's bank
+def withdraw(account):
+    with transaction.atomic():
+        _lock([account.payment_id])
+        balance = Account.objects.filter(pk=account.pk).values_list('balance', flat=True).get()
+        if balance:
+            _post([(account.payment_id, -balance, True), (None, balance, False)], 'withdrawal')
+            wallet.invalidate(account.payment.user_id)
+    return balance
+
+
+# snapshot every wallet account from the previous snapshots and the entries posted since
+def take_snapshots(batch_size=None):
+    cutoff = LedgerEntry.objects.filter(create_date__lt=now() - SNAPSHOT_DELAY).aggregate(
+        last=Max('entry_id'))['last']
+    previous = BalanceSnapshot.objects.aggregate(last=Max('last_entry_id'))['last'] or 0
+    if cutoff is None or cutoff <= previous:
+        return 0
+
+    balances = defaultdict(Decimal, BalanceSnapshot.objects.filter(last_entry_id=previous)
+                           .values_list('payment_id', 'balance'))
+    later = LedgerEntry.objects.filter(entry_id__gt=previous, entry_id__lte=cutoff).values(
+        'payment_id').annotate(total=Sum('amount')).order_by().values_list('payment_id', 'total')
+    for payment_id, total in later:
+        balances[payment_id] += total
+
+    wallets = Account.objects.values_list('payment_id', flat=True)
+    snapshots = [BalanceSnapshot(payment_id=payment_id, balance=balances[payment_id],
+                                 last_entry_id=cutoff) for payment_id in wallets.iterator()]
+    BalanceSnapshot.objects.bulk_create(snapshots, batch_size=batch_size)
+    return len(snapshots)
+
+
+# fold every ledger entry in order into per payment method balances
+def replay(chunk_size=10000):
+    balances = defaultdict(Decimal)
+    count = 0
+    entries = LedgerEntry.objects.order_by('entry_id').values_list('payment_id', 'amount')
+    for payment_id, amount in entries.iterator(chunk_size=chunk_size):
+        balances[payment_id] += amount
+        count += 1
+    return balances, count
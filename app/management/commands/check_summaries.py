@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import summaries
+
+
+class Command(BaseCommand):
+    help = 'Compare the spending summaries with the transaction history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='only check this user id (can be repeated)')
+
+    def handle(self, *args, **options):
+        problems = summaries.inconsistencies(options['users'])
+        for (user_id, month, category, direction), expected, stored in problems:
+            self.stdout.write('user %s %s %s %s: expected %.2f in %d, stored %.2f in %d' % (
+                user_id, month.strftime('%Y-%m'), category, direction,
+                expected[0], expected[1], stored[0], stored[1]))
+        if problems:
+            raise CommandError('%d summary rows are inconsistent, run rebuild_summaries.' % len(problems))
+        self.stdout.write(self.style.SUCCESS('Spending summaries are consistent.'))
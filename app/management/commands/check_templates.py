@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import template_cache
+
+
+class Command(BaseCommand):
+    help = 'Compile every template of the app, as production does when it starts, and report the slowest.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=5, help='how many of the slowest templates to list')
+
+    def handle(self, *args, **options):
+        template_cache.reset()
+        timings, errors = template_cache.precompile()
+        for name, seconds in sorted(timings.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write('%-45s %7.2f ms' % (name, seconds * 1000))
+        for name, error in sorted(errors.items()):
+            self.stdout.write('%s: %s' % (name, error))
+        if errors:
+            raise CommandError('%d templates do not compile.' % len(errors))
+        self.stdout.write(self.style.SUCCESS('%d templates compiled in %.1f ms.' % (
+            len(timings), sum(timings.values()) * 1000)))
@@ -0,0 +1,40 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import registration
+
+
+class Command(BaseCommand):
+    help = ('Register many users from a CSV file with the columns username, first_name, last_name, email, '
+            'password, birthday and address. Rows that fail are reported and do not stop the others.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='path of the CSV file, - for standard input')
+        parser.add_argument('--chunk-size', type=int, default=registration.CHUNK_SIZE,
+                            help='users per database transaction')
+        parser.add_argument('--iterations', type=int,
+                            help='PBKDF2 iterations for the passwords (default: IMPORT_PASSWORD_ITERATIONS, '
+                                 'or the full cost); they are raised to the full cost at first login')
+
+    def handle(self, *args, **options):
+        if options['iterations'] is not None and options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1.')
+        try:
+            if options['csv_file'] == '-':
+                rows, failures = registration.read_csv(sys.stdin)
+            else:
+                with open(options['csv_file'], newline='') as f:
+                    rows, failures = registration.read_csv(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        result = registration.register_many(rows, options['chunk_size'], options['iterations'])
+        failures = sorted(failures + result.failures)
+        for failure in failures:
+            self.stdout.write('line %d (%s): %s' % failure)
+        self.stdout.write('Registered %d users in %.2fs (%.0f users/second).' % (
+            len(result.created), result.elapsed, result.per_second))
+        if failures:
+            raise CommandError('%d users could not be registered.' % len(failures))
+        self.stdout.write(self.style.SUCCESS('All users were registered.'))
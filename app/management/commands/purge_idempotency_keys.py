@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from app import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys older than their TTL; run it periodically, e.g. from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float,
+                            default=idempotency.IDEMPOTENCY_TTL.total_seconds() / 3600,
+                            help='delete keys older than this many hours (default: the TTL)')
+
+    def handle(self, *args, **options):
+        count = idempotency.purge(timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS('Deleted %d idempotency keys.' % count))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app import summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the spending summaries from the transaction history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='only rebuild this user id (can be repeated)')
+
+    def handle(self, *args, **options):
+        count = summaries.rebuild(options['users'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d summary rows.' % count))
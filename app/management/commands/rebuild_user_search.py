@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the user search index from the user table, e.g. after bulk imports.'
+
+    def handle(self, *args, **options):
+        if not search.has_index():
+            raise CommandError('This database has no user search index; users are searched directly.')
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt the user search index.'))
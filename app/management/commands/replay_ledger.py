@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import ledger
+from app.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Replay the whole ledger and check it against every wallet account balance.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snapshots', action='store_true',
+                            help='also check the snapshot based balance of every account')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        balances, count = ledger.replay()
+        elapsed = time.perf_counter() - start
+        self.stdout.write('Replayed %d entries in %.2fs (%.0f entries/second).' % (
+            count, elapsed, count / elapsed if elapsed else 0))
+
+        problems = []
+        # the postings of every movement add up to zero, so the whole ledger must too
+        total = sum(balances.values())
+        if total:
+            problems.append('ledger does not balance, entries add up to %s' % total)
+
+        for account in Account.objects.select_related('payment__user').iterator():
+            replayed = balances.get(account.payment_id, 0)
+            if replayed != account.balance:
+                problems.append('%s: balance %s, ledger %s' % (account, account.balance, replayed))
+            elif options['snapshots'] and account.ledger_balance() != replayed:
+                problems.append('%s: ledger %s, snapshot balance %s' % (
+                    account, replayed, account.ledger_balance()))
+
+        for problem in problems:
+            self.stdout.write(problem)
+        if problems:
+            raise CommandError('%d ledger problems found.' % len(problems))
+        self.stdout.write(self.style.SUCCESS('Every account matches the ledger.'))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from app import jobs
+
+
+class Command(BaseCommand):
+    help = ('Run the queued background jobs that are due. Run it from cron, or with --worker to keep running '
+            'and check every --interval seconds.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=jobs.BATCH_SIZE, help='jobs claimed at a time')
+        parser.add_argument('--max-seconds', type=float,
+                            help='stop a run after this long and leave the rest for the next one')
+        parser.add_argument('--worker', action='store_true', help='keep running until interrupted')
+        parser.add_argument('--interval', type=float, default=1, help='seconds between runs with --worker')
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help='queue the dead jobs again before running, e.g. after fixing their task')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        if options['requeue_dead']:
+            self.stdout.write('Queued %d dead jobs again.' % jobs.requeue_dead())
+        try:
+            while True:
+                self.run(options)
+                if not options['worker']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def run(self, options):
+        # a worker keeps its process for days, so it drops connections like a request would
+        close_old_connections()
+        result = jobs.run(batch_size=options['batch_size'], max_seconds=options['max_seconds'])
+        for job_id, error in result.failures:
+            self.stdout.write('job %d: %s' % (job_id, error))
+        if result.done or result.failures or options['verbosity'] > 1:
+            self.stdout.write('Ran %d jobs in %.2fs (%.0f jobs/second), %d failed, %d of them dead.' % (
+                result.done, result.elapsed, result.per_second, len(result.failures), result.dead))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from app import scheduler
+
+
+class Command(BaseCommand):
+    help = ('Make the scheduled payments that are due. Run it from cron, or with --worker to keep running '
+            'and check every --interval seconds.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=scheduler.BATCH_SIZE,
+                            help='schedules paid per database transaction')
+        parser.add_argument('--max-seconds', type=float,
+                            help='stop a run after this long and leave the rest for the next one')
+        parser.add_argument('--worker', action='store_true', help='keep running until interrupted')
+        parser.add_argument('--interval', type=float, default=60, help='seconds between runs with --worker')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        try:
+            while True:
+                self.run(options)
+                if not options['worker']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def run(self, options):
+        # a worker keeps its process for days, so it drops connections like a request would
+        close_old_connections()
+        result = scheduler.run_due(batch_size=options['batch_size'], max_seconds=options['max_seconds'])
+        for schedule_id, error in result.failures:
+            self.stdout.write('schedule %d: %s' % (schedule_id, error))
+        if result.sent or result.failures or options['verbosity'] > 1:
+            self.stdout.write('Made %d scheduled payments in %.2fs (%.0f payments/second), %d failed.' % (
+                result.sent, result.elapsed, result.per_second, len(result.failures)))
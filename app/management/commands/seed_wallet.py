@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import seeding
+
+
+class Command(BaseCommand):
+    help = ('Add synthetic users, each with a profile, wallet account, bank and card, and transactions '
+            'between them, for testing at scale. Every user gets the password "%s".' % seeding.PASSWORD)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--transactions', type=int, default=100000)
+        parser.add_argument('--staff', type=int, default=0, help='staff users to add as well')
+        parser.add_argument('--seed', type=int, default=0, help='the same seed generates the same data')
+        parser.add_argument('--workers', type=int, default=1, help='processes generating the rows')
+        parser.add_argument('--chunk-size', type=int, default=seeding.CHUNK_SIZE,
+                            help='users or transactions generated at a time')
+        parser.add_argument('--no-rebuild', action='store_false', dest='rebuild',
+                            help='leave the summaries, counterparties and user search index for later')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('At least 2 users are needed to make transactions between them.')
+
+        def progress(kind, rows, elapsed):
+            if options['verbosity'] > 1:
+                self.stdout.write('%s: %d rows in %.1fs' % (kind, rows, elapsed))
+
+        result = seeding.seed(options['users'], options['transactions'], options['seed'], options['staff'],
+                              options['workers'], options['chunk_size'], options['rebuild'], progress)
+        self.stdout.write('Wrote %d rows in %.1fs (%.0f rows/second).' % (
+            result.rows, result.elapsed, result.per_second))
+        if not options['rebuild']:
+            self.stdout.write('Run rebuild_summaries, rebuild_counterparties and rebuild_user_search next.')
+        self.stdout.write(self.style.SUCCESS('Added %d users, %d staff users and %d transactions.' % (
+            len(result.user_ids), len(result.staff_ids), options['transactions'])))
@@ -0,0 +1,51 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import payouts
+from app.models import PaymentMethod
+
+
+class Command(BaseCommand):
+    help = ('Send money to many users from a CSV file with the columns username, amount, category and '
+            'description. Rows that fail are reported and do not stop the others.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('payer', help='username of the user the money comes from')
+        parser.add_argument('csv_file', help='path of the CSV file, - for standard input')
+        parser.add_argument('--payment-method', type=int,
+                            help="id of the payer's payment method to pay with (default: their wallet)")
+        parser.add_argument('--chunk-size', type=int, default=payouts.CHUNK_SIZE,
+                            help='payouts per database transaction')
+
+    def handle(self, *args, **options):
+        payer = User.objects.filter(username=options['payer']).first()
+        if payer is None:
+            raise CommandError('No user named %s.' % options['payer'])
+        methods = PaymentMethod.objects.filter(user=payer)
+        if options['payment_method']:
+            payment_method = methods.filter(pk=options['payment_method']).first()
+        else:
+            payment_method = methods.filter(method_type='account').first()
+        if payment_method is None:
+            raise CommandError('%s has no such payment method.' % payer.username)
+
+        try:
+            if options['csv_file'] == '-':
+                rows, failures = payouts.read_csv(sys.stdin)
+            else:
+                with open(options['csv_file'], newline='') as f:
+                    rows, failures = payouts.read_csv(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        result = payouts.send_payouts(payer, payment_method, rows, options['chunk_size'])
+        failures = sorted(failures + result.failures)
+        for failure in failures:
+            self.stdout.write('line %d (%s): %s' % failure)
+        self.stdout.write('Sent %d payouts in %.2fs (%.0f payouts/second).' % (
+            len(result.sent), result.elapsed, result.per_second))
+        if failures:
+            raise CommandError('%d payouts failed.' % len(failures))
+        self.stdout.write(self.style.SUCCESS('All payouts were sent.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app import ledger
+
+
+class Command(BaseCommand):
+    help = 'Snapshot the ledger balance of every wallet account. Run it periodically, e.g. from cron.'
+
+    def handle(self, *args, **options):
+        count = ledger.take_snapshots()
+        self.stdout.write(self.style.SUCCESS('Took %d balance snapshots.' % count))
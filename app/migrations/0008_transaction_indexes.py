@@ -0,0 +1,37 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_create_group_permissions'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='transaction',
+            options={'ordering': ['-create_date', '-transaction_id']},
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='creator',
+            field=models.ForeignKey(db_index=False, default='', on_delete=django.db.models.deletion.PROTECT, related_name='creator', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='receiver',
+            field=models.ForeignKey(db_index=False, default='', on_delete=django.db.models.deletion.PROTECT, related_name='receiver', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['creator', 'is_complete', 'transaction_type', '-create_date', '-transaction_id'], name='transaction_creator_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['receiver', 'is_complete', 'transaction_type', '-create_date', '-transaction_id'], name='transaction_receiver_idx'),
+        ),
+    ]
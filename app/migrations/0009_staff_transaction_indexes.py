@@ -0,0 +1,25 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['-create_date', '-transaction_id'], name='transaction_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_type', '-create_date', '-transaction_id'], name='transaction_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', '-create_date', '-transaction_id'], name='transaction_category_date_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:35
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def summarise_history(apps, schema_editor):
+    Transaction = apps.get_model('app', 'Transaction')
+    SpendingSummary = apps.get_model('app', 'SpendingSummary')
+
+    summaries = defaultdict(lambda: [0.0, 0])
+    sides = (
+        ('send', 'creator', 'out'),
+        ('send', 'receiver', 'in'),
+        ('request', 'receiver', 'out'),
+        ('request', 'creator', 'in'),
+    )
+    for transaction_type, user_field, direction in sides:
+        rows = Transaction.objects.filter(is_complete=True, transaction_type=transaction_type).annotate(
+            month=TruncMonth('create_date', output_field=DateField())).values(
+            user_field, 'month', 'category').annotate(total=Sum('amount'), count=Count('pk')).order_by()
+        for row in rows:
+            summary = summaries[(row[user_field], row['month'], row['category'], direction)]
+            summary[0] += row['total']
+            summary[1] += row['count']
+
+    SpendingSummary.objects.bulk_create(
+        (SpendingSummary(user_id=user_id, month=month, category=category, direction=direction,
+                         total=round(total, 2), count=count)
+         for (user_id, month, category, direction), (total, count) in summaries.items()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0009_staff_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendingSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('category', models.CharField(choices=[('Bank', 'Bank Transfer'), ('Utilities', 'Bills & Utilities'), ('Transportation', 'Auto & Transport'), ('Groceries', 'Groceries'), ('Food', 'Food'), ('Shopping', 'Shopping'), ('Health', 'Healthcare'), ('Education', 'Education'), ('Travel', 'Travel'), ('Housing', 'Housing'), ('Entertainment', 'Entertainment'), ('Others', 'Others')], max_length=45)),
+                ('direction', models.CharField(choices=[('in', 'Received'), ('out', 'Spent')], max_length=3)),
+                ('total', models.FloatField(default=0.0)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spending_summary', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-month', 'category', 'direction'],
+                'unique_together': {('user', 'month', 'category', 'direction')},
+            },
+        ),
+        migrations.RunPython(summarise_history, migrations.RunPython.noop),
+    ]
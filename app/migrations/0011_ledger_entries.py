@@ -0,0 +1,60 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def open_ledger(apps, schema_editor):
+    # one opening entry per funded wallet account, balanced by money entering the app
+    Account = apps.get_model('app', 'Account')
+    LedgerEntry = apps.get_model('app', 'LedgerEntry')
+
+    entries = []
+    for payment_id, balance in Account.objects.exclude(balance=0).values_list('payment_id', 'balance').iterator():
+        entries.append(LedgerEntry(payment_id=payment_id, kind='opening', amount=balance))
+        entries.append(LedgerEntry(payment_id=None, kind='opening', amount=-balance))
+    LedgerEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_spending_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('entry_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('opening', 'Opening Balance'), ('send', 'Send'), ('payment', 'Request Payment'), ('reversal', 'Reversal'), ('withdrawal', 'Withdrawal')], max_length=45)),
+                ('amount', models.FloatField(default=0.0)),
+                ('create_date', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('payment', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entry', to='app.PaymentMethod')),
+                ('transaction', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ledger_entry', to='app.Transaction')),
+            ],
+            options={
+                'ordering': ['entry_id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.FloatField(default=0.0)),
+                ('last_entry_id', models.BigIntegerField()),
+                ('create_date', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('payment', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshot', to='app.PaymentMethod')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['payment', 'entry_id'], name='ledger_entry_payment_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='balancesnapshot',
+            unique_together={('payment', 'last_entry_id')},
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:41
+
+import app.fields
+from django.db import migrations
+from django.db.models import F, Func, Max, Min
+
+MONEY_COLUMNS = (
+    ('Account', 'balance'),
+    ('BalanceSnapshot', 'balance'),
+    ('LedgerEntry', 'amount'),
+    ('SpendingSummary', 'total'),
+    ('Transaction', 'amount'),
+)
+BATCH_SIZE = 10000
+
+
+def _rescale(apps, value):
+    # rewrite a money column in primary key ranges, so no single statement touches the whole table
+    for model_name, field in MONEY_COLUMNS:
+        model = apps.get_model('app', model_name)
+        bounds = model.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            continue
+        for start in range(bounds['low'], bounds['high'] + 1, BATCH_SIZE):
+            model.objects.filter(pk__gte=start, pk__lt=start + BATCH_SIZE).update(**{field: value(F(field))})
+
+
+def to_cents(apps, schema_editor):
+    # still floats here; the integer column type is applied by the AlterFields below
+    _rescale(apps, lambda amount: Func(amount * 100, function='ROUND'))
+
+
+def to_units(apps, schema_editor):
+    _rescale(apps, lambda amount: amount / 100.0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_ledger_entries'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_cents, to_units),
+        migrations.AlterField(
+            model_name='account',
+            name='balance',
+            field=app.fields.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='balancesnapshot',
+            name='balance',
+            field=app.fields.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='amount',
+            field=app.fields.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='spendingsummary',
+            name='total',
+            field=app.fields.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=app.fields.MoneyField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from importlib import import_module
+
+from django.contrib.auth.management import create_permissions
+from django.db import migrations
+
+# Permissions are normally created after all migrations have run, so on a fresh
+# database 0007 found none and left both groups without permissions. Create them
+# now and assign them again; on an existing database this changes nothing.
+group_permissions = import_module('app.migrations.0007_create_group_permissions')
+
+
+def create_and_assign_permissions(apps, schema_editor):
+    for app_label in ('auth', 'app'):
+        app_config = apps.get_app_config(app_label)
+        app_config.models_module = True
+        create_permissions(app_config, apps=apps, verbosity=0)
+        app_config.models_module = None
+    group_permissions.add_group_permissions_data(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_money_in_cents'),
+        ('auth', '0011_update_proxy_permissions'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_and_assign_permissions, migrations.RunPython.noop),
+    ]
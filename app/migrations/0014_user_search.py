@@ -0,0 +1,35 @@
+from django.db import OperationalError, migrations
+
+# The FTS5 index behind app.search. Other backends, and SQLite builds without FTS5,
+# search the user table directly.
+# prefix='2 3' keeps short prefixes, what autocomplete asks for most, cheap to match.
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE app_user_search USING fts5(username, first_name, last_name, email, prefix='2 3')")
+    except OperationalError:
+        return
+    schema_editor.execute(
+        'INSERT INTO app_user_search (rowid, username, first_name, last_name, email) '
+        'SELECT id, username, first_name, last_name, email FROM auth_user')
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS app_user_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_group_permissions'),
+        ('auth', '0011_update_proxy_permissions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
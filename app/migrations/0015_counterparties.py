@@ -0,0 +1,51 @@
+# Generated by Django 2.2.24 on 2026-10-18 16:01
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Count, F, Max
+
+
+def count_counterparties(apps, schema_editor):
+    # the 20 most recent counterparties of every user, as app.counterparties.rebuild() does
+    Transaction = apps.get_model('app', 'Transaction')
+    Counterparty = apps.get_model('app', 'Counterparty')
+
+    by_user = defaultdict(list)
+    rows = Transaction.objects.exclude(creator=F('receiver')).values('creator', 'receiver').annotate(
+        count=Count('pk'), last_date=Max('create_date')).order_by()
+    for row in rows:
+        by_user[row['creator']].append(Counterparty(user_id=row['creator'], counterparty_id=row['receiver'],
+                                                    count=row['count'], last_date=row['last_date']))
+    Counterparty.objects.bulk_create(
+        (row for user_rows in by_user.values()
+         for row in sorted(user_rows, key=lambda row: row.last_date, reverse=True)[:20]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0014_user_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counterparty',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('last_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('counterparty', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counterparty', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-last_date'],
+                'unique_together': {('user', 'counterparty')},
+            },
+        ),
+        migrations.RunPython(count_counterparties, migrations.RunPython.noop),
+    ]
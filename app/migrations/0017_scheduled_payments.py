@@ -0,0 +1,46 @@
+# Generated by Django 2.2.24 on 2026-10-18 16:40
+
+import app.fields
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0016_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledPayment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('Bank', 'Bank Transfer'), ('Utilities', 'Bills & Utilities'), ('Transportation', 'Auto & Transport'), ('Groceries', 'Groceries'), ('Food', 'Food'), ('Shopping', 'Shopping'), ('Health', 'Healthcare'), ('Education', 'Education'), ('Travel', 'Travel'), ('Housing', 'Housing'), ('Entertainment', 'Entertainment'), ('Others', 'Others')], max_length=45)),
+                ('amount', app.fields.MoneyField(default=0)),
+                ('description', models.CharField(blank=True, default='', max_length=200)),
+                ('interval', models.CharField(choices=[('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=10)),
+                ('start_at', models.DateTimeField()),
+                ('run_count', models.PositiveIntegerField(default=0)),
+                ('next_run_at', models.DateTimeField()),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('failure_count', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, default='', max_length=255)),
+                ('is_active', models.BooleanField(default=True)),
+                ('create_date', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('payment_method', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.PaymentMethod')),
+                ('receiver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_payments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['next_run_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='scheduledpayment',
+            index=models.Index(condition=models.Q(is_active=True), fields=['next_run_at'], name='schedule_due_idx'),
+        ),
+    ]
@@ -1,8 +1,12 @@
+from decimal import Decimal
+
 from django.db import models
 from django.utils.timezone import now
 from django.contrib.auth.models import User, AbstractUser
 from django.urls import reverse
 
+from .fields import MoneyField
+
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -24,7 +28,7 @@ class PaymentMethod(models.Model):
 
 class Account(models.Model):
     payment = models.OneToOneField(PaymentMethod, on_delete=models.CASCADE)
-    balance = models.FloatField(default=0.00)
+    balance = MoneyField(default=0)
 
     def __str__(self):
         return 'Account: %s' % self.payment.user.username
@@ -32,10 +36,13 @@ class Account(models.Model):
     def get_update_url(self):
         return reverse('account_transfer', kwargs={'pk': self.pk})
 
-    def save(self, *args, **kwargs):
-        # ensure that the database only stores 2 decimal places
-        self.balance = round(self.balance, 2)
-        super(Account, self).save(*args, **kwargs)
+    def ledger_balance(self):
+        # the balance according to the ledger: last snapshot plus the entries posted since
+        snapshot = BalanceSnapshot.objects.filter(payment=self.payment_id).order_by('-last_entry_id').first()
+        balance, last_entry_id = (snapshot.balance, snapshot.last_entry_id) if snapshot else (Decimal('0.00'), 0)
+        later = LedgerEntry.objects.filter(payment=self.payment_id, entry_id__gt=last_entry_id).aggregate(
+            total=models.Sum('amount'))['total']
+        return balance + (later or 0)
 
 
 class Bank(models.Model):
@@ -101,6 +108,25 @@ Transaction_Type = (
 )
 
 
+Intervals = (
+    ('weekly', 'Weekly'),
+    ('monthly', 'Monthly'),
+)
+
+
+NotificationKinds = (
+    ('send', 'Money received'),
+    ('request', 'Money requested'),
+    ('payment', 'Request paid'),
+)
+
+
+JobStatuses = (
+    ('pending', 'Pending'),
+    ('dead', 'Dead'),
+)
+
+
 Categories = (
     ('Bank', 'Bank Transfer'),
     ('Utilities', 'Bills & Utilities'),
@@ -117,32 +143,247 @@ Categories = (
 )
 
 
+class TransactionQuerySet(models.QuerySet):
+    def for_listing(self):
+        # only the columns the transaction list pages render, with both users joined in
+        return self.select_related('creator', 'receiver').only(
+            'transaction_id', 'transaction_type', 'category', 'amount', 'description', 'create_date',
+            'is_complete', 'creator__username', 'receiver__username')
+
+
 class Transaction(models.Model):
     transaction_id = models.AutoField(primary_key=True)
     transaction_type = models.CharField(max_length=45, choices=Transaction_Type, default='')
     category = models.CharField(max_length=45, choices=Categories)
-    amount = models.FloatField(default=0.00)
+    amount = MoneyField(default=0)
     description = models.CharField(max_length=200, default=False)
     create_date = models.DateTimeField(default=now, editable=False)
     is_complete = models.BooleanField(default=False)
-    receiver = models.ForeignKey(User, related_name='receiver', on_delete=models.PROTECT, default='')
-    creator = models.ForeignKey(User, related_name='creator', on_delete=models.PROTECT, default='')
+    # indexed through the composite indexes in Meta
+    receiver = models.ForeignKey(User, related_name='receiver', on_delete=models.PROTECT, default='',
+                                 db_index=False)
+    creator = models.ForeignKey(User, related_name='creator', on_delete=models.PROTECT, default='',
+                                db_index=False)
     payment_method = models.ForeignKey(PaymentMethod, related_name='payment_method',
                                        on_delete=models.PROTECT, default='', null=True)
 
+    objects = TransactionQuerySet.as_manager()
+
     def get_absolute_url(self):
         return reverse('staff_tran_detail', kwargs={'pk': self.pk})
 
     def get_delete_url(self):
         return reverse('staff_tran_delete', kwargs={'pk': self.pk})
 
-    def save(self, *args, **kwargs):
-        # ensure that the database only stores 2 decimal places
-        self.amount = round(self.amount, 2)
-        super(Transaction, self).save(*args, **kwargs)
+    def payer_and_payee(self):
+        # ids of the users money moves from and to; a request is paid by its receiver
+        if self.transaction_type == 'request':
+            return self.receiver_id, self.creator_id
+        return self.creator_id, self.receiver_id
 
     def __str__(self):
         return str(self.transaction_id)
 
     class Meta:
-        ordering = ['category']
+        # newest first, the order every transaction page displays
+        ordering = ['-create_date', '-transaction_id']
+        indexes = [
+            models.Index(fields=['creator', 'is_complete', 'transaction_type', '-create_date', '-transaction_id'],
+                         name='transaction_creator_idx'),
+            models.Index(fields=['receiver', 'is_complete', 'transaction_type', '-create_date', '-transaction_id'],
+                         name='transaction_receiver_idx'),
+            # staff browsing of all transactions, optionally narrowed to a type or category
+            models.Index(fields=['-create_date', '-transaction_id'], name='transaction_date_idx'),
+            models.Index(fields=['transaction_type', '-create_date', '-transaction_id'],
+                         name='transaction_type_date_idx'),
+            models.Index(fields=['category', '-create_date', '-transaction_id'],
+                         name='transaction_category_date_idx'),
+        ]
+
+
+Directions = (
+    ('in', 'Received'),
+    ('out', 'Spent'),
+)
+
+
+class SpendingSummary(models.Model):
+    # completed transactions per user, month, category and direction, kept up to date by app.summaries
+    user = models.ForeignKey(User, related_name='spending_summary', on_delete=models.CASCADE)
+    month = models.DateField()
+    category = models.CharField(max_length=45, choices=Categories)
+    direction = models.CharField(max_length=3, choices=Directions)
+    total = MoneyField(default=0)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '%s %s %s %s' % (self.user_id, self.month, self.category, self.direction)
+
+    class Meta:
+        unique_together = ('user', 'month', 'category', 'direction')
+        ordering = ['-month', 'category', 'direction']
+
+
+Entry_Kind = (
+    ('opening', 'Opening Balance'),
+    ('send', 'Send'),
+    ('payment', 'Request Payment'),
+    ('reversal', 'Reversal'),
+    ('withdrawal', 'Withdrawal'),
+)
+
+
+class LedgerEntry(models.Model):
+    # One posting of a money movement. The postings of a movement add up to zero:
+    # wallet accounts, banks and cards are identified by their payment method, and
+    # money entering or leaving the app without one is posted with payment=None.
+    # Entries are only ever inserted.
+    entry_id = models.BigAutoField(primary_key=True)
+    payment = models.ForeignKey(PaymentMethod, related_name='ledger_entry', on_delete=models.PROTECT,
+                                null=True, db_index=False)
+    transaction = models.ForeignKey(Transaction, related_name='ledger_entry', on_delete=models.DO_NOTHING,
+                                    null=True, db_constraint=False)
+    kind = models.CharField(max_length=45, choices=Entry_Kind)
+    amount = MoneyField(default=0)
+    create_date = models.DateTimeField(default=now, editable=False)
+
+    def __str__(self):
+        return str(self.entry_id)
+
+    class Meta:
+        ordering = ['entry_id']
+        indexes = [
+            models.Index(fields=['payment', 'entry_id'], name='ledger_entry_payment_idx'),
+        ]
+
+
+class BalanceSnapshot(models.Model):
+    # balance of a wallet account after all entries up to and including last_entry_id
+    payment = models.ForeignKey(PaymentMethod, related_name='balance_snapshot', on_delete=models.CASCADE,
+                                db_index=False)
+    balance = MoneyField(default=0)
+    last_entry_id = models.BigIntegerField()
+    create_date = models.DateTimeField(default=now, editable=False)
+
+    def __str__(self):
+        return '%s @ %s' % (self.payment_id, self.last_entry_id)
+
+    class Meta:
+        unique_together = ('payment', 'last_entry_id')
+
+
+class Counterparty(models.Model):
+    # someone a user sent money to or requested money from, kept by app.counterparties
+    user = models.ForeignKey(User, related_name='counterparty', on_delete=models.CASCADE)
+    counterparty = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+    last_date = models.DateTimeField(default=now)
+
+    def __str__(self):
+        return '%s -> %s' % (self.user_id, self.counterparty_id)
+
+    class Meta:
+        unique_together = ('user', 'counterparty')
+        ordering = ['-last_date']
+
+
+class IdempotencyKey(models.Model):
+    # The first response to a POST that carried this key, replayed to retries of the
+    # same request. Kept by app.idempotency and purged once older than its TTL.
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, db_index=False)
+    key = models.CharField(max_length=64)
+    path = models.CharField(max_length=255)
+    status = models.PositiveSmallIntegerField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    location = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)
+    create_date = models.DateTimeField(default=now, editable=False, db_index=True)
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+
+class ScheduledPayment(models.Model):
+    # A send repeated every interval from start_at, made by app.scheduler. Occurrences
+    # are counted from start_at, so monthly payments keep their day of the month.
+    user = models.ForeignKey(User, related_name='scheduled_payments', on_delete=models.CASCADE)
+    receiver = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    payment_method = models.ForeignKey(PaymentMethod, related_name='+', on_delete=models.CASCADE)
+    category = models.CharField(max_length=45, choices=Categories)
+    amount = MoneyField(default=0)
+    description = models.CharField(max_length=200, blank=True, default='')
+    interval = models.CharField(max_length=10, choices=Intervals)
+    start_at = models.DateTimeField()
+    # occurrences paid or passed so far, and when the next one is due
+    run_count = models.PositiveIntegerField(default=0)
+    next_run_at = models.DateTimeField()
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    # failures in a row; the schedule is stopped after app.scheduler.MAX_FAILURES
+    failure_count = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True, default='')
+    is_active = models.BooleanField(default=True)
+    create_date = models.DateTimeField(default=now, editable=False)
+
+    def __str__(self):
+        return '%s -> %s, %s' % (self.user_id, self.receiver_id, self.interval)
+
+    class Meta:
+        ordering = ['next_run_at']
+        indexes = [
+            # the scheduler's due schedules, oldest first
+            models.Index(fields=['next_run_at'], name='schedule_due_idx', condition=models.Q(is_active=True)),
+        ]
+
+
+class Job(models.Model):
+    # A call of task (the dotted path of a function) with payload, queued by app.jobs in
+    # the transaction of the change it follows and run by manage.py run_jobs. Jobs are
+    # deleted once done; those that failed app.jobs.MAX_ATTEMPTS times are kept as dead.
+    task = models.CharField(max_length=255)
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=JobStatuses, default='pending')
+    # when a pending job is due; a claimed one is leased to its worker until then
+    run_at = models.DateTimeField(default=now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_by = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    create_date = models.DateTimeField(default=now, editable=False)
+
+    def __str__(self):
+        return '%s %s' % (self.task, self.status)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            # the jobs workers claim, oldest first
+            models.Index(fields=['run_at', 'id'], name='job_due_idx', condition=models.Q(status='pending')),
+        ]
+
+
+class Notification(models.Model):
+    # Tells user that actor sent them money, requested money from them or paid their
+    # request. Written by app.notifications once the transaction commits; it outlives
+    # the transaction, so it keeps the amount and description.
+    user = models.ForeignKey(User, related_name='notifications', on_delete=models.CASCADE, db_index=False)
+    actor = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    transaction = models.ForeignKey(Transaction, related_name='+', on_delete=models.SET_NULL, null=True,
+                                    blank=True)
+    kind = models.CharField(max_length=10, choices=NotificationKinds)
+    amount = MoneyField(default=0)
+    description = models.CharField(max_length=200, blank=True, default='')
+    is_read = models.BooleanField(default=False)
+    create_date = models.DateTimeField(default=now, editable=False)
+
+    def __str__(self):
+        return '%s: %s' % (self.user_id, self.kind)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            # a user's inbox, newest first, and their unread ones
+            models.Index(fields=['user', '-id'], name='notification_user_idx'),
+            models.Index(fields=['user'], name='notification_unread_idx', condition=models.Q(is_read=False)),
+        ]
@@ -0,0 +1,95 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from . import jobs
+from .models import Notification, Transaction
+
+# The unread count of the badge in app/base.html is cached per user and dropped when it
+# changes. Notifications written by manage.py run_jobs only drop it in the web processes
+# when they share the cache (e.g. memcached); with a local memory cache, UNREAD_TIMEOUT
+# bounds how long a badge can lag.
+UNREAD_TIMEOUT = 60
+# a long poll waits at most MAX_WAIT seconds, looking every POLL_INTERVAL seconds
+MAX_WAIT = 30
+POLL_INTERVAL = 1.0
+# transactions read per query by record_queued()
+BATCH_SIZE = 200
+
+
+def _key(user_id):
+    return 'notifications:unread:%s' % user_id
+
+
+def unread_count(user):
+    user_id = getattr(user, 'pk', user)
+    count = cache.get(_key(user_id))
+    if count is None:
+        count = Notification.objects.filter(user=user_id, is_read=False).count()
+        cache.set(_key(user_id), count, UNREAD_TIMEOUT)
+    return count
+
+
+def invalidate(*users):
+    keys = [_key(getattr(user, 'pk', user)) for user in users]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def inbox(user):
+    return Notification.objects.filter(user=user).select_related('actor')
+
+
+# tell the users concerned about the saved transactions trans in a job, once their
+# transaction commits; kind is 'send', 'request' or 'payment'
+def queue(kind, *trans):
+    jobs.enqueue(record_queued, {'kind': kind, 'transactions': [tran.pk for tran in trans]})
+
+
+def _recipient(kind, tran):
+    # (user, actor): the receiver of a send or request hears of it, the creator of a
+    # request of its payment
+    if kind == 'payment':
+        return tran.creator_id, tran.receiver_id
+    return tran.receiver_id, tran.creator_id
+
+
+def record_queued(payloads):
+    wanted = [(payload['kind'], pk) for payload in payloads for pk in payload['transactions']]
+    ids = list({pk for kind, pk in wanted})
+    trans = {}
+    for start in range(0, len(ids), BATCH_SIZE):
+        trans.update(Transaction.objects.only('creator', 'receiver', 'amount', 'description').in_bulk(
+            ids[start:start + BATCH_SIZE]))
+
+    notifications = []
+    # a transaction deleted meanwhile is not told of
+    for kind, pk in wanted:
+        if pk in trans:
+            user, actor = _recipient(kind, trans[pk])
+            notifications.append(Notification(user_id=user, actor_id=actor, transaction_id=pk, kind=kind,
+                                              amount=trans[pk].amount, description=trans[pk].description))
+    Notification.objects.bulk_create(notifications)
+    invalidate(*{notification.user_id for notification in notifications})
+
+
+# mark the unread notifications of user read, up to the newest one they have seen
+def mark_read(user, up_to=None):
+    rows = Notification.objects.filter(user=user, is_read=False)
+    if up_to is not None:
+        rows = rows.filter(pk__lte=up_to)
+    count = rows.update(is_read=True)
+    if count:
+        invalidate(user)
+    return count
+
+
+# The notifications of user after after_id, oldest first. Without any, waits up to wait
+# seconds for one to arrive; every look is one short range scan of the inbox index.
+def wait_for(user, after_id, wait=0, limit=100):
+    deadline = time.monotonic() + (min(wait, MAX_WAIT) if wait > 0 else 0)
+    while True:
+        rows = list(inbox(user).filter(pk__gt=after_id).order_by('pk')[:limit])
+        if rows or time.monotonic() >= deadline:
+            return rows
+        time.sleep(POLL_INTERVAL)
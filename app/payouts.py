@@ -0,0 +1,96 @@
+import csv
+import time
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+
+from . import ledger
+from .form import RequestMoneyForm
+from .ledger import TransferError
+
+CSV_FIELDS = ('username', 'amount', 'category', 'description')
+CHUNK_SIZE = 500
+
+# line is the line of the row in the CSV file, for reporting
+Payout = namedtuple('Payout', ('line', 'username', 'amount', 'category', 'description'))
+Failure = namedtuple('Failure', ('line', 'username', 'error'))
+
+
+class PayoutResult:
+    def __init__(self):
+        self.sent = []
+        self.failures = []
+        self.elapsed = 0.0
+
+    @property
+    def per_second(self):
+        return len(self.sent) / self.elapsed if self.elapsed else 0.0
+
+
+# Payouts from the rows of a CSV file with a header of at least CSV_FIELDS, and a
+# Failure for every row that cannot be read
+def read_csv(lines):
+    payouts, failures = [], []
+    reader = csv.DictReader(lines)
+    missing = set(CSV_FIELDS) - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError('The CSV header is missing: %s.' % ', '.join(sorted(missing)))
+    for row in reader:
+        if None in row.values() or None in row:
+            failures.append(Failure(reader.line_num, row.get('username'), 'The row does not match the header.'))
+            continue
+        payouts.append(Payout(reader.line_num, *[row[field].strip() for field in CSV_FIELDS]))
+    return payouts, failures
+
+
+def _validate(payouts, payer, payment_method, result):
+    # one query for every receiver; the fields are checked by the same form as money requests
+    receivers = User.objects.in_bulk({payout.username for payout in payouts}, field_name='username')
+    trans = []
+    for payout in payouts:
+        receiver = receivers.get(payout.username)
+        if receiver is None:
+            result.failures.append(Failure(payout.line, payout.username, 'No user found.'))
+            continue
+        form = RequestMoneyForm({'amount': payout.amount, 'category': payout.category,
+                                 'description': payout.description})
+        if not form.is_valid():
+            errors = '; '.join('%s: %s' % (field, ' '.join(messages)) for field, messages in form.errors.items())
+            result.failures.append(Failure(payout.line, payout.username, errors))
+            continue
+        tran = form.save(commit=False)
+        tran.creator = payer
+        tran.receiver = receiver
+        tran.payment_method = payment_method
+        trans.append((payout, tran))
+    return trans
+
+
+# Send every payout from payment_method, a payment method of payer. Payouts are made in
+# chunks, each in its own database transaction. A chunk that fails is retried one payout
+# at a time, so a bad row only fails itself and everything else is still sent.
+def send_payouts(payer, payment_method, payouts, chunk_size=CHUNK_SIZE):
+    result = PayoutResult()
+    start = time.perf_counter()
+    trans = _validate(payouts, payer, payment_method, result)
+
+    for offset in range(0, len(trans), chunk_size):
+        chunk = trans[offset:offset + chunk_size]
+        try:
+            ledger.send_many([tran for payout, tran in chunk])
+            result.sent.extend(chunk)
+            continue
+        except (TransferError, DatabaseError):
+            pass
+        for payout, tran in chunk:
+            tran.pk = None
+            try:
+                ledger.send_money(tran)
+                result.sent.append((payout, tran))
+            except (TransferError, DatabaseError) as e:
+                result.failures.append(Failure(payout.line, payout.username, str(e)))
+
+    result.failures.sort()
+    result.elapsed = time.perf_counter() - start
+    return result
@@ -0,0 +1,157 @@
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import connections
+
+# Per view wall time, query count, query time and response size of the most recent
+# requests, kept in memory by each server process. Requests slower than
+# PROFILING_SLOW_MS also get the stacks of their thread sampled while they run.
+# Queries that app.utils runs on worker threads for a request count towards it.
+
+# upper bounds of the wall time histogram buckets, in milliseconds
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+SLOW_REQUESTS = 50
+STACK_DEPTH = 30
+
+_requests = deque(maxlen=getattr(settings, 'PROFILING_BUFFER_SIZE', 10000))
+_slow = deque(maxlen=SLOW_REQUESTS)
+# thread id: [start, path, stack sample counter] of the requests being served; _busy is
+# set while there are any, and the sampler thread sleeps on it otherwise
+_in_flight = {}
+_busy = threading.Event()
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+class _QueryTimer:
+    # called from the worker threads of app.utils.run_concurrently() too
+    __slots__ = ('count', 'time', 'lock')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.time += time.perf_counter() - start
+                self.count += 1
+
+
+def _sample_stacks(interval, slow):
+    while True:
+        _busy.wait()
+        time.sleep(interval)
+        now = time.perf_counter()
+        running = [(thread_id, samples) for thread_id, (start, path, samples) in list(_in_flight.items())
+                   if now - start >= slow]
+        if not running:
+            continue
+        frames = sys._current_frames()
+        for thread_id, samples in running:
+            frame = frames.get(thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame, limit=STACK_DEPTH)
+                samples[''.join(traceback.format_list(stack))] += 1
+
+
+def _start_sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            interval = getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.01)
+            slow = getattr(settings, 'PROFILING_SLOW_MS', 500) / 1000
+            _sampler = threading.Thread(target=_sample_stacks, args=(interval, slow), name='profiling-sampler',
+                                        daemon=True)
+            _sampler.start()
+
+
+def _enter(thread_id, request):
+    with _sampler_lock:
+        _in_flight[thread_id] = request
+        _busy.set()
+
+
+def _leave(thread_id):
+    with _sampler_lock:
+        _in_flight.pop(thread_id, None)
+        if not _in_flight:
+            _busy.clear()
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow = getattr(settings, 'PROFILING_SLOW_MS', 500)
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        thread_id = threading.get_ident()
+        samples = Counter()
+        if self.slow is not None:
+            _start_sampler()
+        start = time.perf_counter()
+        _enter(thread_id, (start, request.path, samples))
+        try:
+            with connections['default'].execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            _leave(thread_id)
+        wall = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        view = (match.view_name if match else None) or 'unresolved'
+        size = None if response.streaming else len(response.content)
+        _requests.append((view, wall, timer.count, timer.time * 1000, size, response.status_code))
+        if samples:
+            _slow.append({'view': view, 'path': request.path, 'wall_ms': round(wall, 1),
+                          'queries': timer.count, 'stacks': samples.most_common(5)})
+        return response
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# per view percentiles and histogram of the requests in the buffer, slowest p95 first
+def report():
+    by_view = {}
+    for view, wall, queries, db_time, size, status in list(_requests):
+        by_view.setdefault(view, []).append((wall, queries, db_time, size, status))
+
+    views = []
+    for view, rows in by_view.items():
+        walls = sorted(row[0] for row in rows)
+        db_times = sorted(row[2] for row in rows)
+        sizes = [row[3] for row in rows if row[3] is not None]
+        histogram = [0] * (len(BUCKETS) + 1)
+        for wall in walls:
+            histogram[next((i for i, bound in enumerate(BUCKETS) if wall < bound), len(BUCKETS))] += 1
+        views.append({
+            'view': view,
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if row[4] >= 500),
+            'p50_ms': round(_percentile(walls, 0.5), 1),
+            'p95_ms': round(_percentile(walls, 0.95), 1),
+            'p99_ms': round(_percentile(walls, 0.99), 1),
+            'queries_mean': round(sum(row[1] for row in rows) / len(rows), 1),
+            'queries_max': max(row[1] for row in rows),
+            'db_p95_ms': round(_percentile(db_times, 0.95), 1),
+            'size_mean': round(sum(sizes) / len(sizes)) if sizes else None,
+            'histogram': histogram,
+        })
+    views.sort(key=lambda view: view['p95_ms'], reverse=True)
+    return {'buckets_ms': list(BUCKETS), 'views': views, 'slow_requests': list(_slow)}
+
+
+def reset():
+    _requests.clear()
+    _slow.clear()
@@ -0,0 +1,175 @@
+import csv
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.contrib.auth.models import Group, User
+from django.db import DatabaseError, transaction
+
+from . import search
+from .form import UserImportForm
+from .models import Account, PaymentMethod, Profile
+
+CSV_FIELDS = ('username', 'first_name', 'last_name', 'email', 'password', 'birthday', 'address')
+CHUNK_SIZE = 500
+
+# line is the line of the row in the CSV file, or its position in an API request, for reporting
+Registration = namedtuple('Registration', ('line',) + CSV_FIELDS)
+Failure = namedtuple('Failure', ('line', 'username', 'error'))
+
+_normal_group_id = None
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = []
+        self.failures = []
+        self.elapsed = 0.0
+
+    @property
+    def per_second(self):
+        return len(self.created) / self.elapsed if self.elapsed else 0.0
+
+
+def normal_group_id():
+    # the group every new user joins; it is created by the migrations and never changes
+    global _normal_group_id
+    if _normal_group_id is None:
+        _normal_group_id = Group.objects.values_list('pk', flat=True).get(name='normal_user')
+    return _normal_group_id
+
+
+def password_hasher(iterations=None):
+    # Imports can hash with fewer PBKDF2 iterations than the default, which is most of
+    # their cost. Django hashes such a password again with the full cost the first time
+    # its user logs in.
+    if iterations is None:
+        iterations = getattr(settings, 'IMPORT_PASSWORD_ITERATIONS', None)
+    if iterations is None:
+        return 'default'
+    hasher = PBKDF2PasswordHasher()
+    hasher.iterations = iterations
+    return hasher
+
+
+def _save(user, birthday, address):
+    user.save()
+    User.groups.through.objects.create(user=user, group_id=normal_group_id())
+    Profile.objects.create(user=user, birthday=birthday, address=address)
+    payment = PaymentMethod.objects.create(user=user, method_type='account')
+    Account.objects.create(payment=payment)
+
+
+# Save user, new and unsaved, with everything a wallet user starts with: the
+# normal_user group, a profile and an empty wallet account. One INSERT each, in one
+# database transaction, so a failure leaves no half registered user behind.
+def register(user, password, birthday, address, hasher='default'):
+    user.password = make_password(password, hasher=hasher)
+    with transaction.atomic():
+        _save(user, birthday, address)
+    return user
+
+
+# Registrations from the rows of a CSV file with a header of at least CSV_FIELDS, and
+# a Failure for every row that cannot be read
+def read_csv(lines):
+    registrations, failures = [], []
+    reader = csv.DictReader(lines)
+    missing = set(CSV_FIELDS) - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError('The CSV header is missing: %s.' % ', '.join(sorted(missing)))
+    for row in reader:
+        if None in row.values() or None in row:
+            failures.append(Failure(reader.line_num, row.get('username'), 'The row does not match the header.'))
+            continue
+        registrations.append(Registration(reader.line_num, *[row[field].strip() for field in CSV_FIELDS]))
+    return registrations, failures
+
+
+def _validate(registrations, result):
+    # every row is checked by the registration form; usernames in one query for all rows
+    valid = []
+    for registration in registrations:
+        data = registration._asdict()
+        data['confirm_password'] = registration.password
+        form = UserImportForm(data)
+        if not form.is_valid():
+            errors = '; '.join('%s: %s' % (field, ' '.join(messages)) for field, messages in form.errors.items())
+            result.failures.append(Failure(registration.line, registration.username, errors))
+            continue
+        valid.append((registration, form))
+
+    taken = set(User.objects.in_bulk({form.cleaned_data['username'] for registration, form in valid},
+                                     field_name='username'))
+    forms = []
+    for registration, form in valid:
+        username = form.cleaned_data['username']
+        if username in taken:
+            result.failures.append(Failure(registration.line, username, 'A user with that username already exists.'))
+            continue
+        taken.add(username)
+        forms.append((registration, form))
+    return forms
+
+
+def _create_many(users, profiles):
+    # users and profiles are parallel lists of unsaved rows; the new primary keys are
+    # looked up by the unique usernames, which works on every backend
+    group_id = normal_group_id()
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        pks = {user.username: user.pk for user in User.objects.in_bulk([user.username for user in users],
+                                                                       field_name='username').values()}
+        for user in users:
+            user.pk = pks[user.username]
+        User.groups.through.objects.bulk_create(User.groups.through(user_id=user.pk, group_id=group_id)
+                                                for user in users)
+        for user, profile in zip(users, profiles):
+            profile.user = user
+        Profile.objects.bulk_create(profiles)
+        PaymentMethod.objects.bulk_create(PaymentMethod(user=user, method_type='account') for user in users)
+        # a range rather than a list of ids keeps any chunk size within the backend's parameter limit
+        pks = [user.pk for user in users]
+        payments = dict(PaymentMethod.objects.filter(user__gte=min(pks), user__lte=max(pks), method_type='account')
+                        .values_list('user_id', 'pk'))
+        Account.objects.bulk_create(Account(payment_id=payments[pk]) for pk in pks)
+        # bulk_create() sends no post_save signals
+        search.index_users(users)
+
+
+# register() for many users, iterations as for password_hasher(). Users are created in
+# chunks, each with a handful of bulk INSERTs in its own database transaction. A chunk
+# that fails is retried one user at a time, so a bad row only fails itself.
+def register_many(registrations, chunk_size=CHUNK_SIZE, iterations=None):
+    result = ImportResult()
+    start = time.perf_counter()
+    forms = _validate(registrations, result)
+    hasher = password_hasher(iterations)
+
+    for offset in range(0, len(forms), chunk_size):
+        chunk = []
+        for registration, form in forms[offset:offset + chunk_size]:
+            user = form.save(commit=False)
+            user.password = make_password(form.cleaned_data['password'], hasher=hasher)
+            profile = Profile(birthday=form.cleaned_data['birthday'], address=form.cleaned_data['address'])
+            chunk.append((registration, user, profile))
+        try:
+            _create_many([user for registration, user, profile in chunk],
+                         [profile for registration, user, profile in chunk])
+            result.created.extend((registration, user) for registration, user, profile in chunk)
+            continue
+        except DatabaseError:
+            pass
+        for registration, user, profile in chunk:
+            user.pk = None
+            try:
+                with transaction.atomic():
+                    _save(user, profile.birthday, profile.address)
+                result.created.append((registration, user))
+            except DatabaseError as e:
+                result.failures.append(Failure(registration.line, user.username, str(e)))
+
+    result.failures.sort()
+    result.elapsed = time.perf_counter() - start
+    return result
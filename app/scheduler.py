@@ -0,0 +1,175 @@
+import calendar
+import time
+from datetime import timedelta
+
+from django.db import DatabaseError, connection, transaction
+from django.utils.timezone import now as current_time
+
+from . import ledger
+from .ledger import TransferError
+from .models import Account, ScheduledPayment, Transaction
+
+BATCH_SIZE = 500
+# schedules claimed per UPDATE, within SQLite's limit on query parameters
+CLAIM_BATCH_SIZE = 500
+# a failed payment is tried again this much later, and the schedule stops after
+# MAX_FAILURES failures in a row
+RETRY_DELAY = timedelta(hours=1)
+MAX_FAILURES = 3
+
+
+class RunResult:
+    def __init__(self):
+        self.sent = 0
+        # (schedule id, error)
+        self.failures = []
+        self.elapsed = 0.0
+
+    @property
+    def per_second(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+
+class _Contended(Exception):
+    pass
+
+
+# the n-th occurrence of a schedule; monthly ones fall on the last day of shorter months
+def occurrence(start_at, interval, n):
+    if interval == 'weekly':
+        return start_at + timedelta(weeks=n)
+    month = start_at.month - 1 + n
+    year, month = start_at.year + month // 12, month % 12 + 1
+    return start_at.replace(year=year, month=month, day=min(start_at.day, calendar.monthrange(year, month)[1]))
+
+
+# Repeat the send tran every interval from now on. tran is the first payment, so the
+# schedule starts with its second.
+def schedule_send(tran, interval):
+    return ScheduledPayment.objects.create(
+        user=tran.creator, receiver=tran.receiver, payment_method=tran.payment_method, category=tran.category,
+        amount=tran.amount, description=tran.description, interval=interval, start_at=tran.create_date,
+        run_count=1, next_run_at=occurrence(tran.create_date, interval, 1))
+
+
+# send tran like SendMoney does and, with an interval, repeat it from then on
+def send(tran, interval=None):
+    # The receiver's wallet is looked up before the transaction starts. Once a SQLite
+    # transaction has read, its first write fails at once with "database is locked" if
+    # another connection is writing, instead of waiting for it.
+    wallets = ledger.wallet_payments(tran.receiver)
+    with transaction.atomic():
+        ledger.send_money(tran, wallets)
+        if interval:
+            schedule_send(tran, interval)
+    return tran
+
+
+def due(now=None):
+    return ScheduledPayment.objects.filter(is_active=True, next_run_at__lte=now or current_time())
+
+
+def _claim(schedules, now):
+    # Mark schedules as being run, and count those still due. A second scheduler that
+    # read the same schedules waits for this transaction and then finds them advanced.
+    claimed = 0
+    ids = [schedule.pk for schedule in schedules]
+    for start in range(0, len(ids), CLAIM_BATCH_SIZE):
+        claimed += due(now).filter(pk__in=ids[start:start + CLAIM_BATCH_SIZE]).update(last_run_at=now)
+    return claimed
+
+
+def _advance(schedules, now):
+    # a scheduler that was down pays once and skips the occurrences it missed
+    for schedule in schedules:
+        while schedule.next_run_at <= now:
+            schedule.run_count += 1
+            schedule.next_run_at = occurrence(schedule.start_at, schedule.interval, schedule.run_count)
+        schedule.last_run_at = now
+        schedule.failure_count = 0
+        schedule.last_error = ''
+    # Every schedule gets its own next_run_at. One UPDATE by primary key each, through
+    # executemany(), is much cheaper than the CASE expression bulk_update() compiles.
+    adapt, quote = connection.ops.adapt_datetimefield_value, connection.ops.quote_name
+    columns = [ScheduledPayment._meta.get_field(field).column
+               for field in ('run_count', 'next_run_at', 'last_run_at', 'failure_count', 'last_error')]
+    with connection.cursor() as cursor:
+        cursor.executemany('UPDATE %s SET %s WHERE %s = %%s' % (
+            quote(ScheduledPayment._meta.db_table), ', '.join('%s = %%s' % quote(column) for column in columns),
+            quote(ScheduledPayment._meta.pk.column)),
+            [(schedule.run_count, adapt(schedule.next_run_at), adapt(now), 0, '', schedule.pk)
+             for schedule in schedules])
+
+
+def _fail(schedule, now, error):
+    schedule.failure_count += 1
+    schedule.last_error = str(error)[:255]
+    schedule.last_run_at = now
+    schedule.next_run_at = now + RETRY_DELAY
+    schedule.is_active = schedule.failure_count < MAX_FAILURES
+    # unless another scheduler has paid it meanwhile
+    due(now).filter(pk=schedule.pk).update(
+        failure_count=schedule.failure_count, last_error=schedule.last_error, last_run_at=now,
+        next_run_at=schedule.next_run_at, is_active=schedule.is_active)
+
+
+def _transaction(schedule):
+    return Transaction(creator=schedule.user, receiver=schedule.receiver, payment_method=schedule.payment_method,
+                       category=schedule.category, amount=schedule.amount, description=schedule.description)
+
+
+def _run_batch(schedules, now, result):
+    # SendMoney refuses wallet accounts with nothing in them, so does the scheduler
+    balances = dict(Account.objects.filter(payment__in={schedule.payment_method_id for schedule in schedules})
+                    .values_list('payment_id', 'balance'))
+    payable = []
+    for schedule in schedules:
+        if schedule.payment_method.method_type == 'account' and balances.get(schedule.payment_method_id, 0) <= 0:
+            _fail(schedule, now, 'Insufficient balance.')
+            result.failures.append((schedule.pk, 'Insufficient balance.'))
+        else:
+            payable.append(schedule)
+    if not payable:
+        return
+
+    try:
+        with transaction.atomic():
+            if _claim(payable, now) != len(payable):
+                raise _Contended()
+            ledger.send_many([_transaction(schedule) for schedule in payable])
+            _advance(payable, now)
+        result.sent += len(payable)
+        return
+    except (_Contended, TransferError, DatabaseError):
+        pass
+
+    # one at a time, so a schedule that cannot be paid only fails itself
+    for schedule in payable:
+        try:
+            with transaction.atomic():
+                if not _claim([schedule], now):
+                    continue
+                ledger.send_money(_transaction(schedule))
+                _advance([schedule], now)
+            result.sent += 1
+        except (TransferError, DatabaseError) as e:
+            _fail(schedule, now, e)
+            result.failures.append((schedule.pk, str(e)))
+
+
+# Pay every schedule due at now, oldest first, batch_size at a time: each batch is
+# claimed, paid with ledger.send_many() and advanced in one database transaction.
+# Stops early once max_seconds have passed; the rest are left for the next run.
+def run_due(now=None, batch_size=BATCH_SIZE, max_seconds=None):
+    now = now or current_time()
+    result = RunResult()
+    start = time.perf_counter()
+    schedules = due(now).select_related('user', 'receiver', 'payment_method').order_by('next_run_at', 'pk')
+    while max_seconds is None or time.perf_counter() - start < max_seconds:
+        batch = list(schedules[:batch_size])
+        if not batch:
+            break
+        _run_batch(batch, now, result)
+    result.failures.sort()
+    result.elapsed = time.perf_counter() - start
+    return result
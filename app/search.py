@@ -0,0 +1,92 @@
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+
+# On SQLite, migration 0014 creates this FTS5 table, one row per user keyed by the
+# user id. app.signals keeps it in sync with saves and deletes of users; bulk writes
+# that bypass the signals need a rebuild_user_search afterwards.
+SEARCH_TABLE = 'app_user_search'
+SEARCH_FIELDS = ('username', 'first_name', 'last_name', 'email')
+# username matches count most, email matches least
+SEARCH_WEIGHTS = (10.0, 2.0, 2.0, 1.0)
+MAX_RESULTS = 10
+MAX_TERMS = 5
+
+# the FTS5 unicode61 tokenizer splits on everything but letters and digits
+_TERM = re.compile(r'[^\W_]+')
+_has_index = None
+
+
+def has_index():
+    global _has_index
+    if _has_index is None:
+        _has_index = connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names()
+    return _has_index
+
+
+def index_user(user):
+    if has_index():
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT OR REPLACE INTO %s (rowid, %s) VALUES (%%s, %%s, %%s, %%s, %%s)' % (
+                SEARCH_TABLE, ', '.join(SEARCH_FIELDS)), [user.pk] + [getattr(user, field) for field in SEARCH_FIELDS])
+
+
+def index_users(users):
+    if has_index():
+        with connection.cursor() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO %s (rowid, %s) VALUES (%%s, %%s, %%s, %%s, %%s)' % (
+                SEARCH_TABLE, ', '.join(SEARCH_FIELDS)),
+                [[user.pk] + [getattr(user, field) for field in SEARCH_FIELDS] for user in users])
+
+
+def unindex_user(user_id):
+    if has_index():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid = %%s' % SEARCH_TABLE, [user_id])
+
+
+def rebuild():
+    if has_index():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % SEARCH_TABLE)
+            cursor.execute('INSERT INTO %s (rowid, %s) SELECT id, %s FROM %s' % (
+                SEARCH_TABLE, ', '.join(SEARCH_FIELDS), ', '.join(SEARCH_FIELDS), User._meta.db_table))
+            cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (SEARCH_TABLE, SEARCH_TABLE))
+
+
+def _match_ids(terms, limit):
+    # Every term must start a word of one of the fields, best matches first. All matches
+    # are scored, so a prefix common to many users costs more, but the ones returned are
+    # the best of them and not of whichever matched first.
+    match = ' '.join('"%s"*' % term for term in terms)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT rowid FROM %s WHERE %s MATCH %%s ORDER BY bm25(%s, %s) LIMIT %%s' % (
+            SEARCH_TABLE, SEARCH_TABLE, SEARCH_TABLE, ', '.join(map(str, SEARCH_WEIGHTS))), [match, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+# Active users whose username, first name, last name or email has a word starting with
+# each word of query, case-insensitively; at most limit of them, the exact username first
+def search_users(query, limit=MAX_RESULTS):
+    terms = _TERM.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return []
+
+    if has_index():
+        # a little slack for the inactive users dropped below
+        ids = _match_ids(terms, limit + 5)
+        users = User.objects.in_bulk(ids)
+        results = [users[pk] for pk in ids if pk in users and users[pk].is_active]
+    else:
+        condition = Q(is_active=True)
+        for term in terms:
+            condition &= Q(*[Q(**{'%s__istartswith' % field: term}) for field in SEARCH_FIELDS], _connector=Q.OR)
+        results = list(User.objects.filter(condition).order_by('username')[:limit])
+
+    # the exact username may be missing from a crowded prefix, so it is looked up by itself
+    exact = User.objects.filter(username=query.strip(), is_active=True).first()
+    if exact is not None:
+        results = [exact] + [user for user in results if user.pk != exact.pk]
+    return results[:limit]
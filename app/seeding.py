@@ -0,0 +1,211 @@
+import random
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from multiprocessing import get_context
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from . import counterparties, search, summaries
+from .models import Account, Bank, Card, Categories, LedgerEntry, PaymentMethod, Profile, Transaction
+
+# Synthetic users with a profile, a wallet account, a bank and a card each, and
+# transactions between them, written with executemany() in large batches. Rows are
+# generated in chunks, each from its own random stream derived from the seed, so the
+# same seed gives the same data however many worker processes generate the chunks;
+# only the dates move along with the day the data is seeded on.
+
+PASSWORD = 'password'
+CHUNK_SIZE = 20000
+# from this many transactions on, the transaction indexes are built after the rows are in
+INDEX_DEFERRAL = 100000
+FIRST_NAMES = ('anna', 'bruno', 'chen', 'daniel', 'elena', 'farid', 'grace', 'hiro', 'ines', 'jamal',
+               'kate', 'li', 'maria', 'nikolai', 'olga', 'pinhuey', 'quinn', 'rosa', 'sven', 'tomas')
+LAST_NAMES = ('smith', 'garcia', 'chiang', 'nguyen', 'mueller', 'rossi', 'kim', 'novak', 'silva', 'tanaka')
+CATEGORIES = [category for category, _ in Categories]
+
+# what the worker processes need to generate a chunk; datetimes are naive UTC
+Plan = namedtuple('Plan', ('seed', 'users', 'first_user', 'first_payment', 'password', 'normal_group', 'now'))
+
+
+class SeedResult:
+    def __init__(self):
+        self.user_ids = []
+        self.staff_ids = []
+        self.rows = 0
+        self.elapsed = 0.0
+
+    @property
+    def per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def _random(plan, kind, index):
+    return random.Random('%s:%s:%d' % (plan.seed, kind, index))
+
+
+def _user_rows(plan, index, chunk_size):
+    rng = _random(plan, 'users', index)
+    rows = {model: [] for model in ('user', 'group', 'profile', 'payment', 'account', 'bank', 'card', 'entry')}
+    joined = str(plan.now - timedelta(days=400))
+    for i in range(index * chunk_size, min((index + 1) * chunk_size, plan.users)):
+        user_id, payment_id = plan.first_user + i, plan.first_payment + 3 * i
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        balance = rng.randrange(10000, 1000000)
+        rows['user'].append((user_id, plan.password, 'user%d' % user_id, first.title(), last.title(),
+                             '%s.%s%d@example.com' % (first, last, user_id), False, True, False, joined))
+        rows['group'].append((user_id, plan.normal_group))
+        rows['profile'].append((user_id, str(date(1960, 1, 1) + timedelta(days=rng.randrange(15000))),
+                                '%d Main Street' % rng.randrange(1, 1000)))
+        rows['payment'] += [(payment_id, 'account', user_id), (payment_id + 1, 'bank', user_id),
+                            (payment_id + 2, 'card', user_id)]
+        rows['account'].append((payment_id, balance))
+        rows['bank'].append((payment_id + 1, first.title(), last.title(), '%09d' % (user_id % 10 ** 9),
+                             '%010d' % user_id))
+        rows['card'].append((payment_id + 2, ('Credit', 'Debit')[user_id % 2], '%016d' % user_id, first.title(),
+                             last.title(), '%03d' % rng.randrange(1000), '2030-01-01'))
+        # the balance enters the app through an opening entry, as in migration 0011
+        rows['entry'] += [(payment_id, 'opening', balance, joined), (None, 'opening', -balance, joined)]
+    return rows
+
+
+@lru_cache()
+def _times_of_day():
+    return ['%02d:%02d:%02d' % (second // 3600, second // 60 % 60, second % 60) for second in range(86400)]
+
+
+def _transaction_rows(plan, index, chunk_size, count):
+    # random() scaled by hand is several times cheaper than randrange() and choice(), and
+    # dates are pasted together from strings made up front instead of formatted row by row
+    rng = _random(plan, 'transactions', index)
+    rand, users, first_user, first_payment = rng.random, plan.users, plan.first_user, plan.first_payment
+    days = [str(plan.now.date() - timedelta(days=365 - day)) + ' ' for day in range(365)]
+    times = _times_of_day()
+    rows = []
+    for _ in range(index * chunk_size, min((index + 1) * chunk_size, count)):
+        creator = int(rand() * users)
+        receiver = (creator + 1 + int(rand() * (users - 1))) % users
+        transaction_type = 'request' if rand() < 0.3 else 'send'
+        is_complete = transaction_type == 'send' or rand() < 0.7
+        payer = creator if transaction_type == 'send' else receiver
+        rows.append((transaction_type, CATEGORIES[int(rand() * len(CATEGORIES))], 100 + int(rand() * 19900),
+                     'generated', days[int(rand() * 365)] + times[int(rand() * 86400)], is_complete,
+                     first_user + creator, first_user + receiver, first_payment + 3 * payer if is_complete else None))
+    return rows
+
+
+def _generate(task):
+    kind, plan, index, chunk_size, count = task
+    if kind == 'users':
+        return kind, _user_rows(plan, index, chunk_size)
+    return kind, _transaction_rows(plan, index, chunk_size, count)
+
+
+def _insert(cursor, model, fields, rows):
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(field).column for field in fields]
+    cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+        quote(model._meta.db_table), ', '.join(quote(column) for column in columns),
+        ', '.join(['%s'] * len(columns))), rows)
+    return len(rows)
+
+
+def _write(cursor, kind, rows):
+    if kind == 'transactions':
+        return _insert(cursor, Transaction, ('transaction_type', 'category', 'amount', 'description', 'create_date',
+                                             'is_complete', 'creator', 'receiver', 'payment_method'), rows)
+    return sum((
+        _insert(cursor, User, ('id', 'password', 'username', 'first_name', 'last_name', 'email', 'is_superuser',
+                               'is_active', 'is_staff', 'date_joined'), rows['user']),
+        _insert(cursor, User.groups.through, ('user', 'group'), rows['group']),
+        _insert(cursor, Profile, ('user', 'birthday', 'address'), rows['profile']),
+        _insert(cursor, PaymentMethod, ('method_id', 'method_type', 'user'), rows['payment']),
+        _insert(cursor, Account, ('payment', 'balance'), rows['account']),
+        _insert(cursor, Bank, ('payment', 'owner_first_name', 'owner_last_name', 'routing_number',
+                               'account_number'), rows['bank']),
+        _insert(cursor, Card, ('payment', 'card_type', 'card_number', 'owner_first_name', 'owner_last_name',
+                               'security_code', 'expiration_date'), rows['card']),
+        _insert(cursor, LedgerEntry, ('payment', 'kind', 'amount', 'create_date'), rows['entry']),
+    ))
+
+
+def _drop_indexes(cursor, model):
+    # SQLite fills an index much faster from a finished table than row by row, so the
+    # plain indexes of a table about to grow a lot are dropped now and created again
+    # afterwards; the returned statements do that
+    if connection.vendor != 'sqlite':
+        return []
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                   [model._meta.db_table])
+    indexes = cursor.fetchall()
+    for name, sql in indexes:
+        cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+    return [sql for name, sql in indexes]
+
+
+def _staff(count, password):
+    # a handful, created the usual way
+    group = Group.objects.get(name='staff')
+    start = User.objects.filter(username__startswith='staff').count()
+    staff = User.objects.bulk_create(User(username='staff%d' % (start + i), password=password, is_staff=True)
+                                     for i in range(count))
+    staff_ids = list(User.objects.filter(username__in=[user.username for user in staff]).values_list('pk', flat=True))
+    User.groups.through.objects.bulk_create(User.groups.through(user_id=pk, group=group) for pk in staff_ids)
+    return staff_ids
+
+
+# Add users users (at least 2), staff staff users and transactions transactions between
+# the new users; every user's password is PASSWORD. With workers > 1 the rows are
+# generated by that many processes while this one writes them.
+def seed(users, transactions, seed=0, staff=0, workers=1, chunk_size=CHUNK_SIZE, rebuild=True, progress=None):
+    result = SeedResult()
+    start = time.perf_counter()
+    password = make_password(PASSWORD)
+
+    # The generated rows only point at rows generated before them, so checking every
+    # foreign key as it is written is skipped where the backend allows it. It is a
+    # no-op when seed() is called inside an open transaction.
+    with connection.constraint_checks_disabled(), transaction.atomic():
+        if connection.vendor == 'sqlite':
+            # a larger page cache keeps the indexes being filled in memory
+            connection.cursor().execute('PRAGMA cache_size = -262144')
+        plan = Plan(seed, users, (User.objects.aggregate(last=Max('id'))['last'] or 0) + 1,
+                    (PaymentMethod.objects.aggregate(last=Max('method_id'))['last'] or 0) + 1, password,
+                    Group.objects.get(name='normal_user').pk, datetime.utcnow().replace(microsecond=0))
+        tasks = [('users', plan, index, chunk_size, users) for index in range(-(-users // chunk_size))]
+        tasks += [('transactions', plan, index, chunk_size, transactions)
+                  for index in range(-(-transactions // chunk_size))]
+
+        pool = get_context('fork').Pool(workers) if workers > 1 else None
+        try:
+            chunks = pool.imap(_generate, tasks) if pool else map(_generate, tasks)
+            with connection.cursor() as cursor:
+                indexes = _drop_indexes(cursor, Transaction) if transactions >= INDEX_DEFERRAL else []
+                for kind, rows in chunks:
+                    result.rows += _write(cursor, kind, rows)
+                    if progress:
+                        progress(kind, result.rows, time.perf_counter() - start)
+                for sql in indexes:
+                    cursor.execute(sql)
+                # explicit primary keys leave the sequences of some backends behind
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User, PaymentMethod]):
+                    cursor.execute(sql)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        result.staff_ids = _staff(staff, password)
+    result.user_ids = list(range(plan.first_user, plan.first_user + users))
+    result.elapsed = time.perf_counter() - start
+
+    if rebuild:
+        summaries.rebuild()
+        counterparties.rebuild()
+        search.rebuild()
+    return result
@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import search, template_cache, wallet
+from .models import Account, Bank, Card, PaymentMethod
+
+
+def _owner(instance):
+    if isinstance(instance, PaymentMethod):
+        return instance.user_id
+    # the payment method is usually loaded already; while a user is deleted it may be gone
+    if type(instance).payment.is_cached(instance):
+        return instance.payment.user_id
+    return PaymentMethod.objects.filter(pk=instance.payment_id).values_list('user_id', flat=True).first()
+
+
+@receiver(post_save, sender=PaymentMethod)
+@receiver(post_save, sender=Account)
+@receiver(post_save, sender=Bank)
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=PaymentMethod)
+@receiver(post_delete, sender=Account)
+@receiver(post_delete, sender=Bank)
+@receiver(post_delete, sender=Card)
+def invalidate_wallet(sender, instance, **kwargs):
+    wallet.invalidate(_owner(instance))
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, update_fields=None, **kwargs):
+    # e.g. the save of last_login on every login leaves the indexed fields as they were
+    if update_fields is not None and not set(update_fields) & set(search.SEARCH_FIELDS):
+        return
+    search.index_user(instance)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    search.unindex_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_header(sender, instance, action, reverse, pk_set, **kwargs):
+    # instance is the user, or with reverse the group or permission whose users are pk_set;
+    # clearing a group or permission of all its users leaves their headers to expire
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        template_cache.invalidate(*(pk_set or () if reverse else [instance]))
@@ -0,0 +1,156 @@
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DateField, F, Sum, Value
+from django.db.models.functions import TruncMonth
+from django.utils.timezone import localtime
+
+from .fields import MoneyField
+from .models import SpendingSummary, Transaction
+
+
+def month_of(date):
+    return localtime(date).date().replace(day=1)
+
+
+def _add(user_id, month, category, direction, amount, count):
+    rows = SpendingSummary.objects.filter(user_id=user_id, month=month, category=category, direction=direction)
+    total = F('total') + Value(amount, output_field=MoneyField())
+    if rows.update(total=total, count=F('count') + count):
+        return
+    try:
+        with transaction.atomic():
+            SpendingSummary.objects.create(user_id=user_id, month=month, category=category,
+                                           direction=direction, total=amount, count=count)
+    except IntegrityError:
+        # created concurrently since the update above
+        rows.update(total=total, count=F('count') + count)
+
+
+# add a completed transaction to its payer's and payee's summaries, or take it out again with sign=-1
+def record(tran, sign=1):
+    payer, payee = tran.payer_and_payee()
+    month = month_of(tran.create_date)
+    _add(payer, month, tran.category, 'out', sign * tran.amount, sign)
+    _add(payee, month, tran.category, 'in', sign * tran.amount, sign)
+
+
+# record() for many transactions: the summary rows they touch are read once, then
+# changed with one UPDATE each through executemany() and the missing ones inserted together
+def record_many(trans, sign=1):
+    deltas = defaultdict(lambda: [Decimal('0.00'), 0])
+    for tran in trans:
+        payer, payee = tran.payer_and_payee()
+        month = month_of(tran.create_date)
+        for user_id, direction in ((payer, 'out'), (payee, 'in')):
+            delta = deltas[(user_id, month, tran.category, direction)]
+            delta[0] += sign * tran.amount
+            delta[1] += sign
+
+    rows = SpendingSummary.objects.filter(user_id__in={key[0] for key in deltas}, month__in={key[1] for key in deltas})
+    existing = {}
+    for pk, *key in rows.values_list('pk', 'user_id', 'month', 'category', 'direction'):
+        if tuple(key) in deltas:
+            existing[tuple(key)] = pk
+
+    if existing:
+        quote, total = connection.ops.quote_name, SpendingSummary._meta.get_field('total')
+        with connection.cursor() as cursor:
+            cursor.executemany('UPDATE %s SET %s = %s + %%s, %s = %s + %%s WHERE %s = %%s' % (
+                quote(SpendingSummary._meta.db_table), quote(total.column), quote(total.column), quote('count'),
+                quote('count'), quote(SpendingSummary._meta.pk.column)),
+                [(total.get_db_prep_value(deltas[key][0], connection), deltas[key][1], pk)
+                 for key, pk in existing.items()])
+
+    missing = [key for key in deltas if key not in existing]
+    try:
+        with transaction.atomic():
+            SpendingSummary.objects.bulk_create(
+                SpendingSummary(user_id=user_id, month=month, category=category, direction=direction,
+                                total=deltas[key][0], count=deltas[key][1])
+                for key in missing for user_id, month, category, direction in [key])
+    except IntegrityError:
+        # some were created concurrently since they were read
+        for key in missing:
+            _add(*key, *deltas[key])
+
+
+def compute(user_ids=None):
+    # the summaries as they should be, aggregated from the whole transaction history
+    summaries = defaultdict(lambda: [Decimal('0.00'), 0])
+    sides = (
+        ('send', 'creator', 'out'),
+        ('send', 'receiver', 'in'),
+        ('request', 'receiver', 'out'),
+        ('request', 'creator', 'in'),
+    )
+    for transaction_type, user_field, direction in sides:
+        rows = Transaction.objects.filter(is_complete=True, transaction_type=transaction_type)
+        if user_ids is not None:
+            rows = rows.filter(**{'%s__in' % user_field: user_ids})
+        rows = rows.annotate(month=TruncMonth('create_date', output_field=DateField())).values(
+            user_field, 'month', 'category').annotate(total=Sum('amount'), count=Count('pk')).order_by()
+        for row in rows:
+            summary = summaries[(row[user_field], row['month'], row['category'], direction)]
+            summary[0] += row['total']
+            summary[1] += row['count']
+    return summaries
+
+
+def stored(user_ids=None):
+    rows = SpendingSummary.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return {(row.user_id, row.month, row.category, row.direction): [row.total, row.count] for row in rows}
+
+
+def rebuild(user_ids=None, batch_size=None):
+    summaries = compute(user_ids)
+    with transaction.atomic():
+        rows = SpendingSummary.objects.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        rows.delete()
+        SpendingSummary.objects.bulk_create(
+            (SpendingSummary(user_id=user_id, month=month, category=category, direction=direction,
+                             total=total, count=count)
+             for (user_id, month, category, direction), (total, count) in summaries.items() if count),
+            batch_size=batch_size)
+    return len(summaries)
+
+
+# (key, expected, stored) for every summary that does not match the transaction history
+def inconsistencies(user_ids=None):
+    expected, actual = compute(user_ids), stored(user_ids)
+    problems = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        want = expected.get(key, [Decimal('0.00'), 0])
+        have = actual.get(key, [Decimal('0.00'), 0])
+        if want != have:
+            problems.append((key, want, have))
+    return problems
+
+
+# the summaries of one user for the last few months, grouped by month and category
+def by_month(user, months=12):
+    today = localtime().date()
+    first = today.replace(day=1)
+    for _ in range(months - 1):
+        first = (first - timedelta(days=1)).replace(day=1)
+
+    grouped = OrderedDict()
+    for row in SpendingSummary.objects.filter(user=user, month__gte=first, count__gt=0):
+        month = grouped.setdefault(row.month, {'month': row.month, 'spent': Decimal('0.00'), 'received': Decimal('0.00'),
+                                               'categories': OrderedDict()})
+        category = month['categories'].setdefault(row.category, {
+            'category': row.get_category_display(), 'spent': Decimal('0.00'), 'received': Decimal('0.00'),
+            'count': 0})
+        key = 'spent' if row.direction == 'out' else 'received'
+        category[key] += row.total
+        category['count'] += row.count
+        month[key] += row.total
+    for month in grouped.values():
+        month['categories'] = list(month['categories'].values())
+    return list(grouped.values())
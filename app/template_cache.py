@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+from django.template import TemplateSyntaxError, engines
+
+# The headers of app/base.html and staff/base.html are cached per user for 900 seconds
+# ({% cache 900 ... user.pk %}). They show links by permission, so a change of a user's
+# groups or permissions drops them, see app.signals; one that bypasses the signals,
+# like a change to a group's permissions, shows once they expire.
+USER_FRAGMENTS = ('base_header', 'staff_header')
+
+
+def invalidate(*users):
+    keys = [make_template_fragment_key(fragment, [getattr(user, 'pk', user)])
+            for fragment in USER_FRAGMENTS for user in users if user is not None]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def template_names():
+    # every template of the wallet app, by the name views load it with
+    directory = os.path.join(apps.get_app_config('app').path, 'templates')
+    for root, dirs, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith('.html'):
+                yield os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+
+
+def reset():
+    # empty the cached template loader, if there is one
+    for loader in engines['django'].engine.template_loaders:
+        if hasattr(loader, 'reset'):
+            loader.reset()
+
+
+# Compile every template of the wallet app, which also fills the cached template loader
+# where it is configured, so that no request pays for it. Returns {name: seconds to
+# load and compile} and {name: error}.
+def precompile():
+    engine = engines['django']
+    timings, errors = {}, {}
+    for name in template_names():
+        start = time.perf_counter()
+        try:
+            engine.get_template(name)
+        except TemplateSyntaxError as e:
+            errors[name] = e
+            continue
+        timings[name] = time.perf_counter() - start
+    return timings, errors
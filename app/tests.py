@@ -1,3 +1,1118 @@
-from django.test import TestCase
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import urlsafe_base64_encode
+from django.utils.timezone import now, utc
+
+from app import (counterparties, events, jobs, ledger, notifications, payouts, profiling, registration, scheduler,
+                 search, seeding, summaries, wallet)
+from app.form import StaffTransactionFilterForm
+from app.ledger import TransferError
+from app.models import (Account, Bank, Card, Counterparty, IdempotencyKey, Job, LedgerEntry, Notification, PaymentMethod, Profile,
+                        ScheduledPayment, SpendingSummary, Transaction)
+from app.utils import KeysetPaginator
+from app.views import ActivityList, IncompleteTranList, StaffTransactionList, StaffUserTran
+
+
+def make_user(username, balance=100, group='normal_user', **kwargs):
+    user = User.objects.create_user(username, password='password', **kwargs)
+    user.groups.add(Group.objects.get(name=group))
+    payment = PaymentMethod.objects.create(user=user, method_type='account')
+    Account.objects.create(payment=payment, balance=balance)
+    return user, payment
+
+
+def balance(user):
+    return Account.objects.get(payment__user=user, payment__method_type='account').balance
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob, self.bob_wallet = make_user('bob')
+
+    def send(self, amount, creator=None, receiver=None, payment_method=None):
+        return ledger.send_money(Transaction(
+            creator=creator or self.alice, receiver=receiver or self.bob,
+            payment_method=payment_method or self.alice_wallet, category='Food', amount=amount,
+            description='lunch'))
+
+    def assertBalanced(self):
+        self.assertEqual(LedgerEntry.objects.aggregate(total=Sum('amount'))['total'] or 0, 0)
+
+    def test_send_moves_balance(self):
+        tran = self.send('10.50')
+        self.assertEqual(balance(self.alice), Decimal('89.50'))
+        self.assertEqual(balance(self.bob), Decimal('110.50'))
+        self.assertEqual(sorted(LedgerEntry.objects.filter(transaction=tran).values_list('amount', flat=True)),
+                         [Decimal('-10.50'), Decimal('10.50')])
+        self.assertBalanced()
+
+    def test_send_many_entries_sum_to_zero(self):
+        carol, carol_wallet = make_user('carol')
+        ledger.send_many([
+            Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet, category='Food',
+                        amount='5', description='a'),
+            Transaction(creator=self.alice, receiver=carol, payment_method=self.alice_wallet, category='Food',
+                        amount='7', description='b'),
+            Transaction(creator=carol, receiver=self.bob, payment_method=carol_wallet, category='Food',
+                        amount='3', description='c'),
+        ])
+        self.assertEqual(balance(self.alice), 88)
+        self.assertEqual(balance(self.bob), 108)
+        self.assertEqual(balance(carol), 104)
+        self.assertEqual(LedgerEntry.objects.count(), 6)
+        self.assertBalanced()
+
+    def test_overdraft_is_refused(self):
+        with self.assertRaisesMessage(TransferError, 'Insufficient balance'):
+            self.send('100.01')
+        self.assertEqual(balance(self.alice), 100)
+        self.assertEqual(balance(self.bob), 100)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(LedgerEntry.objects.exists())
+
+        # the whole balance can still be sent, but not a cent more
+        self.send('100')
+        with self.assertRaises(TransferError):
+            self.send('0.01')
+        self.assertEqual(balance(self.alice), 0)
+
+    def test_amount_must_be_positive(self):
+        for amount in ('0', '-50'):
+            with self.assertRaisesMessage(TransferError, 'greater than 0'):
+                self.send(amount)
+        self.assertEqual(balance(self.alice), 100)
+        self.assertEqual(balance(self.bob), 100)
+        self.assertFalse(LedgerEntry.objects.exists())
+
+    def test_overdraft_refuses_the_whole_batch(self):
+        trans = [Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet,
+                             category='Food', amount='60', description=str(i)) for i in range(2)]
+        with self.assertRaises(TransferError):
+            ledger.send_many(trans)
+        self.assertEqual(balance(self.alice), 100)
+        self.assertFalse(LedgerEntry.objects.exists())
+
+    def test_payment_of_request(self):
+        tran = ledger.request_money(Transaction(creator=self.alice, receiver=self.bob, category='Food',
+                                                amount=Decimal('20'), description='dinner'))
+        ledger.complete_payment(tran, self.bob, self.bob_wallet)
+        self.assertEqual(balance(self.alice), 120)
+        self.assertEqual(balance(self.bob), 80)
+        with self.assertRaisesMessage(TransferError, 'already been paid'):
+            ledger.complete_payment(tran, self.bob, self.bob_wallet)
+        self.assertEqual(balance(self.bob), 80)
+        self.assertBalanced()
+
+    def test_reversal_refunds_and_may_overdraw(self):
+        tran = self.send('30')
+        # bob spends the money before staff delete the transfer
+        self.send('130', creator=self.bob, receiver=self.alice, payment_method=self.bob_wallet)
+        ledger.reverse_transaction(tran)
+        self.assertEqual(balance(self.alice), 230)
+        self.assertEqual(balance(self.bob), -30)
+        self.assertFalse(Transaction.objects.filter(pk=tran.pk).exists())
+        self.assertEqual(LedgerEntry.objects.filter(kind='reversal').count(), 2)
+        self.assertBalanced()
+
+    def test_withdraw_empties_the_wallet(self):
+        account = Account.objects.get(payment=self.alice_wallet)
+        self.assertEqual(ledger.withdraw(account), 100)
+        self.assertEqual(balance(self.alice), 0)
+        self.assertEqual(ledger.withdraw(account), 0)
+        self.assertBalanced()
+
+    def test_replay_matches_balances(self):
+        self.send('12.34')
+        self.send('1.66', creator=self.bob, receiver=self.alice, payment_method=self.bob_wallet)
+        balances, count = ledger.replay()
+        self.assertEqual(count, 4)
+        self.assertEqual(balances[self.alice_wallet.pk], Decimal('-10.68'))
+        self.assertEqual(balances[self.bob_wallet.pk], Decimal('10.68'))
+
+
+class StaffDeleteTests(TestCase):
+    def setUp(self):
+        self.alice, alice_wallet = make_user('alice')
+        self.bob = make_user('bob')[0]
+        self.tran = ledger.send_money(Transaction(creator=self.alice, receiver=self.bob, payment_method=alice_wallet,
+                                                  category='Food', amount=Decimal('10'), description='lunch'))
+        self.client.force_login(make_user('staff', group='staff', is_staff=True)[0])
+        self.urls = ['/staff/transaction/%d/delete/' % self.tran.pk,
+                     '/staff/user/%d/transactions/%d/delete' % (self.alice.pk, self.tran.pk)]
+
+    def test_delete_reverses(self):
+        self.assertRedirects(self.client.post(self.urls[0]), '/staff/transaction/', fetch_redirect_response=False)
+        self.assertEqual((balance(self.alice), balance(self.bob)), (100, 100))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_wallet_gone(self):
+        Account.objects.filter(payment__user=self.alice).delete()
+        for url in self.urls:
+            response = self.client.post(url)
+            self.assertContains(response, 'A wallet account of this transaction does not exist.', status_code=200)
+        self.assertEqual(balance(self.bob), 110)
+        self.assertTrue(Transaction.objects.filter(pk=self.tran.pk).exists())
+
+
+class KeysetPaginatorTests(TestCase):
+    def test_bad_cursors_give_the_first_page(self):
+        paginator = KeysetPaginator([Transaction.objects.all()], 10)
+        self.assertEqual(paginator.decode_cursor(urlsafe_base64_encode(b'["p","2020-01-01T00:00:00+00:00",7]')),
+                         ('p', [datetime(2020, 1, 1, tzinfo=utc), 7]))
+        for data in ('["n",null,null]', '["p","2020-01-01T00:00:00+00:00",null]', '["n",null,7]', '["n",1]',
+                     '["x"]', '{}', 'not json'):
+            self.assertEqual(paginator.decode_cursor(urlsafe_base64_encode(data.encode())), ('n', []), data)
+
+        self.client.force_login(make_user('alice')[0])
+        response = self.client.get('/activity/', {'cursor': urlsafe_base64_encode(b'["n",null,null]')})
+        self.assertEqual(response.status_code, 200)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'the plans are read in the format of SQLite')
+class QueryPlanTests(TestCase):
+    # every transaction query of the list views reads through an index, and the paginated
+    # ones read their page in index order instead of sorting all matching rows
+    def assertIndexed(self, name, queryset, paginated=True):
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            # "SCAN app_transaction" without "USING INDEX" reads every row of the table
+            self.assertFalse('SCAN' in line and 'app_transaction' in line and 'INDEX' not in line,
+                             '%s scans the table:\n%s' % (name, plan))
+            if paginated:
+                self.assertNotIn('TEMP B-TREE', line, '%s sorts its rows:\n%s' % (name, plan))
+
+    def test_activity(self):
+        activity = ActivityList()
+        for name, branches in (('pay', activity.get_pay_querysets(1)),
+                               ('receive', activity.get_receive_querysets(1))):
+            paginator = KeysetPaginator(branches, activity.keyset_per_page, activity.keyset_ordering)
+            # the first page, a later page reached through a cursor and the last page
+            for page, key, forward in (('first', [], True), ('cursor', [now(), 1], True), ('last', [], False)):
+                for i, queryset in enumerate(paginator.get_querysets(key, forward)):
+                    self.assertIndexed('activity %s #%d, %s page' % (name, i + 1, page), queryset)
+
+    def test_staff_transactions(self):
+        staff = StaffTransactionList()
+        for data in ({}, {'transaction_type': 'send'}, {'category': 'Food'}, {'date_from': '2019-12-01'}):
+            form = StaffTransactionFilterForm(data)
+            self.assertTrue(form.is_valid(), form.errors)
+            paginator = KeysetPaginator(form.filter(Transaction.objects.for_listing()), staff.keyset_per_page,
+                                        staff.keyset_ordering)
+            for page, key in (('first', []), ('cursor', [now(), 1])):
+                for queryset in paginator.get_querysets(key, True):
+                    self.assertIndexed('staff transactions %s, %s page' % (data or 'unfiltered', page), queryset)
+
+    def test_incomplete_and_staff_user(self):
+        incomplete = IncompleteTranList()
+        self.assertIndexed('incomplete creator', incomplete.get_creator_queryset(1), False)
+        self.assertIndexed('incomplete receiver', incomplete.get_receiver_queryset(1), False)
+        self.assertIndexed('staff user transactions', StaffUserTran().get_tran_queryset(1), False)
+
+
+class QueryCountTests(TestCase):
+    # The list pages make the same number of queries with a few rows as with many, so a
+    # view or template that queries per row (an N+1) fails here. The first render fills
+    # the caches (template fragments, the unread count); the ones counted are served
+    # from them.
+    def setUp(self):
+        cache.clear()
+        self.owner = make_user('owner')[0]
+        self.users = [self.owner] + [make_user('user%d' % i)[0] for i in range(5)]
+        self.client.force_login(self.owner)
+        self.add_rows(1)
+
+    def tearDown(self):
+        cache.clear()
+
+    def add_rows(self, count):
+        users = self.users
+        Transaction.objects.bulk_create(
+            Transaction(transaction_type=transaction_type, category='Others', amount=1, description='row',
+                        is_complete=is_complete, creator=users[i % len(users)], receiver=users[(i + 1) % len(users)])
+            for i in range(count) for transaction_type in ('send', 'request') for is_complete in (True, False))
+        Notification.objects.bulk_create(Notification(user=users[(i + 1) % len(users)], actor=users[i % len(users)],
+                                                      kind='send', amount=1) for i in range(count))
+
+    def assertQueries(self, url, count):
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(count):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_rows(50)
+        with self.assertNumQueries(count):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_activity(self):
+        self.assertQueries('/activity/', 6)
+
+    def test_incomplete(self):
+        self.assertQueries('/incomplete/', 4)
+
+    def test_notifications(self):
+        self.assertQueries('/notifications/', 3)
+
+    def test_staff_transactions(self):
+        self.client.force_login(make_user('staff', group='staff', is_staff=True)[0])
+        self.assertQueries('/staff/transaction/', 3)
+
+    def test_staff_user_transactions(self):
+        self.client.force_login(make_user('staff', group='staff', is_staff=True)[0])
+        self.assertQueries('/staff/user/%d/transactions/' % self.owner.pk, 4)
+
+
+class StaffTransactionFilterTests(TestCase):
+    def setUp(self):
+        alice, bob = make_user('alice')[0], make_user('bob')[0]
+        Transaction.objects.create(transaction_type='send', category='Food', amount=1, description='lunch',
+                                   is_complete=True, creator=alice, receiver=bob)
+        self.client.force_login(make_user('staff', group='staff', is_staff=True)[0])
+
+    def test_last_date(self):
+        response = self.client.get('/staff/transaction/', {'date_from': '2000-01-01', 'date_to': '9999-12-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([tran.description for tran in response.context['tran_list']], ['lunch'])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob = make_user('alice')[0], make_user('bob')[0]
+        Transaction.objects.create(transaction_type='send', category='Food', amount=1, description='lunch',
+                                   is_complete=True, creator=self.alice, receiver=self.bob)
+        self.urls = ['/staff/transaction/export/', '/staff/user/%d/transactions/export/' % self.alice.pk]
+
+    def test_normal_users_are_refused(self):
+        self.client.force_login(make_user('carol')[0])
+        for url in self.urls:
+            self.assertEqual(self.client.get(url).status_code, 403, url)
+
+    def test_staff_export(self):
+        self.client.force_login(make_user('staff', group='staff', is_staff=True)[0])
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIn(b'lunch', b''.join(response.streaming_content))
+
+
+class SummaryTests(TestCase):
+    def setUp(self):
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob, self.bob_wallet = make_user('bob')
+        self.month = summaries.month_of(now())
+
+    def summary(self, user, direction):
+        row = SpendingSummary.objects.filter(user=user, month=self.month, category='Food', direction=direction).first()
+        return (row.total, row.count) if row else (0, 0)
+
+    def assertSummaries(self, alice_out, alice_in, bob_out, bob_in):
+        self.assertEqual(self.summary(self.alice, 'out'), alice_out)
+        self.assertEqual(self.summary(self.alice, 'in'), alice_in)
+        self.assertEqual(self.summary(self.bob, 'out'), bob_out)
+        self.assertEqual(self.summary(self.bob, 'in'), bob_in)
+        self.assertEqual(summaries.inconsistencies(), [])
+
+    def test_summaries_follow_the_ledger(self):
+        sent = ledger.send_money(Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet,
+                                             category='Food', amount=Decimal('10'), description='lunch'))
+        self.assertSummaries((10, 1), (0, 0), (0, 0), (10, 1))
+
+        # an open request is not spending yet
+        request = ledger.request_money(Transaction(creator=self.alice, receiver=self.bob, category='Food',
+                                                   amount=Decimal('4'), description='coffee'))
+        self.assertSummaries((10, 1), (0, 0), (0, 0), (10, 1))
+
+        ledger.complete_payment(request, self.bob, self.bob_wallet)
+        self.assertSummaries((10, 1), (4, 1), (4, 1), (10, 1))
+
+        ledger.reverse_transaction(sent)
+        self.assertSummaries((0, 0), (4, 1), (4, 1), (0, 0))
+
+    def test_record_many_matches_record(self):
+        carol, carol_wallet = make_user('carol')
+        ledger.send_money(Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet,
+                                      category='Food', amount=Decimal('1'), description='a'))
+        ledger.send_many([
+            Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet, category='Food',
+                        amount=Decimal('2'), description='b'),
+            Transaction(creator=self.alice, receiver=carol, payment_method=self.alice_wallet, category='Food',
+                        amount=Decimal('3'), description='c'),
+            Transaction(creator=carol, receiver=self.bob, payment_method=carol_wallet, category='Others',
+                        amount=Decimal('5'), description='d'),
+        ])
+        self.assertSummaries((6, 3), (0, 0), (0, 0), (3, 2))
+        self.assertEqual(summaries.stored(), summaries.compute())
+
+    def test_rebuild_and_checker(self):
+        ledger.send_money(Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet,
+                                      category='Food', amount=Decimal('10'), description='lunch'))
+        incremental = summaries.stored()
+
+        SpendingSummary.objects.filter(user=self.bob).update(total=1)
+        SpendingSummary.objects.filter(user=self.alice).delete()
+        problems = summaries.inconsistencies()
+        self.assertEqual(sorted((key[0], key[3], want, have) for key, want, have in problems), sorted([
+            (self.alice.pk, 'out', [Decimal('10.00'), 1], [Decimal('0.00'), 0]),
+            (self.bob.pk, 'in', [Decimal('10.00'), 1], [Decimal('1.00'), 1]),
+        ]))
+
+        # only the given users are rebuilt
+        summaries.rebuild([self.alice.pk])
+        self.assertEqual(len(summaries.inconsistencies()), 1)
+        summaries.rebuild()
+        self.assertEqual(summaries.inconsistencies(), [])
+        self.assertEqual(summaries.stored(), incremental)
+
+    def test_staff_only(self):
+        url = '/staff/user/%d/summary/' % self.alice.pk
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(make_user('staff', group='staff', is_staff=True)[0])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class WalletCacheTests(TransactionTestCase):
+    # the groups of the data migrations are kept for the tests after this one
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob = make_user('bob')[0]
+
+    def tearDown(self):
+        cache.clear()
+
+    def send(self, amount):
+        ledger.send_money(Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet,
+                                      category='Food', amount=amount, description='lunch'))
+
+    def test_change_is_seen(self):
+        self.assertEqual(wallet.overview(self.alice)['account'][0].balance, 100)
+        self.send('10')
+        self.assertEqual(wallet.overview(self.alice)['account'][0].balance, 90)
+        self.assertEqual(wallet.overview(self.bob)['account'][0].balance, 110)
+
+    def test_stale_write_after_commit_is_not_served(self):
+        # a page reads the overview before a send commits and caches it afterwards
+        key = wallet._key(self.alice.pk, wallet._version(self.alice.pk))
+        stale = {'account': list(Account.objects.filter(payment__user=self.alice)), 'bank_list': [], 'card_list': []}
+        self.send('10')
+        cache.set(key, stale, wallet.WALLET_TIMEOUT)
+        self.assertEqual(wallet.overview(self.alice)['account'][0].balance, 90)
+
+    def test_stats_are_staff_only(self):
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get('/staff/cache/').status_code, 403)
+        self.client.force_login(make_user('staff', group='staff', is_staff=True)[0])
+        response = self.client.get('/staff/cache/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hit_rate', response.json()['wallet'])
+
+
+class TemplateCacheTests(TransactionTestCase):
+    serialized_rollback = True
+    # in the cached header of users who may see their wallet
+    menu_link = '<li><a href="/wallet/">Wallet</a></li>'
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob = make_user('bob')[0]
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_balance_change_is_shown(self):
+        self.client.force_login(self.alice)
+        self.assertContains(self.client.get('/wallet/'), '<span id="wallet-balance">100.00</span>')
+        self.assertContains(self.client.get('/wallet/'), '<span id="wallet-balance">100.00</span>')
+        ledger.send_money(Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet,
+                                      category='Food', amount=Decimal('10'), description='lunch'))
+        self.assertContains(self.client.get('/wallet/'), '<span id="wallet-balance">90.00</span>')
+        self.client.force_login(self.bob)
+        self.assertContains(self.client.get('/wallet/'), '<span id="wallet-balance">110.00</span>')
+
+    def test_header_is_per_user(self):
+        # carol is in no group, so her menu has none of the wallet links
+        carol = User.objects.create_user('carol', password='password')
+        for user, shown in ((self.alice, True), (carol, False), (self.alice, True), (carol, False)):
+            self.client.force_login(user)
+            response = self.client.get('/notifications/')
+            self.assertEqual(self.menu_link in response.content.decode(), shown, user)
+
+        # and a change of her groups shows at once
+        self.alice.groups.clear()
+        self.assertEqual(self.alice.groups.count(), 0)
+        self.client.force_login(self.alice)
+        self.assertNotContains(self.client.get('/notifications/'), self.menu_link)
+        carol.groups.add(Group.objects.get(name='normal_user'))
+        self.client.force_login(carol)
+        self.assertContains(self.client.get('/notifications/'), self.menu_link)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob = make_user('bob')[0]
+        self.carol = make_user('carol')[0]
+        self.client.force_login(self.alice)
+
+    def post(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+    def assertUnchanged(self):
+        self.assertEqual([balance(user) for user in (self.alice, self.bob, self.carol)], [100, 100, 100])
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_send(self):
+        response = self.post('/api/send/', {'receiver': 'bob', 'category': 'Food', 'amount': '10',
+                                            'payment_method': self.alice_wallet.pk, 'description': 'lunch'})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['transaction']['direction'], 'out')
+        self.assertEqual(balance(self.alice), 90)
+        self.assertEqual(balance(self.bob), 110)
+
+    def test_negative_amounts_are_refused(self):
+        response = self.post('/api/send/', {'receiver': 'bob', 'category': 'Food', 'amount': '-50',
+                                            'payment_method': self.alice_wallet.pk, 'description': 'lunch'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('amount', response.json()['errors'])
+
+        response = self.post('/api/request/', {'receiver': 'bob', 'category': 'Food', 'amount': '-50',
+                                               'description': 'lunch'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('amount', response.json()['errors'])
+
+        response = self.post('/api/payouts/', {'payment_method': self.alice_wallet.pk, 'payouts': [
+            {'receiver': 'bob', 'category': 'Others', 'amount': '1', 'description': 'pay'},
+            {'receiver': 'carol', 'category': 'Others', 'amount': '-50', 'description': 'pay'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['errors']['payouts']), ['1'])
+        self.assertUnchanged()
+
+    def test_payouts_cannot_overdraw(self):
+        response = self.post('/api/payouts/', {'payment_method': self.alice_wallet.pk, 'payouts': [
+            {'receiver': 'bob', 'category': 'Others', 'amount': '60', 'description': 'pay'},
+            {'receiver': 'carol', 'category': 'Others', 'amount': '60', 'description': 'pay'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertUnchanged()
+
+
+@override_settings(CONCURRENT_QUERY_WORKERS=4)
+class ConcurrentQueryTests(TransactionTestCase):
+    # outside a transaction the list pages read their querysets on worker threads; their
+    # queries still count towards the request
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+        self.alice = make_user('alice')[0]
+        bob = make_user('bob')[0]
+        Transaction.objects.bulk_create(
+            Transaction(transaction_type=transaction_type, category='Others', amount=1, description='row',
+                        is_complete=is_complete, creator=creator, receiver=receiver)
+            for transaction_type in ('send', 'request') for is_complete in (True, False)
+            for creator, receiver in ((self.alice, bob), (bob, self.alice)))
+        self.client.force_login(self.alice)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_worker_queries_are_counted(self):
+        self.client.get('/activity/')
+        profiling.reset()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/activity/')
+        self.assertEqual(len(response.context['pay_list']) + len(response.context['receive_list']), 4)
+        # the session, the user and the four branches of the feed
+        self.assertEqual(len(queries), 6, [query['sql'] for query in queries])
+        self.assertEqual(profiling.report()['views'][0]['queries_max'], 6)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/incomplete/').status_code, 200)
+        self.assertEqual(len(queries), 4)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        profiling.reset()
+
+    def test_report_is_staff_only(self):
+        self.client.force_login(make_user('alice')[0])
+        self.assertEqual(self.client.get('/staff/profile/').status_code, 403)
+        self.assertEqual(self.client.post('/staff/profile/').status_code, 403)
+
+        self.client.force_login(make_user('staff', group='staff', is_staff=True)[0])
+        report = self.client.get('/staff/profile/', {'format': 'json'}).json()
+        # the two refused requests; this one is recorded once it has answered
+        self.assertEqual([(view['view'], view['requests'], view['errors']) for view in report['views']],
+                         [('staff_profile', 2, 0)])
+        self.client.post('/staff/profile/')
+        self.assertEqual(len(profiling.report()['views']), 1)
+
+    def test_sampler_only_runs_during_requests(self):
+        def view(request):
+            self.assertTrue(profiling._busy.is_set())
+            # slower than PROFILING_SLOW_MS, so its stack is sampled
+            time.sleep(0.7)
+            return HttpResponse('ok')
+
+        profiling.ProfilingMiddleware(view)(RequestFactory().get('/slow/'))
+        self.assertFalse(profiling._busy.is_set())
+        slow = profiling.report()['slow_requests']
+        self.assertEqual([request['path'] for request in slow], ['/slow/'])
+        self.assertIn('in view', slow[0]['stacks'][0][0])
+
+
+class PayoutTests(TestCase):
+    def setUp(self):
+        self.payer, self.payer_wallet = make_user('payer')
+        self.bob = make_user('bob')[0]
+        self.carol = make_user('carol')[0]
+
+    def send(self, csv):
+        rows, failures = payouts.read_csv(csv.splitlines())
+        self.assertEqual(failures, [])
+        return payouts.send_payouts(self.payer, self.payer_wallet, rows)
+
+    def test_bad_rows_fail_alone(self):
+        result = self.send('username,amount,category,description\n'
+                           'bob,10,Others,pay\n'
+                           'carol,-50,Others,pay\n'
+                           'carol,0,Others,pay\n'
+                           'nobody,1,Others,pay\n')
+        self.assertEqual([payout.username for payout, tran in result.sent], ['bob'])
+        self.assertEqual([(failure.line, failure.username) for failure in result.failures],
+                         [(3, 'carol'), (4, 'carol'), (5, 'nobody')])
+        self.assertIn('greater than 0', result.failures[0].error)
+        self.assertEqual([balance(user) for user in (self.payer, self.bob, self.carol)], [90, 110, 100])
+
+    def test_payout_the_wallet_does_not_cover_fails(self):
+        result = self.send('username,amount,category,description\n'
+                           'bob,60,Others,pay\n'
+                           'carol,60,Others,pay\n')
+        self.assertEqual(len(result.sent), 1)
+        self.assertEqual([(failure.line, failure.username) for failure in result.failures], [(3, 'carol')])
+        self.assertIn('Insufficient balance', result.failures[0].error)
+        self.assertEqual([balance(user) for user in (self.payer, self.bob, self.carol)], [40, 160, 100])
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob = make_user('bob')[0]
+        self.carol = make_user('carol')[0]
+        self.start = datetime(2024, 1, 31, 9, tzinfo=utc)
+        self.now = self.start + timedelta(weeks=1, hours=1)
+
+    def schedule(self, amount, receiver=None):
+        return ScheduledPayment.objects.create(
+            user=self.alice, receiver=receiver or self.bob, payment_method=self.alice_wallet, category='Food',
+            amount=amount, description='rent', interval='weekly', start_at=self.start, run_count=1,
+            next_run_at=self.start + timedelta(weeks=1))
+
+    def test_due_schedules_are_paid_once(self):
+        schedules = [self.schedule(Decimal('10')), self.schedule(Decimal('5')), self.schedule(Decimal('1'), self.carol)]
+        with mock.patch.object(ledger, 'send_many', wraps=ledger.send_many) as send_many:
+            result = scheduler.run_due(self.now)
+        self.assertEqual((result.sent, result.failures), (3, []))
+        self.assertEqual(send_many.call_count, 1)
+        self.assertEqual((balance(self.alice), balance(self.bob), balance(self.carol)), (84, 115, 101))
+        for schedule in schedules:
+            schedule.refresh_from_db()
+            self.assertEqual((schedule.run_count, schedule.next_run_at, schedule.last_run_at),
+                             (2, self.start + timedelta(weeks=2), self.now))
+
+        self.assertEqual(scheduler.run_due(self.now).sent, 0)
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertEqual(balance(self.alice), 84)
+
+    def test_failing_schedule_only_fails_itself(self):
+        paid, unpaid = self.schedule(Decimal('30')), self.schedule(Decimal('150'))
+        result = scheduler.run_due(self.now)
+        self.assertEqual(result.sent, 1)
+        self.assertEqual([pk for pk, error in result.failures], [unpaid.pk])
+        self.assertEqual((balance(self.alice), balance(self.bob)), (70, 130))
+        paid.refresh_from_db()
+        unpaid.refresh_from_db()
+        self.assertEqual((paid.run_count, paid.failure_count), (2, 0))
+        self.assertEqual((unpaid.run_count, unpaid.failure_count), (1, 1))
+        self.assertIn('Insufficient balance', unpaid.last_error)
+        self.assertEqual(unpaid.next_run_at, self.now + scheduler.RETRY_DELAY)
+
+    def test_schedule_stops_after_max_failures(self):
+        schedule = self.schedule(Decimal('150'))
+        now = self.now
+        for failures in range(1, scheduler.MAX_FAILURES + 1):
+            self.assertEqual(len(scheduler.run_due(now).failures), 1)
+            schedule.refresh_from_db()
+            self.assertEqual(schedule.failure_count, failures)
+            now += scheduler.RETRY_DELAY
+        self.assertFalse(schedule.is_active)
+        self.assertEqual(scheduler.run_due(now + timedelta(weeks=10)).failures, [])
+        self.assertEqual(balance(self.alice), 100)
+
+    def test_monthly_occurrences(self):
+        def occurrences(start, *ns):
+            return [scheduler.occurrence(start, 'monthly', n).date().isoformat() for n in ns]
+
+        self.assertEqual(occurrences(self.start, 1, 2, 3, 13, 24),
+                         ['2024-02-29', '2024-03-31', '2024-04-30', '2025-02-28', '2026-01-31'])
+        leap_day = datetime(2024, 2, 29, 9, tzinfo=utc)
+        self.assertEqual(occurrences(leap_day, 1, 12, 48), ['2024-03-29', '2025-02-28', '2028-02-29'])
+
+
+class CounterpartyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = make_user('alice')[0]
+        self.users = [make_user('user%d' % i)[0] for i in range(6)]
+        self.start = now() - timedelta(days=30)
+
+    def tearDown(self):
+        cache.clear()
+
+    def tran(self, receiver, day, creator=None, transaction_type='send'):
+        return Transaction(transaction_type=transaction_type, category='Food', amount=1, description='row',
+                           creator=creator or self.alice, receiver=receiver,
+                           create_date=self.start + timedelta(days=day))
+
+    def record(self, *trans):
+        Transaction.objects.bulk_create(trans)
+        counterparties.record_many(trans)
+
+    def rows(self):
+        return sorted(Counterparty.objects.values_list('user', 'counterparty', 'count', 'last_date'))
+
+    def shortlist(self, user):
+        # the cache is dropped on commit, which a TestCase never gets to
+        cache.clear()
+        return counterparties.shortlist(user)
+
+    def test_least_recently_used_are_trimmed(self):
+        users = self.users
+        with mock.patch.object(counterparties, 'MAX_COUNTERPARTIES', 3):
+            self.record(*(self.tran(user, day) for day, user in enumerate(users[:4])))
+            self.assertEqual(set(Counterparty.objects.values_list('counterparty', flat=True)),
+                             {user.pk for user in users[1:4]})
+            # the oldest one kept is used again, so the next oldest goes
+            self.record(self.tran(users[1], 10), self.tran(users[4], 11))
+            self.assertEqual(set(Counterparty.objects.values_list('counterparty', flat=True)),
+                             {users[1].pk, users[3].pk, users[4].pk})
+            counterparties.rebuild()
+            self.assertEqual(set(Counterparty.objects.values_list('counterparty', flat=True)),
+                             {users[1].pk, users[3].pk, users[4].pk})
+
+    def test_shortlist_order(self):
+        users = self.users
+        self.record(
+            self.tran(users[0], 1), self.tran(users[0], 2), self.tran(users[0], 3),
+            self.tran(users[1], 4), self.tran(users[1], 5),
+            # as often as users[1] but longer ago
+            self.tran(users[2], 1), self.tran(users[2], 2),
+            self.tran(users[3], 6, transaction_type='request'),
+            self.tran(users[4], 7), self.tran(users[5], 8),
+            # to herself and from others, which do not count for alice
+            self.tran(self.alice, 9), self.tran(self.alice, 9, creator=users[0]),
+        )
+        self.assertEqual(self.shortlist(self.alice), [users[0], users[1], users[2], users[5], users[4], users[3]])
+        with mock.patch.object(counterparties, 'SHORTLIST_SIZE', 2):
+            self.assertEqual(self.shortlist(self.alice), users[:2])
+
+        User.objects.filter(pk=users[0].pk).update(is_active=False)
+        self.assertEqual(self.shortlist(self.alice)[0], users[1])
+
+    def test_rebuild_matches_incremental(self):
+        users, days = self.users, iter(range(100))
+        for creator in [self.alice] + users[:3]:
+            trans = [self.tran(receiver, next(days), creator) for receiver in users + users[::2] if receiver != creator]
+            # some one at a time, the rest in a batch
+            for tran in trans[:3]:
+                self.record(tran)
+            self.record(*trans[3:])
+        incremental = self.rows()
+        self.assertEqual(len(incremental), 21)
+
+        Counterparty.objects.all().delete()
+        self.assertEqual(counterparties.rebuild(), 21)
+        self.assertEqual(self.rows(), incremental)
+        # and again for one user only
+        Counterparty.objects.filter(user=users[1]).update(count=0)
+        counterparties.rebuild([users[1].pk])
+        self.assertEqual(self.rows(), incremental)
+
+
+class RegistrationTests(TransactionTestCase):
+    serialized_rollback = True
+
+    data = {'username': 'dave', 'first_name': 'Dave', 'last_name': 'Jones', 'email': 'dave@example.com',
+            'password': 'password', 'confirm_password': 'password', 'birthday': '1990-01-01', 'address': 'Here'}
+
+    def counts(self):
+        return [User.objects.count(), User.groups.through.objects.count(), Profile.objects.count(),
+                PaymentMethod.objects.count(), Account.objects.count()]
+
+    def test_one_post_creates_everything_in_one_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/registration/', self.data)
+        self.assertRedirects(response, '/login/', fetch_redirect_response=False)
+        user = User.objects.get(username='dave')
+        self.assertEqual(list(user.groups.values_list('name', flat=True)), ['normal_user'])
+        self.assertEqual(user.profile.address, 'Here')
+        self.assertEqual(balance(user), 0)
+        self.assertEqual(self.counts(), [1, 1, 1, 1, 1])
+
+        sql = [query['sql'] for query in queries.captured_queries]
+        inserts = [i for i, statement in enumerate(sql) if statement.startswith('INSERT')]
+        self.assertEqual(sql.count('BEGIN'), 1)
+        self.assertLess(sql.index('BEGIN'), inserts[0])
+
+    def test_failure_leaves_nothing_behind(self):
+        with mock.patch.object(Account.objects, 'create', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                self.client.post('/registration/', self.data)
+        self.assertEqual(self.counts(), [0, 0, 0, 0, 0])
+
+    def test_duplicate_username(self):
+        self.client.post('/registration/', self.data)
+        response = self.client.post('/registration/', dict(self.data, email='other@example.com'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('username', response.context['form'].errors)
+
+        # taken between the form's check and the save
+        with self.assertRaises(IntegrityError):
+            registration.register(User(username='dave', first_name='Other', last_name='Dave',
+                                       email='other@example.com'), 'password', date(1990, 1, 1), 'There')
+        self.assertEqual(self.counts(), [1, 1, 1, 1, 1])
+
+
+class SeedingTests(TestCase):
+    def rows(self):
+        # everything but the dates, which move with the time of the seed
+        return [
+            list(User.objects.order_by('pk').values_list('pk', 'username', 'first_name', 'email', 'is_staff')),
+            list(User.groups.through.objects.order_by('user', 'group').values_list('user', 'group')),
+            list(Profile.objects.order_by('user').values_list('user', 'birthday', 'address')),
+            list(PaymentMethod.objects.order_by('pk').values_list('pk', 'method_type', 'user')),
+            list(Account.objects.order_by('payment').values_list('payment', 'balance')),
+            list(Bank.objects.order_by('payment').values_list('payment', 'routing_number', 'account_number')),
+            list(Card.objects.order_by('payment').values_list('payment', 'card_type', 'card_number')),
+            list(Transaction.objects.order_by('pk').values_list(
+                'transaction_type', 'category', 'amount', 'is_complete', 'creator', 'receiver', 'payment_method')),
+            list(LedgerEntry.objects.order_by('pk').values_list('payment', 'kind', 'amount')),
+            sorted(summaries.stored().items(), key=str),
+            sorted(Counterparty.objects.values_list('user', 'counterparty', 'count')),
+        ]
+
+    def test_seed(self):
+        with transaction.atomic():
+            result = seeding.seed(users=3, transactions=10, staff=1, workers=1, chunk_size=4)
+            self.assertEqual(len(result.user_ids), 3)
+            self.assertEqual(result.rows, 3 * 11 + 10)
+            self.assertEqual(Transaction.objects.count(), 10)
+            self.assertEqual(User.objects.filter(is_staff=True).count(), 1)
+
+            balances, count = ledger.replay()
+            self.assertEqual(count, 6)
+            for payment, amount in Account.objects.values_list('payment', 'balance'):
+                self.assertEqual(balances[payment], amount)
+            self.assertEqual(sum(balances.values()), 0)
+            self.assertEqual(summaries.inconsistencies(), [])
+            self.assertTrue(Counterparty.objects.exists())
+
+            rows = self.rows()
+            transaction.set_rollback(True)
+
+        # the same chunks generated by two worker processes instead, into the same empty tables
+        seeding.seed(users=3, transactions=10, staff=1, workers=2, chunk_size=4)
+        self.assertEqual(self.rows(), rows)
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')[0]
+
+    def test_profile_changes_are_indexed(self):
+        self.alice.first_name = 'Zelda'
+        self.alice.save(update_fields=['first_name'])
+        self.assertEqual([user.username for user in search.search_users('zel')], ['alice'])
+
+    def test_best_matches_of_a_common_prefix(self):
+        # more matches than were once ranked, in the email only, before the best ones
+        User.objects.bulk_create(User(username='user%d' % i, email='user%d@zeta.test' % i) for i in range(1100))
+        User.objects.bulk_create([User(username='zetaone'), User(username='zetatwo', first_name='Zeta')])
+        search.rebuild()
+        self.assertEqual(sorted(user.username for user in search.search_users('zeta', 2)), ['zetaone', 'zetatwo'])
+
+    def test_login_does_not_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.login(username='alice', password='password')
+        self.assertFalse([query for query in queries if search.SEARCH_TABLE in query['sql']])
+
+
+class IdempotencyTests(TransactionTestCase):
+    # the same request, sent at once by several clients with one key, moves money once
+    serialized_rollback = True
+    clients = 8
+
+    def setUp(self):
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob = make_user('bob')[0]
+
+    def concurrently(self, request):
+        barrier = threading.Barrier(self.clients)
+        responses = [None] * self.clients
+
+        def run(i):
+            client = Client()
+            client.force_login(self.alice)
+            try:
+                barrier.wait()
+                responses[i] = request(client)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(self.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_form_send(self):
+        key = uuid.uuid4().hex
+        data = {'category': 'Others', 'amount': '2.50', 'payment_method': self.alice_wallet.pk,
+                'description': 'retry', 'idempotency_key': key}
+        responses = self.concurrently(lambda client: client.post('/send/%d/' % self.bob.pk, data))
+        # the first is answered, the others replay its answer or are told it is still running
+        self.assertEqual({response.status_code for response in responses} - {409}, {302})
+        self.assertEqual(balance(self.alice), Decimal('97.50'))
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get().status, 302)
+
+    def test_api_send(self):
+        key = uuid.uuid4().hex
+        data = json.dumps({'receiver': 'bob', 'category': 'Others', 'amount': '2.50',
+                           'payment_method': self.alice_wallet.pk, 'description': 'retry'})
+        responses = self.concurrently(lambda client: client.post(
+            '/api/send/', data, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key))
+        self.assertEqual({response.status_code for response in responses} - {409}, {201})
+        self.assertEqual(len({response.content for response in responses if response.status_code == 201}), 1)
+        self.assertEqual(balance(self.alice), Decimal('97.50'))
+
+        # once answered, a retry gets the same answer back
+        client = Client()
+        client.force_login(self.alice)
+        retry = client.post('/api/send/', data, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_failed_request_gives_the_key_up(self):
+        key = uuid.uuid4().hex
+        client = Client()
+        client.force_login(self.alice)
+        data = {'category': 'Others', 'amount': '-1', 'payment_method': self.alice_wallet.pk,
+                'description': 'retry', 'idempotency_key': key}
+        self.assertEqual(client.post('/send/%d/' % self.bob.pk, data).status_code, 200)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(client.post('/send/%d/' % self.bob.pk, dict(data, amount='1')).status_code, 302)
+        self.assertEqual(balance(self.alice), 99)
+
+
+class NotificationTests(TransactionTestCase):
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob = make_user('bob')[0]
+
+    def tearDown(self):
+        cache.clear()
+
+    def send(self):
+        ledger.send_money(Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet,
+                                      category='Food', amount=Decimal('5'), description='lunch'))
+
+    def test_only_committed_sends_notify(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.send()
+            raise ValueError('rolled back')
+        self.assertFalse(Job.objects.exists())
+
+        self.send()
+        jobs.run()
+        notification = Notification.objects.get()
+        self.assertEqual((notification.user, notification.actor, notification.kind, notification.amount),
+                         (self.bob, self.alice, 'send', 5))
+
+    def test_mark_read(self):
+        for _ in range(3):
+            self.send()
+        jobs.run()
+        self.client.force_login(self.bob)
+        self.assertContains(self.client.get('/notifications/'), '<span class="badge badge-danger">3</span>')
+
+        # the newest one arrived after the page was shown
+        newest = Notification.objects.order_by('pk').last()
+        self.client.post('/notifications/read/', {'up_to': newest.pk - 1})
+        self.assertEqual(notifications.unread_count(self.bob), 1)
+        response = self.client.post('/api/notifications/read/', '{}', content_type='application/json')
+        self.assertEqual(response.json(), {'marked': 1, 'unread': 0})
+        self.assertNotContains(self.client.get('/notifications/'), 'badge-danger')
+
+    @override_settings(JOBS_EAGER=True)
+    def test_long_poll_answers_when_notified(self):
+        self.client.force_login(self.bob)
+        sender = threading.Timer(0.2, self.send)
+        with mock.patch.object(notifications, 'POLL_INTERVAL', 0.05):
+            sender.start()
+            started = time.monotonic()
+            response = self.client.get('/api/notifications/poll/', {'wait': 10})
+            elapsed = time.monotonic() - started
+        sender.join()
+        self.assertLess(elapsed, 5)
+        self.assertEqual([row['amount'] for row in response.json()['results']], ['5.00'])
+        self.assertEqual(response.json()['unread'], 1)
+
+    def test_wait_must_be_finite(self):
+        self.client.force_login(self.bob)
+        for wait in ('nan', 'inf', '-inf', 'soon'):
+            self.assertEqual(self.client.get('/api/notifications/poll/', {'wait': wait}).status_code, 400, wait)
+
+
+def record_or_fail(payloads):
+    if any(payload.get('fail') for payload in payloads):
+        raise ValueError('cannot record this one')
+
+
+class JobTests(TransactionTestCase):
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob = make_user('bob')[0]
+
+    def send(self):
+        ledger.send_money(Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet,
+                                      category='Food', amount=Decimal('1'), description='lunch'))
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_jobs_run_after_commit(self):
+        # queued by another request and left to the worker
+        with self.settings(JOBS_EAGER=False):
+            jobs.enqueue(record_or_fail, {'fail': True})
+        self.send()
+        self.assertEqual(list(Job.objects.values_list('task', 'attempts', 'last_error')),
+                         [('app.tests.record_or_fail', 0, '')])
+        self.assertEqual(counterparties.shortlist(self.alice), [self.bob])
+        self.assertEqual(notifications.unread_count(self.bob), 1)
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_jobs_out_of_time_are_left_to_the_worker(self):
+        with mock.patch.object(jobs, 'EAGER_MAX_SECONDS', 0):
+            self.send()
+        self.assertEqual(list(Job.objects.values_list('locked_by', 'attempts')), [('', 0), ('', 0)])
+        self.assertEqual(jobs.run().done, 2)
+        self.assertEqual(notifications.unread_count(self.bob), 1)
+
+    def test_worker_runs_queued_jobs(self):
+        self.send()
+        self.assertEqual(Job.objects.count(), 2)
+        result = jobs.run()
+        self.assertEqual((result.done, result.failures), (2, []))
+        self.assertEqual(counterparties.shortlist(self.alice), [self.bob])
+
+    def test_failed_batch_is_logged_and_run_one_at_a_time(self):
+        jobs.enqueue_many(record_or_fail, [{}, {'fail': True}, {}])
+        with self.assertLogs('app.jobs', 'WARNING') as logs:
+            result = jobs.run()
+        self.assertIn('A batch of 3 app.tests.record_or_fail jobs failed', logs.output[0])
+        self.assertEqual(result.done, 2)
+        self.assertEqual(len(result.failures), 1)
+        self.assertEqual(Job.objects.get().attempts, 1)
+
+
+class BrokenBackend(events.LocalBackend):
+    def publish(self, channel, event):
+        raise ConnectionError('the broker is down')
+
+
+class EventTests(TransactionTestCase):
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.alice_wallet = make_user('alice')
+        self.bob = make_user('bob')[0]
+
+    def tearDown(self):
+        events._backend = None
+        cache.clear()
+
+    def test_stream(self):
+        self.client.force_login(self.bob)
+        response = self.client.get('/api/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = iter(response.streaming_content)
+        self.assertEqual(next(chunks), b'retry: 2000\n\n')
+        self.assertEqual(next(chunks), b'event: balance\ndata: {"balance": "100.00"}\n\n')
+        ledger.send_money(Transaction(creator=self.alice, receiver=self.bob, payment_method=self.alice_wallet,
+                                      category='Food', amount=Decimal('5'), description='lunch'))
+        received = next(chunks).decode()
+        self.assertIn('event: transaction\n', received)
+        self.assertIn('event: balance\ndata: {"balance": "105.00", "change": "5.00", "kind": "send"}', received)
+        response.close()
+        self.assertEqual(events.backend().subscriber_count(), 0)
+
+    def test_failure_before_the_stream_unsubscribes(self):
+        self.client.force_login(self.bob)
+        with mock.patch.object(wallet, 'overview', side_effect=DatabaseError('database is locked')):
+            with self.assertRaises(DatabaseError):
+                self.client.get('/api/events/')
+        self.assertEqual(events.backend().subscriber_count(), 0)
+
+    def test_failed_publish_does_not_fail_the_send(self):
+        events._backend = BrokenBackend()
+        self.client.force_login(self.alice)
+        with self.assertLogs('app.events', 'ERROR') as logs:
+            response = self.client.post('/send/%d/' % self.bob.pk, {
+                'category': 'Food', 'amount': '5', 'payment_method': self.alice_wallet.pk, 'description': 'lunch'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('Publishing 4 events failed', logs.output[0])
+        self.assertEqual(balance(self.bob), 105)
+
+    def test_sqlite_poller_survives_errors(self):
+        backend = events.SQLiteBackend(os.path.join(tempfile.mkdtemp(), 'events.sqlite3'), poll_interval=0.01)
+        poll, failures = backend.poll, [sqlite3.OperationalError('database is locked')] * 2
+
+        def flaky_poll():
+            if failures:
+                raise failures.pop()
+            return poll()
+
+        with mock.patch.object(backend, 'poll', flaky_poll), self.assertLogs('app.events', 'ERROR') as logs:
+            subscription = backend.subscribe(['user:1'])
+            backend.publish('user:1', ('balance', '{}'))
+            self.assertEqual(subscription.get(5), [('balance', '{}')])
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('database is locked', logs.output[0])
+        subscription.close()
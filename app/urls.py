@@ -1,4 +1,25 @@
 from django.urls import path
+from app.api import (
+    ApiIndex,
+    ApiLogin,
+    ApiLogout,
+    ApiBalance,
+    ApiEvents,
+    ApiPaymentMethods,
+    ApiSend,
+    ApiRequest,
+    ApiScheduled,
+    ApiScheduledCancel,
+    ApiIncompleteList,
+    ApiIncompletePay,
+    ApiActivity,
+    ApiNotifications,
+    ApiNotificationsPoll,
+    ApiNotificationsRead,
+    ApiPayouts,
+    ApiUserSearch,
+    ApiUserImport,
+)
 from app.views import (
     Index,
     UserProfile,
@@ -22,18 +43,29 @@ from app.views import (
     RequestMoney,
     RequestSuccess,
     ActivityList,
+    ActivityExport,
+    SpendingSummaryList,
     IncompleteTranList,
+    ScheduledPaymentList,
+    ScheduledPaymentCancel,
+    NotificationList,
+    NotificationsRead,
     IncompletePayment,
     IncompletePaymentConfirm,
     PaymentComplete,
     IncompleteRequest,
     IncompleteRequestDelete,
     StaffTransactionList,
+    StaffTransactionExport,
     StaffTranDetail,
     StaffTranDelete,
     StaffUserList,
     StaffUserInfo,
     StaffUserTran,
+    StaffUserTranExport,
+    StaffUserSummary,
+    StaffCacheStats,
+    StaffProfile,
     StaffUserTranDetail,
     StaffUserTranDelete,
     StaffUserPayment,
@@ -58,6 +90,8 @@ urlpatterns = [
     path('card/<int:pk>/update/', CardUpdate.as_view(), name='card_update'),
     path('card/<int:pk>/delete/', CardDelete.as_view(), name='card_delete'),
     path('activity/', ActivityList.as_view(), name='activity'),
+    path('activity/export/', ActivityExport.as_view(), name='activity_export'),
+    path('summary/', SpendingSummaryList.as_view(), name='spending_summary'),
     path('send/', SendSearchUser.as_view(), name='send'),
     path('send/<int:pk>/', SendMoney.as_view(), name='send_money'),
     path('send/success/', SendSuccess.as_view(), name='send_success'),
@@ -65,13 +99,20 @@ urlpatterns = [
     path('request/<int:pk>/', RequestMoney.as_view(), name='request_money'),
     path('request/success/', RequestSuccess.as_view(), name='request_success'),
     path('incomplete/', IncompleteTranList.as_view(), name='incomplete'),
+    path('scheduled/', ScheduledPaymentList.as_view(), name='scheduled'),
+    path('scheduled/<int:pk>/cancel/', ScheduledPaymentCancel.as_view(), name='scheduled_cancel'),
+    path('notifications/', NotificationList.as_view(), name='notifications'),
+    path('notifications/read/', NotificationsRead.as_view(), name='notifications_read'),
     path('incomplete/payment/<int:pk>/detail/', IncompletePayment.as_view(), name='incomplete_payment'),
     path('incomplete/payment/<int:pk>/confirm/', IncompletePaymentConfirm.as_view(), name='incomplete_payment_confirm'),
     path('incomplete/payment/complete/', PaymentComplete.as_view(), name='payment_complete'),
     path('incomplete/request/<int:pk>/detail/', IncompleteRequest.as_view(), name='incomplete_request'),
     path('incomplete/request/<int:pk>/delete/', IncompleteRequestDelete.as_view(), name='incomplete_request_delete'),
 
+    path('staff/cache/', StaffCacheStats.as_view(), name='staff_cache_stats'),
+    path('staff/profile/', StaffProfile.as_view(), name='staff_profile'),
     path('staff/transaction/', StaffTransactionList.as_view(), name='staff_transaction'),
+    path('staff/transaction/export/', StaffTransactionExport.as_view(), name='staff_transaction_export'),
     path('staff/transaction/<int:pk>/detail/', StaffTranDetail.as_view(), name='staff_tran_detail'),
     path('staff/transaction/<int:pk>/delete/', StaffTranDelete.as_view(), name='staff_tran_delete'),
     path('staff/user/', StaffUserList.as_view(), name='staff_user'),
@@ -80,7 +121,28 @@ urlpatterns = [
     path('staff/user/<int:pk>/bank/<int:bpk>', StaffUserBankDetail.as_view(), name='staff_user_bank'),
     path('staff/user/<int:pk>/card/<int:cpk>/', StaffUserCardDetail.as_view(), name='staff_user_card'),
     path('staff/user/<int:pk>/transactions/', StaffUserTran.as_view(), name='staff_user_tran'),
+    path('staff/user/<int:pk>/transactions/export/', StaffUserTranExport.as_view(), name='staff_user_tran_export'),
+    path('staff/user/<int:pk>/summary/', StaffUserSummary.as_view(), name='staff_user_summary'),
     path('staff/user/<int:pk>/transactions/<int:tpk>/detail', StaffUserTranDetail.as_view(), name='staff_user_tran_detail'),
     path('staff/user/<int:pk>/transactions/<int:tpk>/delete', StaffUserTranDelete.as_view(), name='staff_user_tran_delete'),
 
+    path('api/', ApiIndex.as_view(), name='api_index'),
+    path('api/login/', ApiLogin.as_view(), name='api_login'),
+    path('api/logout/', ApiLogout.as_view(), name='api_logout'),
+    path('api/balance/', ApiBalance.as_view(), name='api_balance'),
+    path('api/events/', ApiEvents.as_view(), name='api_events'),
+    path('api/payment-methods/', ApiPaymentMethods.as_view(), name='api_payment_methods'),
+    path('api/send/', ApiSend.as_view(), name='api_send'),
+    path('api/request/', ApiRequest.as_view(), name='api_request'),
+    path('api/scheduled/', ApiScheduled.as_view(), name='api_scheduled'),
+    path('api/scheduled/<int:pk>/cancel/', ApiScheduledCancel.as_view(), name='api_scheduled_cancel'),
+    path('api/incomplete/', ApiIncompleteList.as_view(), name='api_incomplete'),
+    path('api/incomplete/<int:pk>/pay/', ApiIncompletePay.as_view(), name='api_incomplete_pay'),
+    path('api/activity/', ApiActivity.as_view(), name='api_activity'),
+    path('api/notifications/', ApiNotifications.as_view(), name='api_notifications'),
+    path('api/notifications/poll/', ApiNotificationsPoll.as_view(), name='api_notifications_poll'),
+    path('api/notifications/read/', ApiNotificationsRead.as_view(), name='api_notifications_read'),
+    path('api/payouts/', ApiPayouts.as_view(), name='api_payouts'),
+    path('api/users/search/', ApiUserSearch.as_view(), name='api_user_search'),
+    path('api/users/import/', ApiUserImport.as_view(), name='api_user_import'),
 ]
@@ -1,3 +1,86 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Q
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+_executor = None
+_worker = threading.local()
+
+
+def _log_query(caller, execute, sql, params, many, context):
+    # adds a query run on a worker thread to the queries of the calling thread's
+    # connection, where DEBUG and CaptureQueriesContext look for them
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if many:
+            sql = '%s times: %s' % (len(params), sql)
+        else:
+            sql = context['connection'].ops.last_executed_query(context['cursor'], sql, params)
+        caller.queries_log.append({'sql': sql, 'time': '%.3f' % (time.perf_counter() - start)})
+
+
+def _caller_wrappers():
+    # the execute wrappers of the calling thread (e.g. ProfilingMiddleware's query timer),
+    # so the queries of its workers are counted with its own
+    caller = connections[DEFAULT_DB_ALIAS]
+    wrappers = list(caller.execute_wrappers)
+    if caller.queries_logged:
+        wrappers.append(partial(_log_query, caller))
+    return wrappers
+
+
+def _run_in_worker(function, wrappers):
+    # Worker threads keep their database connections from one call to the next for
+    # CONCURRENT_QUERY_CONN_MAX_AGE seconds, whatever CONN_MAX_AGE says: with
+    # CONN_MAX_AGE = 0, opening one per call costs more than overlapping the queries
+    # saves. A connection that stopped working is replaced before the call.
+    _worker.active = True
+    if time.monotonic() >= getattr(_worker, 'close_at', 0):
+        connections.close_all()
+        _worker.close_at = time.monotonic() + getattr(settings, 'CONCURRENT_QUERY_CONN_MAX_AGE', 600)
+    for conn in connections.all():
+        if conn.connection is not None and conn.errors_occurred and not conn.is_usable():
+            conn.close()
+    with ExitStack() as stack:
+        for wrapper in wrappers:
+            stack.enter_context(connections[DEFAULT_DB_ALIAS].execute_wrapper(wrapper))
+        return function()
+
+
+# Call independent functions (usually each reading a queryset) at the same time and
+# return their results in order. The first runs in the calling thread, the others on
+# worker threads with their own connections, so their round trips to the database
+# overlap. Inside a transaction the workers could not see its uncommitted rows, so
+# everything runs here, one after another; so do calls made from a worker.
+def run_concurrently(*functions):
+    global _executor
+    workers = getattr(settings, 'CONCURRENT_QUERY_WORKERS', 0)
+    if len(functions) < 2 or workers < 2 or connection.in_atomic_block or getattr(_worker, 'active', False):
+        return [function() for function in functions]
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(workers, thread_name_prefix='query')
+    wrappers = _caller_wrappers()
+    futures = [_executor.submit(_run_in_worker, function, wrappers) for function in functions[1:]]
+    first = functions[0]()
+    return [first] + [future.result() for future in futures]
+
+
+def evaluate_concurrently(querysets):
+    return run_concurrently(*[partial(list, queryset) for queryset in querysets])
+
+
 class PageLinksMixin:
     page_kwarg = 'page'
 
@@ -48,4 +131,171 @@ class PageLinksMixin:
                 'last_page_url':
                     self.last_page(page),
             })
-        return context
\ No newline at end of file
+        return context
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, page_kwarg, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.page_kwarg = page_kwarg
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    # Seek pagination: a page is fetched with a "WHERE (ordering) < (cursor)"
+    # condition and a LIMIT, so every page costs the same as the first one. The
+    # rows of several querysets (e.g. both sides of an OR) can be merged into one
+    # page, letting each of them use its own index. All ordering fields must sort
+    # in the same direction.
+    next_page = 'n'
+    previous_page = 'p'
+
+    def __init__(self, querysets, per_page, ordering=('-create_date', '-pk')):
+        self.querysets = querysets
+        self.per_page = per_page
+        self.ordering = ordering
+        self.descending = ordering[0].startswith('-')
+        self.fields = [name.lstrip('-') for name in ordering]
+        opts = querysets[0].model._meta
+        self.model_fields = [opts.pk if name == 'pk' else opts.get_field(name) for name in self.fields]
+
+    def _key(self, obj):
+        return tuple(getattr(obj, name) for name in self.fields)
+
+    def encode_cursor(self, direction, obj=None):
+        key = [] if obj is None else [
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in self._key(obj)]
+        data = json.dumps([direction] + key, separators=(',', ':'))
+        return urlsafe_base64_encode(data.encode())
+
+    def decode_cursor(self, cursor):
+        # a cursor that does not decode is treated as the first page
+        try:
+            direction, *key = json.loads(urlsafe_base64_decode(cursor).decode())
+            if direction not in (self.next_page, self.previous_page):
+                raise ValueError(direction)
+            if key and len(key) != len(self.fields):
+                raise ValueError(key)
+            key = [field.to_python(value) for field, value in zip(self.model_fields, key)]
+            # the ordering fields are not nullable, and a None would seek with "< NULL"
+            if None in key:
+                raise ValueError(key)
+        except (ValueError, TypeError, ValidationError):
+            return self.next_page, []
+        return direction, key
+
+    def _seek(self, key, forward):
+        # (a, b) after (x, y) in "-a, -b" order is a < x OR (a = x AND b < y); the
+        # redundant a <= x lets the database turn the condition into an index range
+        lookup = 'lt' if self.descending == forward else 'gt'
+        condition = Q()
+        for i, name in enumerate(self.fields):
+            equal = {self.fields[j]: key[j] for j in range(i)}
+            condition |= Q(**equal, **{'%s__%s' % (name, lookup): key[i]})
+        return Q(**{'%s__%se' % (self.fields[0], lookup): key[0]}) & condition
+
+    def get_querysets(self, key, forward=True):
+        # one query per queryset, each fetching a row more than a page to detect the end
+        if forward:
+            ordering = self.ordering
+        else:
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+
+        querysets = []
+        for queryset in self.querysets:
+            if key:
+                queryset = queryset.filter(self._seek(key, forward))
+            querysets.append(queryset.order_by(*ordering)[:self.per_page + 1])
+        return querysets
+
+    def page(self, cursor=None, page_kwarg='cursor'):
+        direction, key = self.decode_cursor(cursor) if cursor else (self.next_page, [])
+        forward = direction == self.next_page
+
+        rows = []
+        for result in evaluate_concurrently(self.get_querysets(key, forward)):
+            rows.extend(result)
+        rows.sort(key=self._key, reverse=self.descending == forward)
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more if forward else key:
+                next_cursor = self.encode_cursor(self.next_page, rows[-1])
+            if key if forward else has_more:
+                previous_cursor = self.encode_cursor(self.previous_page, rows[0])
+        elif key:
+            # walked past either end, offer a way back to the start
+            previous_cursor = self.encode_cursor(self.next_page)
+        return KeysetPage(rows, self, page_kwarg, next_cursor, previous_cursor)
+
+
+class KeysetPageLinksMixin(PageLinksMixin):
+    page_kwarg = 'cursor'
+    keyset_per_page = 20
+    keyset_ordering = ('-create_date', '-pk')
+
+    def _page_urls(self, cursor, page_kwarg=None):
+        # keep the other query parameters (filters, the cursor of another list)
+        params = self.request.GET.copy()
+        params.pop(page_kwarg or self.page_kwarg, None)
+        if cursor is not None:
+            params[page_kwarg or self.page_kwarg] = cursor
+        return '?' + params.urlencode()
+
+    def paginate_keyset(self, querysets, page_kwarg=None):
+        page_kwarg = page_kwarg or self.page_kwarg
+        paginator = KeysetPaginator(querysets, self.keyset_per_page, self.keyset_ordering)
+        return paginator.page(self.request.GET.get(page_kwarg), page_kwarg)
+
+    def first_page(self, page):
+        if page.has_previous():
+            return self._page_urls(None, page.page_kwarg)
+        return None
+
+    def previous_page(self, page):
+        if page.has_previous():
+            return self._page_urls(page.previous_cursor, page.page_kwarg)
+        return None
+
+    def next_page(self, page):
+        if page.has_next():
+            return self._page_urls(page.next_cursor, page.page_kwarg)
+        return None
+
+    def last_page(self, page):
+        # an empty "previous" cursor seeks backwards from the far end of the list
+        if page.has_next():
+            cursor = page.paginator.encode_cursor(page.paginator.previous_page)
+            return self._page_urls(cursor, page.page_kwarg)
+        return None
+
+    def page_links(self, page):
+        return {
+            'first_page_url': self.first_page(page),
+            'previous_page_url': self.previous_page(page),
+            'next_page_url': self.next_page(page),
+            'last_page_url': self.last_page(page),
+        }
@@ -1,13 +1,18 @@
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.views import LoginView, LogoutView
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse_lazy
-from django.contrib.auth.models import Group, User
-from django.db.models import Q, F
+from django.contrib.auth.models import User
+from django.db.models import Q
 from django.views import View
 from django.views.generic import CreateView, ListView, UpdateView, DeleteView
 from django.contrib import messages
+from app import counterparties, ledger, notifications, profiling, registration, scheduler, search, summaries, wallet
+from app.export import export_response
+from app.idempotency import IdempotentMixin
+from app.ledger import TransferError
+from app.utils import KeysetPageLinksMixin, evaluate_concurrently, run_concurrently
 from app.form import (
     UserRegistrationForm,
     UserForm,
@@ -21,6 +26,7 @@ from app.form import (
     SendMoneyForm,
     RequestMoneyForm,
     CompletePaymentForm,
+    StaffTransactionFilterForm,
 )
 
 from .models import (
@@ -30,6 +36,8 @@ from .models import (
     Card,
     Transaction,
     PaymentMethod,
+    ScheduledPayment,
+    Notification,
 )
 
 class Index(View):
@@ -56,20 +64,8 @@ class UserRegistration(CreateView):
         return self.request.user
 
     def form_valid(self, form):
-        user = form.save()
-        password = form.cleaned_data['password']
-
-        user.set_password(password)
-        user.save()
-
-        group = Group.objects.get(name='normal_user')
-        user.groups.add(group)
-
-        # Create User Profile model
-        Profile.objects.create(user=user, birthday=form.clean_birthday(), address=form.clean_address())
-        payment = PaymentMethod.objects.create(user=user, method_type='account')
-        Account.objects.create(payment=payment)
-
+        registration.register(form.save(commit=False), form.cleaned_data['password'],
+                              form.cleaned_data['birthday'], form.cleaned_data['address'])
         return HttpResponseRedirect(reverse_lazy('user_login'))
 
 
@@ -139,7 +135,7 @@ class AccountList(LoginRequiredMixin, ListView, PermissionRequiredMixin):
         context = super().get_context_data(**kwargs)
         user = self.request.user
         context['nbar'] = 'account'
-        context['account'] = Account.objects.filter(payment__user=user)
+        context['account'] = wallet.overview(user)['account']
         return context
 
 
@@ -150,11 +146,17 @@ class AccountTransfer(LoginRequiredMixin, View, PermissionRequiredMixin):
         account = get_object_or_404(
             Account,
             pk=pk,
+            payment__user=request.user,
         )
         return render(request, 'app/account_transfer_confirm.html', {'account': account, 'nbar': 'account'})
 
     def post(self, request, pk):
-        Account.objects.filter(id=self.kwargs.get('pk')).update(balance=0)
+        account = get_object_or_404(
+            Account,
+            pk=pk,
+            payment__user=request.user,
+        )
+        ledger.withdraw(account)
         return HttpResponseRedirect(reverse_lazy('account'))
 
 
@@ -167,7 +169,7 @@ class BankList(LoginRequiredMixin, ListView, PermissionRequiredMixin):
         context = super().get_context_data(**kwargs)
         user = self.request.user
         context['nbar'] = 'bank'
-        context['bank_list'] = Bank.objects.filter(payment__user=user)
+        context['bank_list'] = wallet.overview(user)['bank_list']
         return context
 
 
@@ -206,9 +208,11 @@ class BankDetail(LoginRequiredMixin, View, PermissionRequiredMixin):
     permission_required = 'app.view_bank'
 
     def get(self, request, pk):
+        # one query for the bank and its owner, and only the requesting user's banks
         bank = get_object_or_404(
-            Bank,
+            Bank.objects.select_related('payment__user'),
             pk=pk,
+            payment__user=request.user,
         )
 
         return render(
@@ -260,7 +264,7 @@ class CardList(LoginRequiredMixin, ListView, PermissionRequiredMixin):
         user = self.request.user
 
         context['nbar'] = 'card'
-        context['card_list'] = Card.objects.filter(payment__user=user)
+        context['card_list'] = wallet.overview(user)['card_list']
         return context
 
 
@@ -303,9 +307,11 @@ class CardDetail(LoginRequiredMixin, View, PermissionRequiredMixin):
     permission_required = 'app.view_card'
 
     def get(self, request, pk):
+        # one query for the card and its owner, and only the requesting user's cards
         card = get_object_or_404(
-            Card,
-            pk=pk
+            Card.objects.select_related('payment__user'),
+            pk=pk,
+            payment__user=request.user,
         )
 
         return render(
@@ -348,61 +354,91 @@ class CardDelete(LoginRequiredMixin, DeleteView, PermissionRequiredMixin):
         return HttpResponseRedirect(reverse_lazy('card'))
 
 
-class ActivityList(LoginRequiredMixin, ListView, PermissionRequiredMixin):
+class ActivityList(LoginRequiredMixin, KeysetPageLinksMixin, ListView, PermissionRequiredMixin):
     model = Transaction
     template_name = 'app/activity_list.html'
     permission_required = 'app.view_transaction'
+    keyset_ordering = ('-create_date', '-transaction_id')
+
+    # each side of the former OR is paginated on its own and merged per page
+    def get_pay_querysets(self, user):
+        transactions = Transaction.objects.for_listing()
+        return [transactions.filter(creator=user, is_complete=True, transaction_type='send'),
+                transactions.filter(receiver=user, is_complete=True, transaction_type='request')]
+
+    def get_receive_querysets(self, user):
+        transactions = Transaction.objects.for_listing()
+        return [transactions.filter(receiver=user, is_complete=True, transaction_type='send'),
+                transactions.filter(creator=user, is_complete=True, transaction_type='request')]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
 
-        context['pay_list'] = Transaction.objects.filter(Q(creator=user, is_complete=True, transaction_type='send') |
-                                                         Q(receiver=user, is_complete=True,
-                                                           transaction_type='request')).order_by('-create_date')
-        context['receive_list'] = Transaction.objects.filter(Q(receiver=user, is_complete=True, transaction_type='send') |
-                                                            Q(creator=user, is_complete=True,
-                                                            transaction_type='request')).order_by('-create_date')
+        # the two lists are independent, fetch them at the same time
+        pay_page, receive_page = run_concurrently(
+            lambda: self.paginate_keyset(self.get_pay_querysets(user), 'pay'),
+            lambda: self.paginate_keyset(self.get_receive_querysets(user), 'receive'))
+        context['pay_list'] = pay_page
+        context['pay_links'] = self.page_links(pay_page)
+        context['receive_list'] = receive_page
+        context['receive_links'] = self.page_links(receive_page)
         return context
 
 
-class SendSearchUser(LoginRequiredMixin, ListView):
-    model = User
-    form_class = SearchUserForm
-    template_name = 'app/send_search_user_form.html'
+class ActivityExport(LoginRequiredMixin, View, PermissionRequiredMixin):
+    permission_required = 'app.view_transaction'
 
-    def get_queryset(self):
-        try:
-            username = self.kwargs['search_user']
-        except:
-            username = ''
+    def get(self, request):
+        user = request.user
+        activity = ActivityList()
+        querysets = activity.get_pay_querysets(user) + activity.get_receive_querysets(user)
+        return export_response(querysets, request.GET.get('format', 'csv'), 'activity')
 
-        if username != '':
-            object_list = self.model.objects.filter(username=username)
-        else:
-            object_list = self.model.objects.all()
-        return object_list
+
+class SpendingSummaryList(LoginRequiredMixin, View, PermissionRequiredMixin):
+    permission_required = 'app.view_transaction'
+
+    def get(self, request):
+        return render(
+            request,
+            'app/spending_summary.html',
+            {'month_list': summaries.by_month(request.user), 'nbar': 'summary'}
+        )
+
+
+class UserSearchMixin:
+    # the top matches of the search_user query instead of every user
+    def get_queryset(self):
+        query = self.request.GET.get("search_user", '').strip()
+        return search.search_users(query) if query else []
 
     def get_context_data(self, **kwargs):
-        context = super(SendSearchUser, self).get_context_data(**kwargs)
-        query = self.request.GET.get("search_user")
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get("search_user", '').strip()
         context['user'] = self.request.user
+        context['search_user'] = context['object_list']
+        # the people the user deals with most, to skip the search
+        context['recent_users'] = counterparties.shortlist(self.request.user) if not query else []
+        # an exact username still goes straight to the form
+        context['exact_user'] = next((user for user in context['object_list'] if user.username == query), None)
+        if query and not context['object_list']:
+            messages.error(self.request, 'No user found.')
+        return context
 
-        if query:
-            queryset = (Q(username=query))
-            search_user = User.objects.filter(queryset).distinct()
-            if not search_user:
-                messages.error(self.request, 'No user found.')
-        else:
-            search_user = []
 
-        context['search_user'] = search_user
-        context['nbar'] = 'send'
+class SendSearchUser(LoginRequiredMixin, UserSearchMixin, ListView):
+    model = User
+    form_class = SearchUserForm
+    template_name = 'app/send_search_user_form.html'
 
+    def get_context_data(self, **kwargs):
+        context = super(SendSearchUser, self).get_context_data(**kwargs)
+        context['nbar'] = 'send'
         return context
 
 
-class SendMoney(LoginRequiredMixin, CreateView, PermissionRequiredMixin):
+class SendMoney(LoginRequiredMixin, IdempotentMixin, CreateView, PermissionRequiredMixin):
     form_class = SendMoneyForm
     model = Transaction
     template_name = 'app/send_money_form.html'
@@ -427,17 +463,11 @@ class SendMoney(LoginRequiredMixin, CreateView, PermissionRequiredMixin):
         transaction.description = form.clean_description()
         transaction.payment_method = form.clean_payment_method()
 
-        creator_payment = PaymentMethod.objects.filter(user=transaction.creator,
-                                                       method_id=transaction.payment_method.method_id)
-        creator_account = Account.objects.filter(payment=creator_payment[0])
-        if creator_account:
-            creator_account.update(balance=F('balance') - transaction.amount)
-
-        receiver_payment = PaymentMethod.objects.filter(user=transaction.receiver, method_type='account')
-        receiver_account = Account.objects.filter(payment=receiver_payment[0])
-        receiver_account.update(balance=F('balance')+transaction.amount)
-
-        transaction.save()
+        try:
+            scheduler.send(transaction, form.cleaned_data['repeat'])
+        except TransferError as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
         return HttpResponseRedirect(reverse_lazy('send_success'))
 
 
@@ -446,42 +476,64 @@ class SendSuccess(LoginRequiredMixin, View):
         return render(request, 'app/send_success_page.html', {'nbar': 'send'})
 
 
-class RequestSearchUser(LoginRequiredMixin, ListView):
-    model = User
-    form_class = SearchUserForm
-    template_name = 'app/request_search_user_form.html'
+class ScheduledPaymentList(LoginRequiredMixin, ListView):
+    model = ScheduledPayment
+    template_name = 'app/scheduled_list.html'
 
     def get_queryset(self):
-        try:
-            username = self.kwargs['search_user']
-        except:
-            username = ''
-        if username != '':
-            object_list = self.model.objects.filter(username=username)
-        else:
-            object_list = self.model.objects.all()
-        return object_list
+        return ScheduledPayment.objects.filter(user=self.request.user, is_active=True).select_related('receiver')
 
     def get_context_data(self, **kwargs):
-        context = super(RequestSearchUser, self).get_context_data(**kwargs)
-        query = self.request.GET.get("search_user")
-        context['user'] = self.request.user
+        context = super().get_context_data(**kwargs)
+        context['nbar'] = 'scheduled'
+        return context
 
-        if query:
-            queryset = (Q(username=query))
-            search_user = User.objects.filter(queryset).distinct()
-            if not search_user:
-                messages.error(self.request, 'No user found.')
-        else:
-            search_user = []
 
-        context['search_user'] = search_user
-        context['nbar'] = 'request'
+class ScheduledPaymentCancel(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        schedule = get_object_or_404(ScheduledPayment, pk=pk, user=request.user, is_active=True)
+        ScheduledPayment.objects.filter(pk=schedule.pk).update(is_active=False)
+        messages.success(request, 'The scheduled payment to %s was cancelled.' % schedule.receiver.username)
+        return HttpResponseRedirect(reverse_lazy('scheduled'))
 
+
+class NotificationList(LoginRequiredMixin, KeysetPageLinksMixin, ListView):
+    model = Notification
+    template_name = 'app/notification_list.html'
+    keyset_ordering = ('-pk',)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = self.paginate_keyset([notifications.inbox(self.request.user)])
+        context['notification_list'] = page
+        context['page_links'] = self.page_links(page)
+        context['nbar'] = 'notifications'
         return context
 
 
-class RequestMoney(LoginRequiredMixin, CreateView, PermissionRequiredMixin):
+class NotificationsRead(LoginRequiredMixin, View):
+    def post(self, request):
+        # up to the newest notification the page showed, so later ones stay unread
+        try:
+            up_to = int(request.POST['up_to'])
+        except (KeyError, ValueError):
+            up_to = None
+        notifications.mark_read(request.user, up_to)
+        return HttpResponseRedirect(reverse_lazy('notifications'))
+
+
+class RequestSearchUser(LoginRequiredMixin, UserSearchMixin, ListView):
+    model = User
+    form_class = SearchUserForm
+    template_name = 'app/request_search_user_form.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(RequestSearchUser, self).get_context_data(**kwargs)
+        context['nbar'] = 'request'
+        return context
+
+
+class RequestMoney(LoginRequiredMixin, IdempotentMixin, CreateView, PermissionRequiredMixin):
     form_class = RequestMoneyForm
     model = Transaction
     template_name = 'app/request_money_form.html'
@@ -499,12 +551,10 @@ class RequestMoney(LoginRequiredMixin, CreateView, PermissionRequiredMixin):
         transaction = form.save(commit=False)
         transaction.creator = self.request.user
         transaction.receiver = User.objects.get(id=self.kwargs.get('pk'))
-        transaction.transaction_type = 'request'
-        transaction.is_complete = False
         transaction.category = form.clean_category()
         transaction.amount = form.cleaned_data['amount']
         transaction.description = form.clean_description()
-        transaction.save()
+        ledger.request_money(transaction)
 
         return HttpResponseRedirect(reverse_lazy('request_success'))
 
@@ -519,11 +569,17 @@ class IncompleteTranList(LoginRequiredMixin, ListView, PermissionRequiredMixin):
     template_name = 'app/incomplete_list.html'
     permission_required = 'app.view_transaction'
 
+    def get_creator_queryset(self, user):
+        return Transaction.objects.for_listing().filter(creator=user, is_complete=False)
+
+    def get_receiver_queryset(self, user):
+        return Transaction.objects.for_listing().filter(receiver=user, is_complete=False)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
-        context['tran_creator_list'] = Transaction.objects.filter(creator=user, is_complete=False)
-        context['tran_receiver_list'] = Transaction.objects.filter(receiver=user, is_complete=False)
+        context['tran_creator_list'], context['tran_receiver_list'] = evaluate_concurrently(
+            [self.get_creator_queryset(user), self.get_receiver_queryset(user)])
         context['nbar'] = 'incomplete'
         return context
 
@@ -544,7 +600,7 @@ class IncompletePayment(LoginRequiredMixin, View, PermissionRequiredMixin):
         )
 
 
-class IncompletePaymentConfirm(LoginRequiredMixin, UpdateView, PermissionRequiredMixin):
+class IncompletePaymentConfirm(LoginRequiredMixin, IdempotentMixin, UpdateView, PermissionRequiredMixin):
     model = Transaction
     form_class = CompletePaymentForm
     template_name = 'app/payment_confirm.html'
@@ -560,21 +616,14 @@ class IncompletePaymentConfirm(LoginRequiredMixin, UpdateView, PermissionRequire
 
     def form_valid(self, form):
         transaction = form.save(commit=False)
-        transaction.is_complete = True
-        transaction.payment_method = form.clean_payment_method()
-
         sender = self.request.user
-        sender_payment = PaymentMethod.objects.filter(user=sender, method_id=transaction.payment_method.method_id)
-        sender_account = Account.objects.filter(payment=sender_payment[0])
-        if sender_account:
-            sender_account.update(balance=F('balance') - transaction.amount)
 
         # receiver is the person who create the request (transaction creator at this point)
-        receiver_payment = PaymentMethod.objects.filter(user=transaction.creator, method_type='account')
-        receiver_account = Account.objects.filter(payment=receiver_payment[0])
-        receiver_account.update(balance=F('balance')+transaction.amount)
-
-        transaction.save()
+        try:
+            ledger.complete_payment(transaction, sender, form.clean_payment_method())
+        except TransferError as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
         return HttpResponseRedirect(reverse_lazy('payment_complete'))
 
 
@@ -644,15 +693,50 @@ class StaffUserTran(LoginRequiredMixin, ListView, PermissionRequiredMixin):
     template_name = 'staff/user_transaction_list.html'
     permission_required = 'app.view_transaction'
 
+    def get_tran_queryset(self, target_user):
+        return Transaction.objects.for_listing().filter(Q(receiver=target_user) | Q(creator=target_user))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         target_user = self.kwargs['pk']
-        context['tran_list'] = Transaction.objects.filter(Q(receiver=target_user) |
-                                                          Q(creator=target_user)).order_by('-create_date')
+        context['tran_list'] = self.get_tran_queryset(target_user)
         context['user'] = User.objects.get(id=self.kwargs.get('pk'))
         return context
 
 
+class StaffUserSummary(LoginRequiredMixin, PermissionRequiredMixin, View):
+    # any user's summary, so a permission only staff hold
+    permission_required = 'app.delete_transaction'
+
+    def get(self, request, pk):
+        user = get_object_or_404(
+            User,
+            pk=pk
+        )
+
+        return render(
+            request,
+            'staff/user_summary.html',
+            {'user': user, 'month_list': summaries.by_month(user)}
+        )
+
+
+class StaffUserTranExport(LoginRequiredMixin, PermissionRequiredMixin, View):
+    # every user's transactions, so a permission only staff hold
+    permission_required = 'app.delete_transaction'
+
+    def get(self, request, pk):
+        user = get_object_or_404(
+            User,
+            pk=pk
+        )
+
+        # both sides separately so each reads through its own index
+        querysets = [Transaction.objects.filter(creator=user),
+                     Transaction.objects.filter(receiver=user).filter(~Q(creator=user))]
+        return export_response(querysets, request.GET.get('format', 'csv'), '%s_transactions' % user.username)
+
+
 class StaffUserTranDetail(LoginRequiredMixin, View, PermissionRequiredMixin):
     permission_required = 'app.view_transaction'
 
@@ -696,15 +780,11 @@ class StaffUserTranDelete(LoginRequiredMixin, View, PermissionRequiredMixin):
 
     def post(self, request, pk, tpk):
         tran = Transaction.objects.get(transaction_id=tpk)
-
-        creator_payment = PaymentMethod.objects.filter(user=tran.creator, method_type='account')
-        creator_account = Account.objects.filter(payment=creator_payment[0])
-        creator_account.update(balance=F('balance') + tran.amount)
-
-        receiver_payment = PaymentMethod.objects.filter(user=tran.receiver, method_type='account')
-        receiver_account = Account.objects.filter(payment=receiver_payment[0])
-        receiver_account.update(balance=F('balance') - tran.amount)
-        tran.delete()
+        try:
+            ledger.reverse_transaction(tran)
+        except TransferError as e:
+            messages.error(request, str(e))
+            return self.get(request, pk, tpk)
         return HttpResponseRedirect(reverse_lazy('staff_user_tran', kwargs={'pk': pk}))
 
 
@@ -717,13 +797,34 @@ class StaffUserPayment(LoginRequiredMixin, ListView, PermissionRequiredMixin):
         context = super().get_context_data(**kwargs)
         user = self.kwargs['pk']
 
-        context['account'] = Account.objects.filter(payment__user=user)
-        context['bank_list'] = Bank.objects.filter(payment__user=user)
-        context['card_list'] = Card.objects.filter(payment__user=user)
+        context.update(wallet.overview(user))
         context['user'] = User.objects.get(id=self.kwargs.get('pk'))
         return context
 
 
+class StaffCacheStats(LoginRequiredMixin, PermissionRequiredMixin, View):
+    permission_required = 'app.delete_transaction'
+
+    def get(self, request):
+        # counters of this process's wallet cache, for monitoring
+        return JsonResponse({'wallet': wallet.stats()})
+
+
+class StaffProfile(LoginRequiredMixin, PermissionRequiredMixin, View):
+    # request timings of this process; the permission is checked, unlike the mixin order elsewhere
+    permission_required = 'app.delete_transaction'
+
+    def get(self, request):
+        report = profiling.report()
+        if request.GET.get('format') == 'json':
+            return JsonResponse(report)
+        return render(request, 'staff/profile.html', {'report': report})
+
+    def post(self, request):
+        profiling.reset()
+        return HttpResponseRedirect(reverse_lazy('staff_profile'))
+
+
 class StaffUserBankDetail(LoginRequiredMixin, View, PermissionRequiredMixin):
     permission_required = ('app.view_bank')
     def get(self, request, pk, bpk):
@@ -765,17 +866,42 @@ class StaffUserCardDetail(LoginRequiredMixin, View, PermissionRequiredMixin):
         )
 
 
-class StaffTransactionList(LoginRequiredMixin, ListView, PermissionRequiredMixin):
+class StaffTransactionList(LoginRequiredMixin, KeysetPageLinksMixin, ListView, PermissionRequiredMixin):
     model = Transaction
     template_name = 'staff/transaction_list.html'
     permission_required = 'app.view_transaction'
+    keyset_per_page = 50
+    keyset_ordering = ('-create_date', '-transaction_id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['tran_list'] = Transaction.objects.all()
+        form = StaffTransactionFilterForm(self.request.GET)
+        if form.is_valid():
+            querysets = form.filter(Transaction.objects.for_listing())
+        else:
+            querysets = [Transaction.objects.none()]
+
+        page = self.paginate_keyset(querysets)
+        context['form'] = form
+        context['tran_list'] = page
+        context['page_links'] = self.page_links(page)
         return context
 
 
+class StaffTransactionExport(LoginRequiredMixin, PermissionRequiredMixin, View):
+    # every user's transactions, so a permission only staff hold
+    permission_required = 'app.delete_transaction'
+
+    def get(self, request):
+        # exports what the transaction list shows with the same filters
+        form = StaffTransactionFilterForm(request.GET)
+        if form.is_valid():
+            querysets = form.filter(Transaction.objects.all())
+        else:
+            querysets = [Transaction.objects.none()]
+        return export_response(querysets, request.GET.get('format', 'csv'), 'transactions')
+
+
 class StaffTranDetail(LoginRequiredMixin, View, PermissionRequiredMixin):
     permission_required = 'app.view_transaction'
 
@@ -804,14 +930,9 @@ class StaffTranDelete(LoginRequiredMixin, DeleteView, PermissionRequiredMixin):
 
     def delete(self, request, *args, **kwargs):
         tran = Transaction.objects.get(transaction_id=kwargs.get('pk'))
-
-        creator_payment = PaymentMethod.objects.filter(user=tran.creator, method_type='account')
-        creator_account = Account.objects.filter(payment=creator_payment[0])
-        creator_account.update(balance=F('balance') + tran.amount)
-
-        receiver_payment = PaymentMethod.objects.filter(user=tran.receiver, method_type='account')
-        receiver_account = Account.objects.filter(payment=receiver_payment[0])
-        receiver_account.update(balance=F('balance') - tran.amount)
-
-        tran.delete()
+        try:
+            ledger.reverse_transaction(tran)
+        except TransferError as e:
+            messages.error(request, str(e))
+            return self.get(request, *args, **kwargs)
         return HttpResponseRedirect(reverse_lazy('staff_transaction'))
@@ -0,0 +1,86 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Account, Bank, Card
+
+# a cached overview only goes stale through writes that bypass the signals, this bounds how long
+WALLET_TIMEOUT = 60 * 15
+HITS_KEY = 'wallet:hits'
+MISSES_KEY = 'wallet:misses'
+
+
+def _version_key(user_id):
+    return 'wallet:version:%s' % user_id
+
+
+def _key(user_id, version):
+    return 'wallet:%s:%s' % (user_id, version)
+
+
+def _version(user_id):
+    # The overview of a user is cached under their current version, which invalidate()
+    # bumps. A lost version starts again from the clock, not from a number an old
+    # overview may still be cached under.
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        cache.add(_version_key(user_id), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # first hit or miss since the cache was cleared
+        cache.add(key, 1, timeout=None)
+
+
+# the wallet account, banks and cards of a user, as the wallet pages render them
+def overview(user):
+    user_id = getattr(user, 'pk', user)
+    # the version is read before the rows, so an overview read before a change commits
+    # is cached under the version that change then retires
+    key = _key(user_id, _version(user_id))
+    wallet = cache.get(key)
+    if wallet is not None:
+        _count(HITS_KEY)
+        return wallet
+
+    _count(MISSES_KEY)
+    wallet = {
+        'account': list(Account.objects.filter(payment__user=user_id)),
+        'bank_list': list(Bank.objects.filter(payment__user=user_id)),
+        'card_list': list(Card.objects.filter(payment__user=user_id)),
+    }
+    cache.set(key, wallet, WALLET_TIMEOUT)
+    return wallet
+
+
+def _bump(user_ids):
+    for user_id in user_ids:
+        try:
+            cache.incr(_version_key(user_id))
+        except ValueError:
+            # no version, so nothing is cached under one; the next overview starts a new one
+            pass
+
+
+# Retire the overviews of the given users once the current transaction commits. Deleting
+# them would not do: a page that read the old rows before the commit could still put
+# them back afterwards, for up to WALLET_TIMEOUT.
+def invalidate(*users):
+    user_ids = [getattr(user, 'pk', user) for user in users if user is not None]
+    transaction.on_commit(lambda: _bump(user_ids))
+
+
+def stats():
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+    }
@@ -0,0 +1,39 @@
+"""
+Benchmarks for the wallet app.
+
+Each module is runnable on its own, e.g. ``python -m benchmarks.transfers``;
+``python -m benchmarks.suite --check`` runs the scripted scenarios and fails
+on a regression against the stored baselines.
+Benchmarks run against a throwaway SQLite database created from the
+migrations, so the project database is never touched.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chiang_pinhuey_final_project.settings.development')
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def scratch_database():
+    # a file database rather than the in-memory default, so that worker threads
+    # each get their own connection to the same data
+    directory = tempfile.mkdtemp(prefix='wallet-bench-')
+    connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    old_name = connection.settings_dict['NAME']
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(directory, ignore_errors=True)
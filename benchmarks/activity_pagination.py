@@ -0,0 +1,89 @@
+"""
+Latency of ``ActivityList`` pages at increasing depth.
+
+Bulk-inserts ``--transactions`` completed transactions for one user, then
+times the first page and pages reached through cursors deep into the
+history, next to the equivalent LIMIT/OFFSET query for comparison.
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import Group, User
+from django.test import Client
+from django.utils.timezone import now
+
+from app.models import Account, PaymentMethod, Transaction
+from app.utils import KeysetPaginator
+from app.views import ActivityList
+
+
+def create_history(count, batch_size=10000):
+    user, other = User.objects.bulk_create([User(username='owner'), User(username='other')])
+    user, other = User.objects.order_by('pk')
+    user.groups.add(Group.objects.get(name='normal_user'))
+    payment = PaymentMethod.objects.create(user=user, method_type='account')
+    PaymentMethod.objects.create(user=other, method_type='account')
+    Account.objects.create(payment=payment)
+
+    rng = random.Random(0)
+    start = now() - timedelta(seconds=count)
+    for offset in range(0, count, batch_size):
+        rows = []
+        for i in range(offset, min(offset + batch_size, count)):
+            mine = rng.random() < 0.5
+            rows.append(Transaction(
+                transaction_type=rng.choice(('send', 'request')), category='Others', amount=1,
+                description='history', is_complete=True, payment_method=payment,
+                create_date=start + timedelta(seconds=i),
+                creator=user if mine else other, receiver=other if mine else user))
+        Transaction.objects.bulk_create(rows)
+    return user
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with scratch_database():
+        start = time.perf_counter()
+        user = create_history(args.transactions)
+        print('inserted %d transactions in %.1fs' % (args.transactions, time.perf_counter() - start))
+
+        client = Client()
+        client.force_login(user)
+        view = ActivityList()
+        querysets = view.get_pay_querysets(user)
+        paginator = KeysetPaginator(querysets, view.keyset_per_page, view.keyset_ordering)
+        history = Transaction.objects.filter(creator=user, transaction_type='send').order_by(
+            '-create_date', '-transaction_id')
+        size = history.count()
+
+        print('%8s %14s %14s' % ('depth', 'keyset (ms)', 'offset (ms)'))
+        for depth in (0, 0.01, 0.1, 0.5, 0.99):
+            position = int(size * depth)
+            params = {}
+            if position:
+                params['pay'] = paginator.encode_cursor(paginator.next_page, history[position - 1])
+            keyset = timed(lambda: client.get('/activity/', params), args.repeat)
+            offset = timed(lambda: list(history[position:position + view.keyset_per_page]), args.repeat)
+            print('%7d%% %14.2f %14.2f' % (depth * 100, keyset, offset))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Requests/second of the JSON API against the HTML pages doing the same work.
+
+Runs each pair of equivalent requests ``--requests`` times through the test
+client, then makes ``--payouts`` sends one HTML form post at a time and as a
+single call to the bulk payouts endpoint.
+"""
+import argparse
+import json
+import time
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import Group, User
+from django.test import Client
+
+from app.models import Account, PaymentMethod, Transaction
+
+
+def create_user(username, balance=0):
+    user = User.objects.create_user(username, password='password')
+    user.groups.add(Group.objects.get(name='normal_user'))
+    payment = PaymentMethod.objects.create(user=user, method_type='account')
+    Account.objects.create(payment=payment, balance=balance)
+    return user, payment
+
+
+def rate(count, request):
+    start = time.perf_counter()
+    for i in range(count):
+        response = request(i)
+        assert response.status_code in (200, 201, 302), response.content[:500]
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--payouts', type=int, default=500)
+    args = parser.parse_args()
+
+    with scratch_database():
+        owner, payment = create_user('owner', balance=10 ** 9)
+        receivers = [create_user('receiver%d' % i)[0] for i in range(50)]
+        Transaction.objects.bulk_create(
+            Transaction(transaction_type='send', category='Others', amount=1, description='row', is_complete=True,
+                        creator=owner, receiver=receivers[i % 50]) for i in range(200))
+        client = Client()
+        client.force_login(owner)
+
+        def post_json(url, data):
+            return client.post(url, json.dumps(data), content_type='application/json')
+
+        def send_form(i):
+            return client.post('/send/%d/' % receivers[i % 50].pk, {
+                'category': 'Others', 'amount': '1.00', 'payment_method': payment.pk, 'description': 'bench'})
+
+        def send_json(i):
+            return post_json('/api/send/', {'receiver': receivers[i % 50].username, 'category': 'Others',
+                                            'amount': '1.00', 'payment_method': payment.pk, 'description': 'bench'})
+
+        pairs = (
+            ('balance', lambda i: client.get('/wallet/'), lambda i: client.get('/api/balance/')),
+            ('activity', lambda i: client.get('/activity/'), lambda i: client.get('/api/activity/')),
+            ('send', send_form, send_json),
+        )
+        print('%-10s %12s %12s' % ('', 'HTML req/s', 'JSON req/s'))
+        for name, html, api in pairs:
+            print('%-10s %12.0f %12.0f' % (name, rate(args.requests, html), rate(args.requests, api)))
+
+        start = time.perf_counter()
+        rate(args.payouts, send_form)
+        one_by_one = time.perf_counter() - start
+
+        payouts = [{'receiver': receivers[i % 50].username, 'category': 'Others', 'amount': '1.00',
+                    'description': 'payout'} for i in range(args.payouts)]
+        start = time.perf_counter()
+        response = post_json('/api/payouts/', {'payment_method': payment.pk, 'payouts': payouts})
+        bulk = time.perf_counter() - start
+        assert response.status_code == 201, response.content[:500]
+
+        print('%d payouts as HTML form posts: %.2fs' % (args.payouts, one_by_one))
+        print('%d payouts in one API call:    %.2fs' % (args.payouts, bulk))
+
+
+if __name__ == '__main__':
+    main()
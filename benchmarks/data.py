@@ -0,0 +1,121 @@
+"""
+Synthetic wallet data for the benchmarks.
+
+``generate()`` bulk-inserts users in the normal user group, each with a
+profile, a wallet account, a bank and a card, a few staff users, and
+transactions between random users over the past year. It then opens the
+ledger for the seeded balances and rebuilds the derived tables (spending
+summaries, counterparties, user search), so every page works on the data as
+it would on real data. The same seed always generates the same data.
+"""
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.utils.timezone import now
+
+from app import counterparties, search, summaries
+from app.models import Account, Bank, Card, Categories, LedgerEntry, PaymentMethod, Profile, Transaction
+
+PASSWORD = 'password'
+STAFF_USERS = 3
+FIRST_NAMES = ('anna', 'bruno', 'chen', 'daniel', 'elena', 'farid', 'grace', 'hiro', 'ines', 'jamal',
+               'kate', 'li', 'maria', 'nikolai', 'olga', 'pinhuey', 'quinn', 'rosa', 'sven', 'tomas')
+LAST_NAMES = ('smith', 'garcia', 'chiang', 'nguyen', 'mueller', 'rossi', 'kim', 'novak', 'silva', 'tanaka')
+
+
+class Dataset:
+    def __init__(self, users, staff, wallets):
+        # users[i] is the id of 'user<i>' and staff[i] of 'staff<i>'; wallets maps user
+        # ids to the payment method ids of their wallet accounts
+        self.users = users
+        self.staff = staff
+        self.wallets = wallets
+
+
+def _create_users(rng, count):
+    # hashing is slow on purpose, so every user shares one hash of PASSWORD
+    password = make_password(PASSWORD)
+    users = []
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        users.append(User(username='user%d' % i, password=password, first_name=first.title(),
+                          last_name=last.title(), email='%s.%s%d@example.com' % (first, last, i)))
+    users += [User(username='staff%d' % i, password=password, is_staff=True) for i in range(STAFF_USERS)]
+    User.objects.bulk_create(users)
+
+    ids = dict(User.objects.values_list('username', 'pk'))
+    user_ids = [ids['user%d' % i] for i in range(count)]
+    staff_ids = [ids['staff%d' % i] for i in range(STAFF_USERS)]
+    membership = User.groups.through
+    normal, staff = Group.objects.get(name='normal_user'), Group.objects.get(name='staff')
+    membership.objects.bulk_create([membership(user_id=pk, group=normal) for pk in user_ids]
+                                   + [membership(user_id=pk, group=staff) for pk in staff_ids])
+    return user_ids, staff_ids
+
+
+def _create_payment_methods(rng, user_ids):
+    Profile.objects.bulk_create(
+        (Profile(user_id=pk, birthday=date(1960, 1, 1) + timedelta(days=rng.randrange(15000)),
+                 address='%d Main Street' % rng.randrange(1, 1000)) for pk in user_ids))
+    PaymentMethod.objects.bulk_create(
+        (PaymentMethod(user_id=pk, method_type=method_type) for pk in user_ids
+         for method_type in ('account', 'bank', 'card')))
+
+    methods = {(user_id, method_type): pk for pk, user_id, method_type in PaymentMethod.objects.filter(
+        user__in=user_ids).values_list('pk', 'user_id', 'method_type').iterator()}
+    Account.objects.bulk_create(
+        (Account(payment_id=methods[(pk, 'account')], balance=Decimal(rng.randrange(10000, 1000000)).scaleb(-2))
+         for pk in user_ids))
+    Bank.objects.bulk_create(
+        (Bank(payment_id=methods[(pk, 'bank')], owner_first_name='Owner', owner_last_name=str(pk),
+              routing_number='%09d' % (i % 10 ** 9), account_number='%010d' % i)
+         for i, pk in enumerate(user_ids)))
+    Card.objects.bulk_create(
+        (Card(payment_id=methods[(pk, 'card')], card_type=('Credit', 'Debit')[i % 2], card_number='%016d' % i,
+              owner_first_name='Owner', owner_last_name=str(pk), security_code='%03d' % (i % 1000),
+              expiration_date=date(2030, 1, 1))
+         for i, pk in enumerate(user_ids)))
+    return {user_id: pk for (user_id, method_type), pk in methods.items() if method_type == 'account'}
+
+
+def _create_transactions(rng, user_ids, count, batch_size):
+    categories = [category for category, _ in Categories]
+    start = now() - timedelta(days=365)
+    for offset in range(0, count, batch_size):
+        rows = []
+        for _ in range(offset, min(offset + batch_size, count)):
+            creator, receiver = rng.sample(user_ids, 2)
+            transaction_type = rng.choice(('send', 'send', 'request'))
+            rows.append(Transaction(
+                transaction_type=transaction_type, category=rng.choice(categories),
+                amount=Decimal(rng.randrange(100, 20000)).scaleb(-2), description='generated',
+                is_complete=transaction_type == 'send' or rng.random() < 0.7,
+                create_date=start + timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                creator_id=creator, receiver_id=receiver))
+        Transaction.objects.bulk_create(rows)
+
+
+def _open_ledger():
+    # the seeded balances enter the app through opening entries, as in migration 0011
+    entries = []
+    for payment_id, balance in Account.objects.exclude(balance=0).values_list('payment_id', 'balance').iterator():
+        entries.append(LedgerEntry(payment_id=payment_id, kind='opening', amount=balance))
+        entries.append(LedgerEntry(payment_id=None, kind='opening', amount=-balance))
+    LedgerEntry.objects.bulk_create(entries)
+
+
+def generate(users=1000, transactions=20000, seed=0, batch_size=5000):
+    rng = random.Random(seed)
+    with transaction.atomic():
+        user_ids, staff_ids = _create_users(rng, users)
+        wallets = _create_payment_methods(rng, user_ids)
+        _create_transactions(rng, user_ids, transactions, batch_size)
+        _open_ledger()
+    summaries.rebuild()
+    counterparties.rebuild()
+    search.rebuild()
+    return Dataset(user_ids, staff_ids, wallets)
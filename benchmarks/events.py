@@ -0,0 +1,139 @@
+"""
+Concurrent subscribers of the event stream (api/events/) one process holds.
+
+Seeds ``--subscribers`` users, serves the app from a threaded WSGI server in
+this process and opens one stream per user over a real socket. Then publishes
+``--rounds`` balance events to every user and reports how long the last
+subscriber waited for each round, with the memory and threads the streams
+take. ``--backend sqlite`` carries the events through app.events.SQLiteBackend
+instead of the in-process LocalBackend.
+"""
+import argparse
+import os
+import selectors
+import socket
+import tempfile
+import threading
+import time
+
+from benchmarks import scratch_database
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+
+from app import events, seeding
+
+
+class Server(ThreadedWSGIServer):
+    # room for every subscriber connecting at once
+    request_queue_size = 4096
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def session_cookies(user_ids):
+    cookies = []
+    for user in User.objects.filter(pk__in=user_ids).order_by('pk'):
+        client = Client()
+        client.force_login(user)
+        cookies.append((user.pk, client.cookies[settings.SESSION_COOKIE_NAME].value))
+    return cookies
+
+
+def connect(port, cookie):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(('GET /api/events/ HTTP/1.1\r\nHost: testserver\r\nAccept: text/event-stream\r\n'
+                  'Cookie: %s=%s\r\n\r\n' % (settings.SESSION_COOKIE_NAME, cookie)).encode())
+    sock.setblocking(False)
+    return sock
+
+
+def wait_for(selector, pending, marker, timeout):
+    # read every socket in pending until it has sent marker; returns when each did
+    buffers = {sock: b'' for sock in pending}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for key, _ in selector.select(0.5):
+            sock = key.fileobj
+            if sock not in pending:
+                sock.recv(65536)
+                continue
+            data = sock.recv(65536)
+            if not data:
+                raise SystemExit('a stream was closed by the server')
+            buffers[sock] += data
+            if marker in buffers[sock]:
+                pending.discard(sock)
+                buffers[sock] = b''
+    if pending:
+        raise SystemExit('%d subscribers did not receive %r' % (len(pending), marker))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscribers', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--backend', choices=('local', 'sqlite'), default='local')
+    args = parser.parse_args()
+
+    with scratch_database():
+        if args.backend == 'sqlite':
+            events._backend = events.SQLiteBackend(os.path.join(tempfile.mkdtemp(), 'events.sqlite3'),
+                                                   poll_interval=0.05)
+        user_ids = seeding.seed(args.subscribers, 0, rebuild=False).user_ids
+        cookies = session_cookies(user_ids)
+
+        server = Server(('127.0.0.1', 0), QuietHandler)
+        server.set_app(get_wsgi_application())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+
+        memory, threads = rss_kb(), threading.active_count()
+        start = time.perf_counter()
+        selector = selectors.DefaultSelector()
+        sockets = {}
+        for user_id, cookie in cookies:
+            sockets[user_id] = connect(port, cookie)
+            selector.register(sockets[user_id], selectors.EVENT_READ)
+        # connected once the current balance came back
+        wait_for(selector, set(sockets.values()), b'event: balance', 120)
+        connected = time.perf_counter() - start
+        assert events.backend().subscriber_count() == args.subscribers
+        print('%d subscribers connected in %.2fs' % (args.subscribers, connected))
+        print('memory: %.0f KB per subscriber, %d threads' % (
+            (rss_kb() - memory) / args.subscribers, threading.active_count() - threads))
+
+        latencies = []
+        for i in range(args.rounds):
+            marker = ('"round": %d' % i).encode()
+            start = time.perf_counter()
+            for user_id in sockets:
+                events.publish(events.user_channel(user_id), 'balance', {'round': i})
+            published = time.perf_counter() - start
+            wait_for(selector, set(sockets.values()), marker, 60)
+            latencies.append(time.perf_counter() - start)
+            print('round %d: published %d events in %.1f ms, all delivered after %.1f ms' % (
+                i, args.subscribers, published * 1000, latencies[-1] * 1000))
+        print('events/second delivered: %.0f' % (args.subscribers * args.rounds / sum(latencies)))
+
+        for sock in sockets.values():
+            sock.close()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Throughput and memory of the streaming transaction export.
+
+Bulk-inserts ``--transactions`` rows, then streams the staff export in each
+format and reports rows/second and the peak resident set size. The peak
+should stay flat as ``--transactions`` grows.
+"""
+import argparse
+import resource
+import time
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import Group, User
+from django.test import Client
+
+from app.models import Transaction
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def create_transactions(count, batch_size=10000):
+    alice, bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+    for offset in range(0, count, batch_size):
+        Transaction.objects.bulk_create(
+            Transaction(transaction_type='send', category='Others', amount=i % 500, description='export row',
+                        is_complete=True, creator=alice if i % 2 else bob, receiver=bob if i % 2 else alice)
+            for i in range(offset, min(offset + batch_size, count)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with scratch_database():
+        create_transactions(args.transactions)
+        staff = User.objects.create_user('staff', is_staff=True)
+        staff.groups.add(Group.objects.get(name='staff'))
+        client = Client()
+        client.force_login(staff)
+        print('peak RSS after inserting: %.1f MB' % peak_rss_mb())
+
+        for export_format in ('csv', 'ndjson'):
+            start = time.perf_counter()
+            response = client.get('/staff/transaction/export/', {'format': export_format})
+            lines = size = 0
+            for chunk in response.streaming_content:
+                lines += chunk.count(b'\n')
+                size += len(chunk)
+            elapsed = time.perf_counter() - start
+            rows = lines - 1 if export_format == 'csv' else lines
+            print('%-7s %d rows, %.1f MB in %.2fs: %.0f rows/second, peak RSS %.1f MB' % (
+                export_format, rows, size / 2 ** 20, elapsed, rows / elapsed, peak_rss_mb()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Stress test of idempotency keys: the same request replayed concurrently.
+
+For each money-moving endpoint, ``--clients`` threads, each with its own
+database connection, post the same request with the same idempotency key at
+the same moment, ``--rounds`` times. Clients answered 409 (the first request is
+still running) ask again. Every round must debit the payer exactly once, and
+every client must get the first response back. Reports the time a
+round takes and exits non-zero if any round does not hold.
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.test import Client
+
+from app.models import Account, PaymentMethod, Transaction
+
+
+def create_user(username, balance=0):
+    user = User.objects.create_user(username, password='password')
+    user.groups.add(Group.objects.get(name='normal_user'))
+    payment = PaymentMethod.objects.create(user=user, method_type='account')
+    Account.objects.create(payment=payment, balance=balance)
+    return user, payment
+
+
+def balance(payment):
+    return Account.objects.get(payment=payment).balance
+
+
+def answered(request):
+    # a client told that the first request is still running asks again, as a real one would
+    while True:
+        response = request()
+        if response.status_code != 409:
+            return response
+        time.sleep(0.02)
+
+
+def concurrently(count, request):
+    barrier = threading.Barrier(count)
+    responses = [None] * count
+
+    def client(i):
+        try:
+            barrier.wait()
+            responses[i] = answered(request)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    # every 409 would be logged as a warning
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+
+    with scratch_database():
+        payer, payment = create_user('payer', balance=10 ** 6)
+        payee, payee_payment = create_user('payee')
+        amount = Decimal('1.25')
+
+        def logged_in():
+            client = Client()
+            client.force_login(payer)
+            return client
+
+        def send_form(key):
+            return logged_in().post('/send/%d/' % payee.pk, {
+                'category': 'Others', 'amount': amount, 'payment_method': payment.pk, 'description': 'retry',
+                'idempotency_key': key})
+
+        def send_json(key):
+            return logged_in().post('/api/send/', json.dumps({
+                'receiver': 'payee', 'category': 'Others', 'amount': str(amount), 'payment_method': payment.pk,
+                'description': 'retry'}), content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+        def money_request():
+            return Transaction.objects.create(transaction_type='request', category='Others', amount=amount,
+                                              description='retry', is_complete=False, creator=payee, receiver=payer)
+
+        def pay_form(key, tran):
+            return logged_in().post('/incomplete/payment/%d/confirm/' % tran.pk, {
+                'payment_method': payment.pk, 'idempotency_key': key})
+
+        def pay_json(key, tran):
+            return logged_in().post('/api/incomplete/%d/pay/' % tran.pk, json.dumps({
+                'payment_method': payment.pk}), content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+        cases = (('send form', send_form, False), ('api send', send_json, False),
+                 ('payment form', pay_form, True), ('api payment', pay_json, True))
+        failed = False
+        print('%-14s %8s %14s' % ('endpoint', 'rounds', 'round (ms)'))
+        for name, post, needs_request in cases:
+            elapsed = 0.0
+            for _ in range(args.rounds):
+                key = uuid.uuid4().hex
+                tran = money_request() if needs_request else None
+                before, sends = balance(payment), Transaction.objects.filter(transaction_type='send').count()
+                start = time.perf_counter()
+                responses = concurrently(args.clients, lambda: post(key, tran) if tran else post(key))
+                elapsed += time.perf_counter() - start
+
+                debited = before - balance(payment)
+                new_sends = Transaction.objects.filter(transaction_type='send').count() - sends
+                statuses = {response.status_code for response in responses}
+                bodies = {(response.content, response.get('Location')) for response in responses}
+                if debited != amount or new_sends != (0 if tran else 1) or len(statuses) != 1 or len(bodies) != 1 \
+                        or statuses & {400, 409, 500}:
+                    failed = True
+                    print('%s: debited %s, %d sends, statuses %s, %d distinct responses' % (
+                        name, debited, new_sends, sorted(statuses), len(bodies)))
+            print('%-14s %8d %14.1f' % (name, args.rounds, elapsed / args.rounds * 1000))
+
+        if balance(payee_payment) != amount * args.rounds * len(cases):
+            failed = True
+            print('the payee received %s' % balance(payee_payment))
+    if failed:
+        sys.exit(1)
+    print('every round debited the payer exactly once')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+The background job queue of app.jobs, as run by ``manage.py run_jobs``.
+
+Makes ``--sends`` transfers between ``--users`` seeded users with
+``ledger.send_money``, which now queues a job to count their counterparties,
+and compares the time per send with what counting them inline cost each send
+(measured on the same transfers and rolled back). Then runs the queued jobs
+one per claim and ``--batch-size`` per claim and reports jobs per second.
+Last, a task that always fails is queued to check retries and dead jobs.
+"""
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from benchmarks import scratch_database
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from app import counterparties, jobs, ledger, seeding
+from app.models import Job, PaymentMethod, Transaction
+
+
+def fail(payloads):
+    raise ValueError('this task always fails')
+
+
+def make_sends(user_ids, count, rng):
+    users = User.objects.in_bulk(user_ids)
+    payments = ledger.wallet_payments(*user_ids)
+    methods = PaymentMethod.objects.in_bulk(payments.values())
+    trans = []
+    start = time.perf_counter()
+    for _ in range(count):
+        creator, receiver = rng.sample(user_ids, 2)
+        trans.append(ledger.send_money(Transaction(
+            creator=users[creator], receiver=users[receiver], payment_method=methods[payments[creator]],
+            category='Others', amount='0.01', description='bench')))
+    return trans, (time.perf_counter() - start) / count
+
+
+def inline_cost(trans):
+    start = time.perf_counter()
+    with transaction.atomic():
+        for tran in trans:
+            counterparties.record(tran)
+        transaction.set_rollback(True)
+    return (time.perf_counter() - start) / len(trans)
+
+
+def run_queue(name, batch_size):
+    result = jobs.run(batch_size=batch_size)
+    assert not result.failures, result.failures[:3]
+    print('%-32s %8d jobs %10.0f jobs/second' % (name, result.done, result.per_second))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--sends', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=jobs.BATCH_SIZE)
+    args = parser.parse_args()
+    # jobs are left to the runs below, not run as each send commits
+    settings.JOBS_EAGER = False
+    rng = random.Random(0)
+
+    with scratch_database():
+        user_ids = seeding.seed(args.users, 0, rebuild=False).user_ids
+        trans, queued = make_sends(user_ids, args.sends, rng)
+        inline = inline_cost(trans)
+        print('send_money(), counterparties queued %8.2f ms' % (queued * 1000))
+        print('counting them inline added        %8.2f ms' % (inline * 1000))
+        run_queue('one job per claim', 1)
+
+        make_sends(user_ids, args.sends, rng)
+        run_queue('%d jobs per claim' % args.batch_size, args.batch_size)
+        assert not Job.objects.exists()
+        shortlisted = counterparties.shortlist(user_ids[0])
+        counterparties.rebuild()
+        assert counterparties.shortlist(user_ids[0]) == shortlisted
+
+        # without the wait between attempts, one run goes through all of them
+        jobs.RETRY_DELAY = timedelta(0)
+        jobs.enqueue(fail)
+        result = jobs.run()
+        assert result.dead == 1 and len(result.failures) == jobs.MAX_ATTEMPTS, result.failures
+        job = Job.objects.get()
+        assert job.status == 'dead' and job.attempts == jobs.MAX_ATTEMPTS and 'always fails' in job.last_error
+        print('a failing job was tried %d times and is now dead' % job.attempts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Replay benchmark for the wallet ledger.
+
+Bulk inserts ``--entries`` ledger entries spread over ``--users`` wallet
+accounts, then times ``manage.py replay_ledger`` rebuilding every balance from
+them, before and after ``manage.py snapshot_balances``.
+"""
+import argparse
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
+from django.utils.timezone import now
+
+from app import ledger
+from app.models import Account, LedgerEntry, PaymentMethod
+
+BATCH_SIZE = 10000
+
+
+def create_accounts(count):
+    User.objects.bulk_create(User(username='bench%d' % i) for i in range(count))
+    users = User.objects.filter(username__startswith='bench')
+    PaymentMethod.objects.bulk_create(PaymentMethod(user=user, method_type='account') for user in users)
+    payments = list(PaymentMethod.objects.filter(user__in=users).values_list('pk', flat=True))
+    Account.objects.bulk_create(Account(payment_id=payment, balance=0) for payment in payments)
+    return payments
+
+
+def post_entries(payments, count, seed=0):
+    # pairs of entries moving cents between two random wallets, old enough to be snapshotted
+    rng = random.Random(seed)
+    balances = dict.fromkeys(payments, 0)
+    create_date = now() - ledger.SNAPSHOT_DELAY - timedelta(minutes=1)
+    batch = []
+    with transaction.atomic():
+        for _ in range(count // 2):
+            payer, payee = rng.sample(payments, 2)
+            cents = rng.randint(1, 50000)
+            amount = Decimal(cents).scaleb(-2)
+            balances[payer] -= cents
+            balances[payee] += cents
+            batch.append(LedgerEntry(payment_id=payer, kind='send', amount=-amount, create_date=create_date))
+            batch.append(LedgerEntry(payment_id=payee, kind='send', amount=amount, create_date=create_date))
+            if len(batch) >= BATCH_SIZE:
+                LedgerEntry.objects.bulk_create(batch)
+                batch = []
+        LedgerEntry.objects.bulk_create(batch)
+        for payment, cents in balances.items():
+            Account.objects.filter(payment_id=payment).update(balance=Decimal(cents).scaleb(-2))
+
+
+def timed(name, *args):
+    start = time.perf_counter()
+    call_command(name, *args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--entries', type=int, default=2000000)
+    args = parser.parse_args()
+
+    with scratch_database():
+        start = time.perf_counter()
+        post_entries(create_accounts(args.users), args.entries)
+        print('inserted %d entries in %.2fs' % (args.entries, time.perf_counter() - start))
+
+        print('replay:           %.2fs' % timed('replay_ledger'))
+        print('snapshot:         %.2fs' % timed('snapshot_balances'))
+        print('replay+snapshots: %.2fs' % timed('replay_ledger', '--snapshots'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Load test of the read-heavy pages behind a WSGI and an ASGI server.
+
+Seeds a scratch database, starts the project in a child process behind the
+chosen server and has ``--concurrency`` client threads request ``--paths`` as
+a logged in user, ``--requests`` times in total. Reports throughput and p50/p99
+latency per path.
+
+    python -m benchmarks.load_test --server wsgi
+    python -m benchmarks.load_test --server asgi   # needs uvicorn installed
+
+``--url`` skips the built-in server and seeding, and loads a server you
+started yourself (e.g. gunicorn or uvicorn against a seeded database); pass
+the session cookie of a logged in user with ``--session``.
+"""
+import argparse
+import http.client
+import multiprocessing
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from benchmarks import scratch_database
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db import connections
+from django.test import Client
+
+from app.models import Account, PaymentMethod, Transaction
+
+DEFAULT_PATHS = ('/activity/', '/incomplete/', '/wallet/', '/api/activity/')
+
+
+def seed(transactions):
+    users = []
+    for i in range(20):
+        user = User.objects.create_user('load%d' % i, password='password')
+        user.groups.add(Group.objects.get(name='normal_user'))
+        payment = PaymentMethod.objects.create(user=user, method_type='account')
+        Account.objects.create(payment=payment, balance=1000)
+        users.append(user)
+    Transaction.objects.bulk_create(
+        Transaction(transaction_type=('send', 'request')[i % 2], category='Others', amount=1, description='load',
+                    is_complete=i % 3 != 0, creator=users[i % 20], receiver=users[(i * 7 + 1) % 20])
+        for i in range(transactions))
+    client = Client()
+    client.force_login(users[0])
+    return client.cookies['sessionid'].value
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(server, port):
+    # the scratch database's test environment only allows the test client's host
+    settings.ALLOWED_HOSTS = ['127.0.0.1']
+    if server == 'asgi':
+        import uvicorn
+        from chiang_pinhuey_final_project.asgi import application
+        uvicorn.run(application, host='127.0.0.1', port=port, log_level='warning')
+    else:
+        from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+        from django.core.wsgi import get_wsgi_application
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        httpd = ThreadedWSGIServer(('127.0.0.1', port), QuietHandler)
+        httpd.set_app(get_wsgi_application())
+        httpd.serve_forever()
+
+
+def wait_for(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('the server did not start listening on port %d' % port)
+
+
+def run_client(url, session, paths, count):
+    # one keep-alive connection per client thread
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    headers = {'Cookie': 'sessionid=%s' % session} if session else {}
+    timings = []
+    for i in range(count):
+        path = paths[i % len(paths)]
+        start = time.perf_counter()
+        try:
+            conn.request('GET', parts.path.rstrip('/') + path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+            timings.append((path, None))
+            continue
+        timings.append((path, time.perf_counter() - start if response.status == 200 else None))
+    conn.close()
+    return timings
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def load(url, session, paths, requests, concurrency):
+    per_client = max(1, requests // concurrency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = pool.map(run_client, [url] * concurrency, [session] * concurrency,
+                           [paths] * concurrency, [per_client] * concurrency)
+        timings = [timing for result in results for timing in result]
+    elapsed = time.perf_counter() - start
+
+    print('%-18s %8s %8s %10s %10s' % ('path', 'ok', 'errors', 'p50 (ms)', 'p99 (ms)'))
+    for path in paths:
+        ok = sorted(t for p, t in timings if p == path and t is not None)
+        errors = sum(1 for p, t in timings if p == path and t is None)
+        if ok:
+            print('%-18s %8d %8d %10.1f %10.1f' % (path, len(ok), errors, percentile(ok, 0.5) * 1000,
+                                                   percentile(ok, 0.99) * 1000))
+        else:
+            print('%-18s %8d %8d %10s %10s' % (path, 0, errors, '-', '-'))
+    print('throughput: %.0f requests/second over %d requests' % (len(timings) / elapsed, len(timings)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--url', help='load an already running server instead')
+    parser.add_argument('--session', help='sessionid cookie to send with --url')
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--transactions', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.url:
+        load(args.url, args.session, args.paths, args.requests, args.concurrency)
+        return
+
+    if args.server == 'asgi':
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            parser.error('--server asgi needs uvicorn (pip install uvicorn)')
+
+    with scratch_database():
+        session = seed(args.transactions)
+        # the child gets its own connections to the scratch database
+        connections.close_all()
+        port = free_port()
+        server = multiprocessing.get_context('fork').Process(target=serve, args=(args.server, port), daemon=True)
+        server.start()
+        try:
+            wait_for('127.0.0.1', port)
+            print('%s server, %d clients' % (args.server.upper(), args.concurrency))
+            load('http://127.0.0.1:%d/' % port, session, args.paths, args.requests, args.concurrency)
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == '__main__':
+    main()
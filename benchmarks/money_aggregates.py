@@ -0,0 +1,78 @@
+"""
+Aggregate queries over money stored as integer cents versus floats.
+
+Bulk-inserts ``--transactions`` rows with random amounts, copies the amounts
+into two temporary tables of the same shape, once as integer cents and once as
+REAL the way they were stored before migration 0012, and times the same
+per-category and per-user SUMs over both. It also reports how far the float
+totals drift from the exact ones.
+"""
+import argparse
+import random
+import time
+from decimal import Decimal
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Sum
+
+from app.models import Categories, Transaction
+
+QUERIES = (
+    ('per category', 'SELECT category, SUM(amount) FROM {table} GROUP BY category'),
+    ('per creator', 'SELECT creator_id, SUM(amount) FROM {table} GROUP BY creator_id'),
+    ('grand total', 'SELECT SUM(amount) FROM {table}'),
+)
+
+
+def create_transactions(count, users=100, batch_size=10000, seed=0):
+    rng = random.Random(seed)
+    User.objects.bulk_create(User(username='bench%d' % i) for i in range(users))
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    categories = [category for category, _ in Categories]
+    for offset in range(0, count, batch_size):
+        Transaction.objects.bulk_create(
+            Transaction(transaction_type='send', category=rng.choice(categories), is_complete=True,
+                        amount=Decimal(rng.randint(1, 100000)).scaleb(-2), description='aggregate row',
+                        creator_id=rng.choice(user_ids), receiver_id=rng.choice(user_ids))
+            for _ in range(offset, min(offset + batch_size, count)))
+
+
+def timed(cursor, sql, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+    return (time.perf_counter() - start) / repeat, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with scratch_database():
+        create_transactions(args.transactions)
+        table = Transaction._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TEMP TABLE cent_amounts AS SELECT category, creator_id, amount FROM %s' % table)
+            cursor.execute('CREATE TEMP TABLE float_amounts AS SELECT category, creator_id, amount / 100.0 AS amount '
+                           'FROM %s' % table)
+            print('%-14s %12s %12s' % ('query', 'cents (ms)', 'float (ms)'))
+            for name, sql in QUERIES:
+                cents, _ = timed(cursor, sql.format(table='cent_amounts'), args.repeat)
+                floats, _ = timed(cursor, sql.format(table='float_amounts'), args.repeat)
+                print('%-14s %12.1f %12.1f' % (name, cents * 1000, floats * 1000))
+
+            cursor.execute('SELECT SUM(amount) FROM float_amounts')
+            float_total = cursor.fetchone()[0]
+        exact = Transaction.objects.aggregate(total=Sum('amount'))['total']
+        print('exact total: %s' % exact)
+        print('float total: %r (off by %.2e)' % (float_total, abs(Decimal(float_total) - exact)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Throughput of ``manage.py send_payouts``.
+
+Writes a CSV of ``--payouts`` rows to ``--receivers`` users, with a few bad
+rows mixed in, and runs the command over it with ``--chunk-size`` payouts per
+database transaction.
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+
+from app.models import Account, LedgerEntry, PaymentMethod
+
+PAYER_BALANCE = 10 ** 6
+BAD_ROWS = (
+    ('nobody', '1.00', 'Others', 'unknown user'),
+    ('bench0', '-', 'Others', 'bad amount'),
+    ('bench1', '1.00', 'Lottery', 'bad category'),
+)
+
+
+def create_users(count):
+    User.objects.bulk_create(User(username='bench%d' % i) for i in range(count + 1))
+    users = User.objects.filter(username__startswith='bench')
+    PaymentMethod.objects.bulk_create(PaymentMethod(user=user, method_type='account') for user in users)
+    Account.objects.bulk_create(Account(payment=payment, balance=0)
+                                for payment in PaymentMethod.objects.filter(user__in=users))
+    # bench0 pays; its balance enters the app through an opening entry, as in migration 0011
+    payer = PaymentMethod.objects.get(user__username='bench0')
+    Account.objects.filter(payment=payer).update(balance=PAYER_BALANCE)
+    LedgerEntry.objects.bulk_create([LedgerEntry(payment=payer, kind='opening', amount=PAYER_BALANCE),
+                                     LedgerEntry(payment=None, kind='opening', amount=-PAYER_BALANCE)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--payouts', type=int, default=10000)
+    parser.add_argument('--receivers', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with scratch_database(), tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as f:
+        create_users(args.receivers)
+        writer = csv.writer(f)
+        writer.writerow(('username', 'amount', 'category', 'description'))
+        for i in range(args.payouts):
+            writer.writerow(('bench%d' % rng.randint(1, args.receivers), '%d.%02d' % (rng.randint(0, 99), rng.randint(1, 99)),
+                             'Others', 'payroll'))
+        writer.writerows(BAD_ROWS)
+        f.close()
+        try:
+            call_command('send_payouts', 'bench0', f.name, chunk_size=args.chunk_size)
+        except CommandError as e:
+            print(e)
+        finally:
+            os.unlink(f.name)
+        call_command('replay_ledger')
+        call_command('check_summaries')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Overhead of the request profiling middleware.
+
+Serves ``--requests`` requests over ``--paths`` through the test client with
+and without ``app.profiling.ProfilingMiddleware``, alternating between the two
+for ``--rounds`` rounds, and reports the best time per request of each and
+the relative overhead. Whole requests vary by more than the overhead on a busy
+machine, so it also times the middleware around a view that does nothing and
+its query timer around ``SELECT 1``, and estimates the overhead from those and
+the number of queries the pages make.
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks import scratch_database
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.http import HttpResponse
+from django.db import connection
+from django.test import Client, RequestFactory, override_settings
+
+from app import profiling
+from app.models import Account, PaymentMethod, Transaction
+
+DEFAULT_PATHS = ('/activity/', '/wallet/', '/incomplete/', '/api/balance/')
+MIDDLEWARE = 'app.profiling.ProfilingMiddleware'
+
+
+def seed(transactions):
+    users = []
+    for i in range(20):
+        user = User.objects.create_user('profile%d' % i, password='password')
+        user.groups.add(Group.objects.get(name='normal_user'))
+        payment = PaymentMethod.objects.create(user=user, method_type='account')
+        Account.objects.create(payment=payment, balance=1000)
+        users.append(user)
+    Transaction.objects.bulk_create(
+        Transaction(transaction_type=('send', 'request')[i % 2], category='Others', amount=1, description='profile',
+                    is_complete=i % 3 != 0, creator=users[i % 20], receiver=users[(i * 7 + 1) % 20])
+        for i in range(transactions))
+    return users[0]
+
+
+def per_request(user, middleware, paths, count):
+    with override_settings(MIDDLEWARE=middleware):
+        client = Client()
+        client.force_login(user)
+        client.get(paths[0])
+        start = time.perf_counter()
+        for i in range(count):
+            response = client.get(paths[i % len(paths)])
+            assert response.status_code == 200, response.status_code
+        return (time.perf_counter() - start) / count
+
+
+def timed_queries(cursor, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        cursor.execute('SELECT 1')
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--transactions', type=int, default=5000)
+    args = parser.parse_args()
+
+    with scratch_database():
+        user = seed(args.transactions)
+        with_profiling = [MIDDLEWARE] + [name for name in settings.MIDDLEWARE if name != MIDDLEWARE]
+        without = [name for name in settings.MIDDLEWARE if name != MIDDLEWARE]
+
+        on, off = [], []
+        for _ in range(args.rounds):
+            off.append(per_request(user, without, args.paths, args.requests))
+            on.append(per_request(user, with_profiling, args.paths, args.requests))
+        on, off = min(on), min(off)
+        print('without profiling: %.3f ms/request' % (off * 1000))
+        print('with profiling:    %.3f ms/request' % (on * 1000))
+        print('overhead:          %+.2f%%' % ((on - off) / off * 100))
+        queries = statistics.mean(view['queries_mean'] for view in profiling.report()['views'])
+
+        # one response for every call, building one costs more than the middleware
+        request, response = RequestFactory().get('/'), HttpResponse('ok')
+        bare = profiling.ProfilingMiddleware(lambda request: response)
+        count = 100000
+        start = time.perf_counter()
+        for _ in range(count):
+            bare(request)
+        middleware = (time.perf_counter() - start) / count
+        print('middleware alone:  %.1f us/request' % (middleware * 10 ** 6))
+
+        with connection.cursor() as cursor:
+            plain = timed_queries(cursor, count // 10)
+            with connection.execute_wrapper(profiling._QueryTimer()):
+                wrapped = timed_queries(cursor, count // 10)
+        per_query = max(wrapped - plain, 0)
+        print('query timer:       %.1f us/query' % (per_query * 10 ** 6))
+
+        estimate = middleware + queries * per_query
+        print('estimated:         %.1f us/request at %.1f queries/request, %.2f%% of %.1f ms' % (
+            estimate * 10 ** 6, queries, estimate / off * 100, off * 1000))
+
+
+if __name__ == '__main__':
+    main()
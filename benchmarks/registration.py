@@ -0,0 +1,90 @@
+"""
+Registration: the previous view code, app.registration.register() and
+register_many().
+
+Registers ``--users`` users through each and reports users per second and
+queries per user. The previous flow saved the user twice, looked the group up
+every time and created the profile and wallet outside a transaction; it is
+kept here for comparison. register_many() runs once with the full password
+hashing cost and once with ``--iterations`` PBKDF2 iterations, the way an
+import would.
+"""
+import argparse
+import time
+from datetime import date
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from app import registration
+from app.form import UserRegistrationForm
+from app.models import Account, PaymentMethod, Profile
+
+
+def data(prefix, i):
+    return {'username': '%s%d' % (prefix, i), 'first_name': 'Bench', 'last_name': 'User',
+            'email': '%s%d@example.com' % (prefix, i), 'password': 'password', 'confirm_password': 'password',
+            'birthday': '1990-01-01', 'address': '1 Main Street'}
+
+
+def previous_register(form):
+    user = form.save()
+    user.set_password(form.cleaned_data['password'])
+    user.save()
+    user.groups.add(Group.objects.get(name='normal_user'))
+    Profile.objects.create(user=user, birthday=form.clean_birthday(), address=form.clean_address())
+    payment = PaymentMethod.objects.create(user=user, method_type='account')
+    Account.objects.create(payment=payment)
+
+
+def new_register(form):
+    registration.register(form.save(commit=False), form.cleaned_data['password'],
+                          form.cleaned_data['birthday'], form.cleaned_data['address'])
+
+
+def one_by_one(name, prefix, count, register):
+    forms = [UserRegistrationForm(data(prefix, i)) for i in range(count)]
+    assert all(form.is_valid() for form in forms)
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        for form in forms:
+            register(form)
+        elapsed = time.perf_counter() - start
+    report(name, count, elapsed, len(queries))
+
+
+def in_bulk(name, prefix, count, iterations):
+    rows = [registration.Registration(i, *[data(prefix, i)[field] for field in registration.CSV_FIELDS])
+            for i in range(count)]
+    with CaptureQueriesContext(connection) as queries:
+        result = registration.register_many(rows, iterations=iterations)
+    assert not result.failures, result.failures[:3]
+    report(name, count, result.elapsed, len(queries))
+
+
+def report(name, count, elapsed, queries):
+    print('%-38s %10.0f %12.1f' % (name, count / elapsed, queries / count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=1000)
+    args = parser.parse_args()
+
+    with scratch_database():
+        print('%-38s %10s %12s' % ('', 'users/s', 'queries/user'))
+        one_by_one('previous view code', 'previous', args.users, previous_register)
+        one_by_one('register()', 'single', args.users, new_register)
+        in_bulk('register_many()', 'bulk', args.users, None)
+        in_bulk('register_many(), %d iterations' % args.iterations, 'fast', args.users, args.iterations)
+        # the birthday and the wallet came out the same for every flow
+        assert Account.objects.count() == User.objects.count() == 4 * args.users
+        assert Profile.objects.filter(birthday=date(1990, 1, 1)).count() == 4 * args.users
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Scripted user journeys for ``benchmarks.suite``.
+
+A scenario is set up once with the generated dataset and returns a function
+that performs one operation, given the operation's number. Operations go
+through Django's test client like a browser would and fail loudly on an
+unexpected response.
+"""
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+from django.test import Client
+
+from app.models import Transaction
+
+from benchmarks.data import PASSWORD
+
+
+def logged_in(user_id):
+    client = Client()
+    client.force_login(User.objects.get(pk=user_id))
+    return client
+
+
+def expect(response, status, what):
+    if response.status_code != status:
+        raise AssertionError('%s: expected %d, got %d' % (what, status, response.status_code))
+    return response
+
+
+def login(data):
+    def op(i):
+        client = Client()
+        expect(client.post('/login/', {'username': 'user%d' % (i % len(data.users)), 'password': PASSWORD}),
+               302, 'login')
+    return op
+
+
+def view_activity(data):
+    clients = [logged_in(user_id) for user_id in data.users[:20]]
+
+    def op(i):
+        client = clients[i % len(clients)]
+        expect(client.get('/activity/'), 200, 'activity')
+        expect(client.get('/wallet/'), 200, 'wallet')
+    return op
+
+
+def send_money(data):
+    senders = data.users[:20]
+    clients = [logged_in(user_id) for user_id in senders]
+
+    def op(i):
+        sender = senders[i % len(senders)]
+        receiver = data.users[20 + i % (len(data.users) - 20)]
+        expect(clients[i % len(senders)].post('/send/%d/' % receiver, {
+            'category': 'Others', 'amount': '1.00', 'payment_method': data.wallets[sender],
+            'description': 'benchmark'}), 302, 'send')
+    return op
+
+
+def request_and_pay(data):
+    # one user asks another for money, who then pays the request from their wallet
+    pairs = [(data.users[k], data.users[k + 1]) for k in range(0, 20, 2)]
+    clients = {user_id: logged_in(user_id) for pair in pairs for user_id in pair}
+
+    def op(i):
+        creator, payer = pairs[i % len(pairs)]
+        expect(clients[creator].post('/request/%d/' % payer, {
+            'category': 'Food', 'amount': '2.50', 'description': 'benchmark'}), 302, 'request')
+        tran = Transaction.objects.filter(creator=creator, receiver=payer, is_complete=False).latest('pk')
+        expect(clients[payer].post('/incomplete/payment/%d/confirm/' % tran.pk, {
+            'payment_method': data.wallets[payer]}), 302, 'pay')
+    return op
+
+
+def staff_browsing(data):
+    client = logged_in(data.staff[0])
+    pages = ['/staff/transaction/', '/staff/transaction/?category=Food', '/staff/user/']
+    pages += ['/staff/user/%d/transactions/' % user_id for user_id in data.users[:5]]
+
+    def op(i):
+        expect(client.get(pages[i % len(pages)]), 200, 'staff page')
+    return op
+
+
+# name: (setup, operations per run); hashing the password makes logins slow by design
+SCENARIOS = OrderedDict((
+    ('login', (login, 20)),
+    ('view activity', (view_activity, 200)),
+    ('send money', (send_money, 200)),
+    ('request and pay', (request_and_pay, 100)),
+    ('staff browsing', (staff_browsing, 160)),
+))
@@ -0,0 +1,66 @@
+"""
+Throughput of ``app.scheduler.run_due``, the run of ``manage.py run_schedules``.
+
+Seeds ``--users`` users with app.seeding, gives them ``--schedules`` monthly
+payments that are all due, and makes them in one run with ``--batch-size``
+schedules per database transaction. ``--bad`` of the schedules pay from a
+payment method that is not their user's, so their batches fall back to one
+payment at a time. Then checks that every due schedule was paid or failed,
+and that the ledger and spending summaries still add up.
+"""
+import argparse
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks import scratch_database
+
+from django.core.management import call_command
+from django.utils.timezone import now
+
+from app import scheduler, seeding
+from app.ledger import wallet_payments
+from app.models import ScheduledPayment, Transaction
+
+
+def create_schedules(user_ids, count, bad):
+    wallets = wallet_payments(*user_ids)
+    start = now() - timedelta(days=40)
+    schedules = []
+    for i in range(count):
+        user, receiver = user_ids[i % len(user_ids)], user_ids[(i + 1) % len(user_ids)]
+        # a bad schedule pays from its receiver's wallet
+        payment = wallets[receiver if i < bad else user]
+        schedules.append(ScheduledPayment(user_id=user, receiver_id=receiver, payment_method_id=payment,
+                                          category='Housing', amount=Decimal('0.01'), description='rent',
+                                          interval='monthly', start_at=start, next_run_at=start))
+    ScheduledPayment.objects.bulk_create(schedules)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--schedules', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=scheduler.BATCH_SIZE)
+    parser.add_argument('--bad', type=int, default=10)
+    parser.add_argument('--max-seconds', type=float)
+    args = parser.parse_args()
+
+    with scratch_database():
+        users = seeding.seed(args.users, 0, rebuild=False).user_ids
+        create_schedules(users, args.schedules, args.bad)
+
+        result = scheduler.run_due(batch_size=args.batch_size, max_seconds=args.max_seconds)
+        print('made %d scheduled payments in %.2fs (%.0f payments/second), %d failed' % (
+            result.sent, result.elapsed, result.per_second, len(result.failures)))
+
+        left = scheduler.due().count()
+        print('%d schedules still due' % left)
+        if args.max_seconds is None:
+            assert result.sent + len(result.failures) == args.schedules and not left
+        assert Transaction.objects.count() == result.sent
+        call_command('replay_ledger')
+        call_command('check_summaries')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+The wallet benchmark suite: scripted scenarios against generated data.
+
+Generates ``--users`` users and ``--transactions`` transactions with
+``benchmarks.data`` in a scratch database, runs every scenario of
+``benchmarks.scenarios`` (or those named with ``--scenario``) and reports
+operations/second, latency percentiles and queries per operation.
+
+    python -m benchmarks.suite                 # report
+    python -m benchmarks.suite --save          # store the results as baselines
+    python -m benchmarks.suite --check         # fail on a regression
+
+``--check`` compares with the stored baselines and exits non-zero when a
+scenario makes more queries per operation than its baseline, or its
+throughput or p95 latency is more than ``--threshold`` worse. Timings depend
+on the machine, so record baselines on the machine that checks them.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from benchmarks import scratch_database
+
+from django.db import connection
+
+from app.profiling import _QueryTimer
+
+from benchmarks.data import generate
+from benchmarks.scenarios import SCENARIOS
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+WARMUP = 5
+# query counts are exact, give or take a cache that happens to be cold
+QUERY_SLACK = 0.5
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(setup, data, count):
+    op = setup(data)
+    for i in range(WARMUP):
+        op(i)
+    timings, timer = [], _QueryTimer()
+    with connection.execute_wrapper(timer):
+        start = time.perf_counter()
+        for i in range(WARMUP, WARMUP + count):
+            op_start = time.perf_counter()
+            op(i)
+            timings.append(time.perf_counter() - op_start)
+        elapsed = time.perf_counter() - start
+    timings.sort()
+    return {
+        'ops_per_sec': round(count / elapsed, 1),
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+        'queries_per_op': round(timer.count / count, 2),
+    }
+
+
+def regressions(name, result, baseline, threshold):
+    problems = []
+    if result['queries_per_op'] > baseline['queries_per_op'] + QUERY_SLACK:
+        problems.append('%s: %.2f queries/op, baseline %.2f' % (
+            name, result['queries_per_op'], baseline['queries_per_op']))
+    if result['ops_per_sec'] < baseline['ops_per_sec'] * (1 - threshold):
+        problems.append('%s: %.1f ops/s, baseline %.1f' % (name, result['ops_per_sec'], baseline['ops_per_sec']))
+    if result['p95_ms'] > baseline['p95_ms'] * (1 + threshold):
+        problems.append('%s: p95 %.2f ms, baseline %.2f' % (name, result['p95_ms'], baseline['p95_ms']))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), dest='scenarios')
+    parser.add_argument('--ops', type=float, default=1.0, help='scale the operations of every scenario')
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--save', action='store_true', help='store the results as the baselines')
+    parser.add_argument('--check', action='store_true', help='fail if a scenario regressed')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown for --check, as a fraction (default 0.25)')
+    args = parser.parse_args()
+
+    config = {'users': args.users, 'transactions': args.transactions, 'seed': args.seed}
+    baselines = None
+    if args.check:
+        try:
+            with open(args.baselines) as f:
+                baselines = json.load(f)
+        except FileNotFoundError:
+            parser.error('no baselines at %s, record them with --save' % args.baselines)
+        if baselines['config'] != config:
+            parser.error('the baselines were recorded with %s' % baselines['config'])
+
+    results = {}
+    with scratch_database():
+        start = time.perf_counter()
+        data = generate(args.users, args.transactions, args.seed)
+        print('generated %d users and %d transactions in %.1fs' % (
+            args.users, args.transactions, time.perf_counter() - start))
+
+        print('%-18s %10s %10s %10s %10s %12s' % ('scenario', 'ops/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+                                                 'queries/op'))
+        for name in args.scenarios or SCENARIOS:
+            setup, count = SCENARIOS[name]
+            result = results[name] = run(setup, data, max(1, int(count * args.ops)))
+            print('%-18s %10.1f %10.2f %10.2f %10.2f %12.2f' % (
+                name, result['ops_per_sec'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['queries_per_op']))
+
+    if args.save:
+        stored = {'config': config, 'scenarios': {}}
+        if os.path.exists(args.baselines):
+            with open(args.baselines) as f:
+                stored = json.load(f)
+            if stored['config'] != config:
+                stored = {'config': config, 'scenarios': {}}
+        stored['scenarios'].update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('saved the baselines to %s' % args.baselines)
+
+    if baselines is not None:
+        problems = []
+        for name, result in results.items():
+            if name in baselines['scenarios']:
+                problems += regressions(name, result, baselines['scenarios'][name], args.threshold)
+            else:
+                print('%s has no baseline' % name)
+        if problems:
+            print('\n'.join(['regressions:'] + problems))
+            sys.exit(1)
+        print('no regressions beyond %d%%' % (args.threshold * 100))
+
+
+if __name__ == '__main__':
+    main()
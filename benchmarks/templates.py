@@ -0,0 +1,91 @@
+"""
+Rendering time of each page template under three template configurations.
+
+Requests every page once as a user (and the staff pages as a staff user) to
+capture the template and context it renders, then renders each template again
+``--repeat`` times:
+
+* uncached - the previous development configuration: templates are found,
+  read and compiled on every render, through ``DIRS`` and then ``APP_DIRS``
+* cached loader - production.py: compiled once, fragments rendered every time
+* cached + fragments - production.py with the ``{% cache %}`` fragments of
+  the base templates and tab bars warm
+"""
+import argparse
+import os
+import time
+
+from benchmarks import scratch_database
+from benchmarks.data import generate
+from benchmarks.scenarios import logged_in
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.template import RequestContext
+from django.template.backends.django import DjangoTemplates
+from django.urls import reverse
+
+USER_PAGES = ('index', 'activity', 'spending_summary', 'send', 'request', 'incomplete', 'account', 'bank', 'card',
+              'profile')
+STAFF_PAGES = ('staff_user', 'staff_transaction')
+
+
+def engine(cached):
+    options = dict(settings.TEMPLATES[0]['OPTIONS'], debug=False)
+    if cached:
+        options['loaders'] = [('django.template.loaders.cached.Loader',
+                               ['django.template.loaders.app_directories.Loader'])]
+        config = {'DIRS': [], 'APP_DIRS': False}
+    else:
+        # what DEBUG = True used: DIRS and APP_DIRS through loaders that cache nothing
+        options['loaders'] = ['django.template.loaders.filesystem.Loader',
+                              'django.template.loaders.app_directories.Loader']
+        config = {'DIRS': [os.path.join(apps.get_app_config('app').path, 'templates')], 'APP_DIRS': False}
+    return DjangoTemplates(dict(config, NAME='bench', OPTIONS=options)).engine
+
+
+def capture(client, names):
+    # (template name, request, context) of every page
+    pages = []
+    for name in names:
+        response = client.get(reverse(name))
+        assert response.status_code == 200, (name, response.status_code)
+        context = response.context[0] if isinstance(response.context, list) else response.context
+        pages.append((response.templates[0].name, response.wsgi_request, context.flatten()))
+    return pages
+
+
+def timed(engine, page, repeat, fragments):
+    name, request, context = page
+    engine.get_template(name).render(RequestContext(request, context))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        if not fragments:
+            cache.clear()
+        engine.get_template(name).render(RequestContext(request, context))
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with scratch_database():
+        data = generate(users=20, transactions=500)
+        pages = capture(logged_in(data.users[0]), USER_PAGES) + capture(logged_in(data.staff[0]), STAFF_PAGES)
+
+        uncached, cached = engine(False), engine(True)
+        print('%-36s %12s %14s %14s' % ('template (ms)', 'uncached', 'cached loader', '+ fragments'))
+        totals = [0.0, 0.0, 0.0]
+        for page in pages:
+            timings = [timed(uncached, page, args.repeat, False), timed(cached, page, args.repeat, False),
+                       timed(cached, page, args.repeat, True)]
+            totals = [total + timing for total, timing in zip(totals, timings)]
+            print('%-36s %12.3f %14.3f %14.3f' % ((page[0],) + tuple(timing * 1000 for timing in timings)))
+        print('%-36s %12.3f %14.3f %14.3f' % (('total',) + tuple(total * 1000 for total in totals)))
+
+
+if __name__ == '__main__':
+    main()
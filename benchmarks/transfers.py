@@ -0,0 +1,94 @@
+"""
+Concurrency benchmark for ``app.ledger.send_money``.
+
+Fires ``--transfers`` random sends between a pool of ``--users`` users from
+``--workers`` threads, then checks that the total wallet balance is conserved.
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Sum
+
+from app import ledger
+from app.models import Account, LedgerEntry, PaymentMethod, Transaction
+
+OPENING_BALANCE = Decimal('1000.00')
+
+
+def create_users(count):
+    User.objects.bulk_create(User(username='bench%d' % i) for i in range(count))
+    users = list(User.objects.filter(username__startswith='bench').order_by('pk'))
+    PaymentMethod.objects.bulk_create(PaymentMethod(user=user, method_type='account') for user in users)
+    payments = PaymentMethod.objects.filter(user__in=users).order_by('user_id')
+    Account.objects.bulk_create(Account(payment=payment, balance=OPENING_BALANCE) for payment in payments)
+    # open the ledger the way migration 0011 does for existing accounts
+    LedgerEntry.objects.bulk_create(
+        entry for payment in payments
+        for entry in (LedgerEntry(payment=payment, kind='opening', amount=OPENING_BALANCE),
+                      LedgerEntry(payment=None, kind='opening', amount=-OPENING_BALANCE)))
+    return [(user, payment) for user, payment in zip(users, payments)]
+
+
+def run_worker(pairs, transfers, seed):
+    rng = random.Random(seed)
+    retries = 0
+    try:
+        for _ in range(transfers):
+            (creator, payment), (receiver, _) = rng.sample(pairs, 2)
+            tran = Transaction(creator=creator, receiver=receiver, payment_method=payment,
+                               category='Others', description='benchmark',
+                               amount=Decimal(rng.randint(1, 500)).scaleb(-2))
+            while True:
+                try:
+                    ledger.send_money(tran)
+                    break
+                except OperationalError:
+                    # SQLite gave up waiting for the write lock
+                    retries += 1
+    finally:
+        connection.close()
+    return retries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--transfers', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    with scratch_database():
+        pairs = create_users(args.users)
+        expected = Account.objects.aggregate(total=Sum('balance'))['total']
+        per_worker = args.transfers // args.workers
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.workers) as pool:
+            retries = sum(pool.map(run_worker, [pairs] * args.workers,
+                                   [per_worker] * args.workers, range(args.workers)))
+        elapsed = time.perf_counter() - start
+
+        total = Account.objects.aggregate(total=Sum('balance'))['total']
+        sent = Transaction.objects.count()
+        print('transfers:        %d' % sent)
+        print('workers:          %d' % args.workers)
+        print('lock retries:     %d' % retries)
+        print('elapsed:          %.2fs' % elapsed)
+        print('transfers/second: %.0f' % (sent / elapsed))
+        print('total balance:    %.2f (expected %.2f)' % (total, expected))
+
+        assert sent == per_worker * args.workers, 'lost transfers'
+        assert total == expected, 'balance not conserved'
+        call_command('replay_ledger')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+User search through the FTS5 index versus scanning the user table.
+
+Bulk-inserts ``--users`` users with generated names and emails, rebuilds the
+search index and times ``search_users`` for a set of autocomplete-style
+queries (short and long prefixes, names, several words), once through the
+index and once through the istartswith filters used where there is none.
+"""
+import argparse
+import random
+import time
+
+from benchmarks import scratch_database
+
+from django.contrib.auth.models import User
+
+from app import search
+
+FIRST_NAMES = ('anna', 'bruno', 'chen', 'daniel', 'elena', 'farid', 'grace', 'hiro', 'ines', 'jamal',
+               'kate', 'li', 'maria', 'nikolai', 'olga', 'pinhuey', 'quinn', 'rosa', 'sven', 'tomas')
+LAST_NAMES = ('smith', 'garcia', 'chiang', 'nguyen', 'mueller', 'rossi', 'kim', 'novak', 'silva', 'tanaka',
+              'okafor', 'jensen', 'dubois', 'haddad', 'kowalski', 'lopez', 'ivanova', 'wang', 'brown', 'ali')
+DOMAINS = ('example.com', 'mail.test', 'wallet.test')
+QUERIES = ('an', 'chi', 'gillian', 'maria', 'maria sm', 'kowal', 'user12', 'user123456', 'wallet', 'zzz')
+
+
+def create_users(count, batch_size=10000, seed=0):
+    rng = random.Random(seed)
+    for offset in range(0, count, batch_size):
+        users = []
+        for i in range(offset, min(offset + batch_size, count)):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            users.append(User(username='user%d' % i, first_name=first.title(), last_name=last.title(),
+                              email='%s.%s%d@%s' % (first, last, i, rng.choice(DOMAINS))))
+        User.objects.bulk_create(users)
+    User.objects.create(username='gillian', first_name='Gillian', last_name='Chiang', email='gillian@example.com')
+
+
+def timed(query, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = search.search_users(query)
+    return (time.perf_counter() - start) / repeat, len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-scan', action='store_true', help='only time the index')
+    args = parser.parse_args()
+
+    with scratch_database():
+        if not search.has_index():
+            parser.error('this SQLite build has no FTS5')
+        start = time.perf_counter()
+        create_users(args.users)
+        print('inserted %d users in %.1fs' % (args.users, time.perf_counter() - start))
+        start = time.perf_counter()
+        search.rebuild()
+        print('rebuilt the index in %.1fs' % (time.perf_counter() - start))
+
+        print('%-14s %8s %12s %12s' % ('query', 'results', 'index (ms)', 'scan (ms)'))
+        for query in QUERIES:
+            indexed, count = timed(query, args.repeat)
+            scan = '-'
+            if not args.skip_scan:
+                search._has_index = False
+                try:
+                    scan = '%.1f' % (timed(query, 1)[0] * 1000)
+                finally:
+                    search._has_index = True
+            print('%-14s %8d %12.1f %12s' % (query, count, indexed * 1000, scan))
+
+
+if __name__ == '__main__':
+    main()
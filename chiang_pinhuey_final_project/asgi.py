@@ -0,0 +1,17 @@
+"""
+ASGI config for chiang_pinhuey_final_project project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+for servers such as uvicorn or daphne. Django 2.2 handles requests
+synchronously, so the WSGI application is adapted with asgiref and every
+request runs on a thread of the server's executor.
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chiang_pinhuey_final_project.settings')
+
+application = WsgiToAsgi(get_wsgi_application())
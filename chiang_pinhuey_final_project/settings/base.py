@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +57,8 @@ ROOT_URLCONF = 'chiang_pinhuey_final_project.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [os.path.join(BASE_DIR, 'app/../../app/templates')],
+        # app/templates is found through APP_DIRS
+        'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -64,6 +66,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'app.context_processors.unread_notifications',
             ],
         },
     },
@@ -79,10 +82,69 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, '../db.sqlite3'),
+        # a file rather than the shared in-memory database, whose table locks fail
+        # the threaded tests of app.tests at once instead of waiting like a real one
+        'TEST': {'NAME': os.path.join(BASE_DIR, '../test_db.sqlite3')},
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'wallet',
+    }
+}
+
+
+# Threads used to run the independent queries of a page at the same time
+# (app.utils.run_concurrently); below 2 they run one after another. Their
+# database connections are kept for CONCURRENT_QUERY_CONN_MAX_AGE seconds.
+# Against the SQLite file a query has no network round trip to overlap, and
+# benchmarks/load_test.py measures no gain, only a longer p99; try 4 with a
+# database server.
+
+CONCURRENT_QUERY_WORKERS = 0
+CONCURRENT_QUERY_CONN_MAX_AGE = 600
+
+
+# Request profiling (app.profiling): how many recent requests each process keeps,
+# and from how many milliseconds on a request has its stack sampled every
+# PROFILING_SAMPLE_INTERVAL seconds; None turns the sampling off
+
+PROFILING_BUFFER_SIZE = 10000
+PROFILING_SLOW_MS = 500
+PROFILING_SAMPLE_INTERVAL = 0.01
+
+# PBKDF2 iterations for the passwords of bulk imported users (app.registration);
+# None uses the full default cost. Fewer make imports faster, and each password is
+# hashed again with the full cost when its user first logs in.
+
+IMPORT_PASSWORD_ITERATIONS = None
+
+# Compile every template of the app when the process starts (app.template_cache),
+# for the cached template loader of production.py
+
+TEMPLATE_PRECOMPILE = False
+
+# Queued jobs (app.jobs) are run by a manage.py run_jobs worker next to the web
+# processes (see README.md). Without one, set it to True to have each request run the
+# jobs it queued once its transaction commits, at the cost of its response time.
+
+JOBS_EAGER = False
+
+# Pub/sub behind the live event stream (app.events). LocalBackend only reaches the
+# streams of the process that published; app.events.SQLiteBackend, with
+# 'OPTIONS': {'path': ...}, shares events between the processes of one host.
+
+EVENTS_BACKEND = {
+    'BACKEND': 'app.events.LocalBackend',
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -2,4 +2,11 @@ from .base import *
 
 DEBUG = False
 
-ALLOWED_HOSTS = ['localhost', '127.0.0.1', 'gillianchiang.pythonanywhere.com']
\ No newline at end of file
+ALLOWED_HOSTS = ['localhost', '127.0.0.1', 'gillianchiang.pythonanywhere.com']
+
+# Templates are compiled once, when the process starts, and kept for its lifetime
+TEMPLATES[0]['APP_DIRS'] = False
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', ['django.template.loaders.app_directories.Loader']),
+]
+TEMPLATE_PRECOMPILE = True